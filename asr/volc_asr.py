@@ -6,10 +6,11 @@ from asr.volc_asr_client import VolcAsrClient
 from utility.mlogging import logger
 
 class VolcASR(VolcAsrClient):
-    def __init__(self, config: dict):
+    def __init__(self, config: dict, ping_interval=0):
         """
         Args:
             config: asr配置参数
+            ping_interval: 连接健康检测间隔(s), 由连接池配置
         """
         self.config = config
         volc_config = config['volc']
@@ -38,7 +39,10 @@ class VolcASR(VolcAsrClient):
             samplerate = common_config['audio']['samplerate'],
             channels = common_config['audio']['channels'],
             sampwidth = common_config['audio']['sampwidth'],
-            codec = common_config['audio']['codec']
+            codec = common_config['audio']['codec'],
+            ping_interval = ping_interval,
+            compression_level = volc_config.get('compression_level', 1),
+            codec_workers = volc_config.get('codec_workers', 2)
         )
 
         logger.info('asr client initialize.')
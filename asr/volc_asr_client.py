@@ -14,6 +14,7 @@ from tornado.httpclient import HTTPRequest
 from collections import deque
 from utility.mlogging import logger
 from common.ws_client import WsClient
+from common.codec_pool import CodecLane, compress, INLINE_MAX_BYTES
 from common.ws_enum_types import WsEnumTypes 
 
 
@@ -80,20 +81,22 @@ def generate_header( version=PROTOCOL_VERSION,
     return header
 
 
-def generate_full_default_header():
-    return generate_header()
+def generate_full_default_header(compression_type=GZIP):
+    return generate_header(compression_type=compression_type)
 
 
-def generate_audio_default_header():
+def generate_audio_default_header(compression_type=GZIP):
     return generate_header(
-        message_type=CLIENT_AUDIO_ONLY_REQUEST
+        message_type=CLIENT_AUDIO_ONLY_REQUEST,
+        compression_type=compression_type
     )
 
 
-def generate_last_audio_default_header():
+def generate_last_audio_default_header(compression_type=GZIP):
     return generate_header(
         message_type=CLIENT_AUDIO_ONLY_REQUEST,
-        message_type_specific_flags=NEG_SEQUENCE
+        message_type_specific_flags=NEG_SEQUENCE,
+        compression_type=compression_type
     )
 
 
@@ -185,13 +188,23 @@ class VolcAsrClient:
         # 关于连接建立:
         # SDK说明，多次合成需要建立多次连接，但有时连接通道建立较慢,非常影响整体效果。
         # 实测: 单次连接也可以多次合成，但服务器可能会主动关闭连接
-        # TODO: 加入空闲检测机制，空闲自动断开连接, 在收到合成请求(预请求)后及时重连
+        # 空闲检测、预连接及断开重连由连接池(common.ws_pool.WsClientPool)实现
         # self.ws = create_connection(self.api_url, header=ws_header, timeout=600)
         # header = {"Authorization": f"Bearer; {self.token}"}
 
         header = {'Authorization': 'Bearer; {}'.format(self.token)}
         request = HTTPRequest(url=self.api_url, headers=header)
-        self._ws = WsClient(request)
+        # 连接健康检测间隔(s)
+        self.ping_interval = kwargs.get("ping_interval", 0)
+        self._ws = WsClient(request, ping_interval=self.ping_interval)
+
+        # 请求压缩等级 1-9, 0不压缩(如局域网部署)
+        self.compression_level = int(kwargs.get("compression_level", 1))
+        self._compression_type = GZIP if self.compression_level > 0 else NO_COMPRESSION
+        # 请求编码及响应解码在共享线程池中执行, 按顺序发送请求及读取响应
+        codec_workers = int(kwargs.get("codec_workers", 2))
+        self._send_lane = CodecLane(codec_workers)
+        self._receive_lane = CodecLane(codec_workers)
 
         # 创建ws子线程
         self._ws_thread = threading.Thread(target=self._ws.run, args=())
@@ -275,21 +288,23 @@ class VolcAsrClient:
             'reqid': '691440b6-16ae-4aea-b67f-fdc333b060b5', 'sequence': 1}, 'payload_size': 157}
         """
         reqid = str(uuid.uuid4())
-        # 构建 full client request，并序列化压缩
+        # 构建 full client request，并序列化压缩(数据量小, 在调用线程执行)
         request_params = self.construct_request(reqid)
-        payload_bytes = str.encode(json.dumps(request_params))
-        payload_bytes = gzip.compress(payload_bytes)
+        # 发送首次请求信息      
+        self._send_lane.submit(self._pack_full_request, request_params, callback=self._ws.auto_send, offload=False)
+        logger.debug('asr full_request send.')
 
-        full_client_request = bytearray(generate_full_default_header())
+
+    def _pack_full_request(self, request_params: dict):
+        """序列化并压缩起始请求
+        """
+        payload_bytes = compress(str.encode(json.dumps(request_params)), self.compression_level)
+
+        full_client_request = bytearray(generate_full_default_header(self._compression_type))
         full_client_request.extend((len(payload_bytes)).to_bytes(4, 'big'))  # payload size(4 bytes)
         full_client_request.extend(payload_bytes)  # payload
         # 转为bytes发送
-        full_client_request = bytes(full_client_request)
-
-        # print(full_client_request)
-        # 发送首次请求信息      
-        self._ws.auto_send(full_client_request)
-        logger.debug('asr full_request send.')
+        return bytes(full_client_request)
 
 
     def execute_audio_req(self, audio_bytes: bytes, end_seq = False):
@@ -300,23 +315,28 @@ class VolcAsrClient:
 
         请求成功响应如下:
         """
+        # 发送 audio-only client request, 较大的音频在线程池中压缩, 压缩完成后按顺序发送
+        offload = self.compression_level > 0 and len(audio_bytes) > INLINE_MAX_BYTES
+        self._send_lane.submit(self._pack_audio_request, audio_bytes, end_seq, callback=self._ws.auto_send, offload=offload)
+        logger.debug('asr audio_only_request send.')
+
+
+    def _pack_audio_request(self, audio_bytes: bytes, end_seq: bool):
+        """压缩并打包音频请求
+        """
         ## 数据压缩
-        payload_bytes = gzip.compress(audio_bytes)
+        payload_bytes = compress(audio_bytes, self.compression_level)
 
         if end_seq:
-            audio_only_request = bytearray(generate_last_audio_default_header())
+            audio_only_request = bytearray(generate_last_audio_default_header(self._compression_type))
         else:
-            audio_only_request = bytearray(generate_audio_default_header())
+            audio_only_request = bytearray(generate_audio_default_header(self._compression_type))
 
         audio_only_request.extend((len(payload_bytes)).to_bytes(4, 'big'))  # payload size(4 bytes)
         audio_only_request.extend(payload_bytes)  # payload
 
         # 转为bytes发送
-        audio_only_request = bytes(audio_only_request)
-
-        # 发送 audio-only client request
-        self._ws.auto_send(audio_only_request)
-        logger.debug('asr audio_only_request send.')
+        return bytes(audio_only_request)
 
 
     def get_result(self):
@@ -343,9 +363,18 @@ class VolcAsrClient:
                 'result': { 'text': '识别结果', 'confidence': '置信度,保留字段,暂时为0'  }
                 } 
         """
-        res = self._ws.auto_read()
-        if res is None:
+        ## 接收到的消息按顺序提交解码, 压缩的较大响应在线程池中解压及json解析
+        while True:
+            res = self._ws.auto_read()
+            if res is None:
+                break
+            offload = res['status'] == WsEnumTypes.STATUS_MSG_OK and (res['msg'][2] & 0x0f) == GZIP \
+                and len(res['msg']) > INLINE_MAX_BYTES
+            self._receive_lane.submit(self._parse_message, res, offload=offload)
+        ready, item = self._receive_lane.get()
+        if not ready:
             return None
+        res, msg = item
 
         result = {}
         result['result'] = None
@@ -358,7 +387,6 @@ class VolcAsrClient:
             result['status'] = "CONNECTED"
             return result
         elif res['status'] == WsEnumTypes.STATUS_MSG_OK:
-            msg = parse_response(res['msg'])
             msg = msg['payload_msg']
             code = msg['code']
             if code == 1000: # 请求成功
@@ -381,15 +409,61 @@ class VolcAsrClient:
         return None
 
 
+    @staticmethod
+    def _parse_message(res: dict):
+        """解码响应消息
+        Returns:
+            (res, 解码结果)
+        """
+        if res['status'] != WsEnumTypes.STATUS_MSG_OK:
+            return res, None
+        return res, parse_response(res['msg'])
+
+
     def auto_connect(self):
-        """客户端自动连接
+        """客户端自动连接, 丢弃上一连接未输出的编解码结果
         Returns:
         """
+        self._clear_lanes()
         self._ws.auto_connect()
 
 
     def connect_close(self):
-        """ws关闭连接
+        """ws关闭连接, 丢弃未输出的编解码结果(连接池复用时不串到下一任务)
         """
+        self._clear_lanes()
         self._ws.connect_close()
 
+
+    def _clear_lanes(self):
+        """丢弃未发送的请求及未读取的响应
+        """
+        self._send_lane.clear()
+        self._receive_lane.clear()
+
+
+    def set_receive_notify(self, callback):
+        """设置接收通知, 收到响应及线程池解码完成时调用
+        Args:
+            callback  无参数回调, 在ws线程或编解码线程中执行
+        """
+        self._ws.set_receive_notify(callback)
+        self._receive_lane.set_notify(callback)
+
+
+    def is_connected(self):
+        """ws是否已连接
+        """
+        return self._ws.is_connected()
+
+
+    def is_connecting(self):
+        """ws是否正在连接
+        """
+        return self._ws.is_connecting()
+
+
+    def idle_time(self):
+        """ws连接空闲时长(s)
+        """
+        return self._ws.idle_time()
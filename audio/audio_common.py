@@ -1,13 +1,23 @@
 # coding=utf-8
 """音频处理通用功能
+PCM(16bit有符号, 小端)处理使用NumPy向量化计算, 输入可为bytes/bytearray/memoryview或np.ndarray,
+bytes类输入通过np.frombuffer直接映射, 不复制数据。
 """
 from typing import Union
+from functools import lru_cache
 import wave
 import array
-import struct
+
+import numpy as np
+
 from utility.mlogging import logger
 
 
+# 16bit采样最大值
+SAMPLE_MAX = 32767
+SAMPLE_MIN = -32768
+
+
 def readWav(file_path: str):
     """
     打开 WAV 文件,并读取相应的数据
@@ -64,32 +74,189 @@ def listToPcmBytes(pcm_data: list) -> bytes:
     return pcm_array.tobytes()
 
 
-def saveWav(file_path, audio_data: Union[list, bytes], samplerate: int, channels=1, sampwidth=2):
+def pcmToArray(pcm: Union[bytes, bytearray, memoryview, np.ndarray]) -> np.ndarray:
+    """PCM数据映射为int16数组(不复制数据)
+    Args:
+        pcm  PCM数据(16bit), 或np.ndarray
+    Returns:
+        np.ndarray(int16), bytes输入时为只读
+    """
+    if isinstance(pcm, np.ndarray):
+        return pcm
+    return np.frombuffer(pcm, dtype='<i2')
+
+
+def arrayToPcm(samples: np.ndarray) -> bytes:
+    """采样数组转换为PCM数据, 超出16bit范围的采样截断
+    Args:
+        samples  采样数组(整数或浮点)
+    Returns:
+        pcm_bytes bytes
+    """
+    if samples.dtype != np.int16:
+        samples = np.clip(np.rint(samples), SAMPLE_MIN, SAMPLE_MAX).astype('<i2')
+    return samples.tobytes()
+
+
+@lru_cache(maxsize=16)
+def _lowpass_kernel(src_rate: int, dst_rate: int, taps=31):
+    """降采样抗混叠低通滤波器(汉明窗sinc), 截止频率为目标采样率奈奎斯特频率的0.9倍
+    """
+    cutoff = 0.45 * dst_rate / src_rate
+    n = np.arange(taps) - (taps - 1) / 2
+    kernel = 2 * cutoff * np.sinc(2 * cutoff * n) * np.hamming(taps)
+    return (kernel / kernel.sum()).astype(np.float32)
+
+
+def resample(pcm, src_rate: int, dst_rate: int) -> bytes:
+    """重采样(单声道), 支持8k/16k/24k等任意采样率转换
+    整数倍降采样时先按倍数求平均(抗混叠), 非整数倍降采样(如24k->16k)先低通滤波再线性插值, 升采样线性插值
+    Args:
+        pcm       PCM数据
+        src_rate  原采样率
+        dst_rate  目标采样率
+    Returns:
+        pcm_bytes bytes
+    """
+    samples = pcmToArray(pcm)
+    if src_rate == dst_rate or len(samples) == 0:
+        return arrayToPcm(samples)
+    if src_rate > dst_rate and src_rate % dst_rate == 0:
+        ratio = src_rate // dst_rate
+        length = len(samples) // ratio * ratio
+        return arrayToPcm(samples[:length].reshape(-1, ratio).mean(axis=1, dtype=np.float32))
+    samples = samples.astype(np.float32)
+    if src_rate > dst_rate:
+        samples = np.convolve(samples, _lowpass_kernel(src_rate, dst_rate), mode='same')
+    length = int(len(samples) * dst_rate / src_rate)
+    positions = np.arange(length, dtype=np.float64) * (src_rate / dst_rate)
+    return arrayToPcm(np.interp(positions, np.arange(len(samples)), samples))
+
+
+def applyGain(pcm, gain_db: float) -> bytes:
+    """调整音量
+    Args:
+        pcm      PCM数据
+        gain_db  增益(dB)
+    Returns:
+        pcm_bytes bytes
+    """
+    return arrayToPcm(pcmToArray(pcm).astype(np.float32) * (10 ** (gain_db / 20)))
+
+
+def normalize(pcm, peak_db=-1.0) -> bytes:
+    """峰值归一化
+    Args:
+        pcm      PCM数据
+        peak_db  归一化后的峰值(dBFS)
+    Returns:
+        pcm_bytes bytes, 静音数据原样返回
+    """
+    current = peak(pcm)
+    if current == 0:
+        return arrayToPcm(pcmToArray(pcm))
+    return arrayToPcm(pcmToArray(pcm).astype(np.float32) * (SAMPLE_MAX * 10 ** (peak_db / 20) / current))
+
+
+def mix(pcm_list: list, weights=None) -> bytes:
+    """混音, 长度不同时按最长的音频补零
+    Args:
+        pcm_list  PCM数据列表
+        weights   各音频权重, None时均为1
+    Returns:
+        pcm_bytes bytes
+    """
+    arrays = [pcmToArray(pcm) for pcm in pcm_list]
+    if len(arrays) == 0:
+        return b''
+    output = np.zeros(max(len(samples) for samples in arrays), dtype=np.float32)
+    for i, samples in enumerate(arrays):
+        output[:len(samples)] += samples * (1.0 if weights is None else weights[i])
+    return arrayToPcm(output)
+
+
+def rms(pcm, frame_samples=None):
+    """均方根能量
+    Args:
+        pcm            PCM数据
+        frame_samples  每帧采样点数, None计算整段
+    Returns:
+        float, 或各帧能量(np.ndarray, 不足一帧的数据忽略)
+    """
+    samples = pcmToArray(pcm)
+    if frame_samples is None:
+        return float(np.sqrt(np.mean(np.square(samples, dtype=np.float32)))) if len(samples) > 0 else 0.0
+    samples = samples[:len(samples) // frame_samples * frame_samples].reshape(-1, frame_samples)
+    return np.sqrt(np.mean(np.square(samples, dtype=np.float32), axis=1))
+
+
+def peak(pcm) -> int:
+    """峰值(采样绝对值最大值)
+    """
+    samples = pcmToArray(pcm)
+    if len(samples) == 0:
+        return 0
+    return int(max(int(samples.max()), -int(samples.min())))
+
+
+def toDb(value: float) -> float:
+    """采样幅值转换为dBFS
+    """
+    return 20 * np.log10(max(value, 1e-9) / SAMPLE_MAX)
+
+
+def saveWav(file_path, audio_data: Union[list, bytes, bytearray, memoryview, np.ndarray], samplerate: int, channels=1, sampwidth=2):
     """写入PCM音频数据到.wav文件
     Args:
         file_path  文件路径
-        audio_data    音频采样数据，16位有符号整数列表或者bytes
+        audio_data    音频采样数据，16位有符号整数列表, PCM数据(bytes/bytearray/memoryview)或np.ndarray
         samplerate    采样率
         channels      音频通道数, 默认:1
         sampwidth     音频数据位宽 默认:2--16bit
     """
-    samples = []
     if isinstance(audio_data, list):
-        samples = audio_data
-    elif isinstance(audio_data, bytes):
-        samples = pcmBytesToList(audio_data)
-    else:
+        audio_data = np.asarray(audio_data, dtype='<i2')
+    if isinstance(audio_data, np.ndarray):
+        audio_data = arrayToPcm(audio_data)
+    elif not isinstance(audio_data, (bytes, bytearray, memoryview)):
         logger.error('invalid audio data.')
-        return  
-    samples_number = len(samples)
-    save_samples = []
-    ## 确保数据转成16位有符号整型
-    for sample in samples:
-        save_samples.append(struct.pack('<h', sample))
+        return
 
     with wave.open(file_path, 'w') as wave_file:
         logger.debug('save wav audio to: {}'.format(file_path))
-        wave_file.setparams((channels, sampwidth, int(samplerate), samples_number, 'NONE', 'not compressed'))
-        wave_file.writeframes(b''.join(save_samples))
-        wave_file.close()
+        wave_file.setparams((channels, sampwidth, int(samplerate), 0, 'NONE', 'not compressed'))
+        ## PCM数据直接写入, 不逐采样转换
+        wave_file.writeframes(audio_data)
+
+
+if __name__=='__main__':
+    # 性能测试: 10s 16kHz音频保存为wav, 与逐采样点struct.pack对比
+    import os
+    import struct
+    import tempfile
+    import timeit
+
+    rng = np.random.default_rng(0)
+    pcm = rng.integers(-3000, 3000, 16000 * 10, dtype=np.int16).tobytes()
+    file_path = os.path.join(tempfile.gettempdir(), 'audio_common_test.wav')
+
+    def save_wav_struct(file_path, audio_data, samplerate):
+        samples = pcmBytesToList(audio_data)
+        with wave.open(file_path, 'w') as wave_file:
+            wave_file.setparams((1, 2, samplerate, len(samples), 'NONE', 'not compressed'))
+            wave_file.writeframes(b''.join(struct.pack('<h', sample) for sample in samples))
+
+    number = 5
+    struct_t = timeit.timeit(lambda: save_wav_struct(file_path, pcm, 16000), number=number) / number
+    numpy_t = timeit.timeit(lambda: saveWav(file_path, pcm, 16000), number=number) / number
+    print('save 10s wav, struct: {:.2f} ms  numpy: {:.2f} ms'.format(struct_t * 1e3, numpy_t * 1e3))
+    assert readWav(file_path)['frames'] == pcm
+
+    for src_rate, dst_rate in [(16000, 8000), (24000, 16000), (8000, 16000), (16000, 24000)]:
+        t = timeit.timeit(lambda: resample(pcm, src_rate, dst_rate), number=number) / number
+        print('resample {} -> {}: {:.2f} ms, {} -> {} bytes'.format(src_rate, dst_rate, t * 1e3,
+            len(pcm), len(resample(pcm, src_rate, dst_rate))))
+    print('rms: {:.1f} peak: {} normalized peak: {:.2f} dBFS mix peak: {}'.format(rms(pcm), peak(pcm),
+        toDb(peak(normalize(pcm))), peak(mix([pcm, applyGain(pcm, -6)]))))
+    os.remove(file_path)
 
@@ -1,15 +1,91 @@
 # Opus音频解码
+import ctypes
+from collections import OrderedDict
+
 import opuslib
+import opuslib.api
 import opuslib.api.encoder
 import opuslib.api.decoder
 
 
 class OpusDecoder():
-    def __init__(self, samplerate: int, channels: int, seq_time: float) -> None:
+    """opus解码, 解码结果写入预分配的缓冲区
+    Note:
+        opus解码有状态, 每路音频流使用独立的解码器
+    """
+    def __init__(self, samplerate: int, channels: int, seq_time: float, max_packets=50) -> None:
+        """
+        Args:
+            samplerate   采样率
+            channels     通道数
+            seq_time     单个包时长(s)
+            max_packets  批量解码包数, 决定预分配缓冲区大小(超出时扩大)
+        """
         self.samplerate = samplerate
+        self.channels = channels
         # 创建解码器
         self.decoder = opuslib.Decoder(fs=self.samplerate, channels=channels)
+        # 单个包采样点数(每通道), 丢包补偿时按该长度生成
+        self.frame_size = int(seq_time*self.samplerate)
+        # 单次解码最大采样点数(每通道), 允许包时长最多为seq_time的2倍
         self.seq_length = int(seq_time*self.samplerate*2)
+        self._alloc(max_packets)
+
+
+    def _alloc(self, max_packets: int):
+        """分配解码输出缓冲区
+        """
+        self._max_packets = max_packets
+        self._out = (ctypes.c_int16 * (self.seq_length * self.channels * max_packets))()
+        self._out_address = ctypes.addressof(self._out)
+        self._out_view = memoryview(self._out).cast('B')
+
+
+    def reset(self):
+        """重置解码器状态, 用于新的音频流
+        """
+        self.decoder.reset_state()
+
+
+    def _decode_into(self, data, frame_size: int, fec: bool, offset: int):
+        """解码一个包到输出缓冲区
+        Args:
+            data        opus包, None为丢包补偿(PLC)
+            frame_size  最大采样点数(每通道), PLC及FEC时为丢失的采样点数
+            fec         是否使用该包携带的前向纠错数据恢复上一个包
+            offset      输出缓冲区偏移(字节)
+        Returns:
+            解码数据长度(字节)
+        """
+        pcm_pointer = ctypes.cast(self._out_address + offset, opuslib.api.c_int16_pointer)
+        result = opuslib.api.decoder.libopus_decode(self.decoder.decoder_state, data,
+            0 if data is None else len(data), pcm_pointer, frame_size, int(fec))
+        if result < 0:
+            raise opuslib.exceptions.OpusError(result)
+        return result * self.channels * 2
+
+
+    def decode_batch(self, packets: list):
+        """批量解码
+        Args:
+            packets  opus包列表, 丢失的包为None: 后一个包存在时使用其FEC数据恢复, 否则进行丢包补偿(PLC)
+        Returns:
+            memoryview 解码结果, 指向解码器内部缓冲区, 下次解码前有效
+        """
+        if len(packets) > self._max_packets:
+            self._alloc(len(packets))
+        offset = 0
+        for i, packet in enumerate(packets):
+            if packet is not None:
+                if not isinstance(packet, bytes):
+                    packet = bytes(packet)
+                offset += self._decode_into(packet, self.seq_length, False, offset)
+            elif i + 1 < len(packets) and packets[i + 1] is not None:
+                offset += self._decode_into(bytes(packets[i + 1]), self.frame_size, True, offset)
+            else:
+                offset += self._decode_into(None, self.frame_size, False, offset)
+        return self._out_view[:offset]
+
 
     def decode(self, input_bytes: bytes):
         """解码测试
@@ -20,7 +96,49 @@ class OpusDecoder():
         Returns:
             dec_output 解码结果
         """
-        # 直接解码opus数据
-        dec_output = self.decoder.decode(bytes(input_bytes), self.seq_length)
-        # print('decode seq len: {}'.format(len(dec_output))) 
-        return dec_output
+        return bytes(self.decode_batch([input_bytes]))
+
+
+class OpusDecoderPool():
+    """opus解码器池, 按音频流分配解码器, 流结束后重置并复用
+    Note:
+        非线程安全, 只在单个线程中使用
+    """
+    def __init__(self, samplerate: int, channels: int, seq_time: float, max_idle=8):
+        """
+        Args:
+            samplerate  采样率
+            channels    通道数
+            seq_time    单个包时长(s)
+            max_idle    保留的空闲解码器数
+        """
+        self.samplerate = samplerate
+        self.channels = channels
+        self.seq_time = seq_time
+        self.max_idle = max_idle
+        # 音频流key: OpusDecoder
+        self.decoders = OrderedDict()
+        self._idle = []
+
+
+    def acquire(self, key):
+        """获取音频流的解码器, 没有时复用空闲解码器或新建
+        Args:
+            key  音频流标识, 如(dev_id, chat_id)
+        """
+        decoder = self.decoders.get(key, None)
+        if decoder is None:
+            decoder = self._idle.pop() if len(self._idle) > 0 else \
+                OpusDecoder(self.samplerate, self.channels, self.seq_time)
+            self.decoders[key] = decoder
+        return decoder
+
+
+    def release(self, key):
+        """音频流结束, 重置解码器放回空闲列表
+        """
+        decoder = self.decoders.pop(key, None)
+        if decoder is None or len(self._idle) >= self.max_idle:
+            return
+        decoder.reset()
+        self._idle.append(decoder)
@@ -0,0 +1,125 @@
+# Opus音频编码
+from collections import deque
+
+import opuslib
+
+from common.frame_buffer import FrameBuffer
+
+
+# 设备帧中每个opus包的长度前缀字节数(大端)
+PACKET_LENGTH_BYTES = 2
+
+
+class OpusEncoder():
+    """opus编码, 输入任意长度的PCM数据, 按包时长输出opus包
+    Note:
+        opus编码有状态, 每路音频流使用独立的编码器
+    """
+    def __init__(self, samplerate: int, channels: int, seq_time: float, bitrate=24000, complexity=5,
+            application='voip') -> None:
+        """
+        Args:
+            samplerate   采样率(8000/12000/16000/24000/48000)
+            channels     通道数
+            seq_time     单个包时长(s), 2.5/5/10/20/40/60ms
+            bitrate      码率(bps)
+            complexity   编码复杂度 0-10
+            application  voip / audio / restricted_lowdelay
+        """
+        self.samplerate = samplerate
+        self.channels = channels
+        # 创建编码器
+        self.encoder = opuslib.Encoder(fs=samplerate, channels=channels, application=application)
+        self.encoder.bitrate = bitrate
+        self.encoder.complexity = complexity
+        # 单个包采样点数(每通道)及PCM字节数
+        self.frame_size = int(seq_time*samplerate)
+        self.seq_length = self.frame_size*channels*2
+        # 不足一个包的PCM数据
+        self._pcm_buff = FrameBuffer()
+
+
+    def reset(self):
+        """重置编码器状态及缓冲数据, 用于新的音频流
+        """
+        self.encoder.reset_state()
+        self._pcm_buff.clear()
+
+
+    def encode(self, pcm: bytes, flush=False):
+        """编码PCM数据
+        Args:
+            pcm    PCM数据(16bit)
+            flush  是否编码剩余不足一个包的数据(补静音), 音频流结束时使用
+        Returns:
+            [bytes] opus包列表
+        """
+        self._pcm_buff.write(pcm)
+        frames = self._pcm_buff.frames(self.seq_length, flush=flush)
+        if flush and len(frames) > 0 and len(frames[-1]) < self.seq_length:
+            frames[-1] = frames[-1] + bytes(self.seq_length - len(frames[-1]))
+        return [self.encoder.encode(frame, self.frame_size) for frame in frames]
+
+
+class OpusFrameBuffer():
+    """PCM编码为opus后按设备帧打包, 接口与tts_pipeline.SegmentFrameBuffer相同(write/frames/clear)
+    设备帧由若干完整的opus包组成, 每个包前加2字节长度(大端), 设备按长度拆分后逐包解码
+    Note:
+        同一设备的各片段使用同一个实例, 编码器状态连续, 只在音频流结束时补静音
+    """
+    def __init__(self, encoder: OpusEncoder):
+        """
+        Args:
+            encoder  opus编码器
+        """
+        self.encoder = encoder
+        # 已编码未打包的opus包
+        self._packets = deque()
+
+
+    def write(self, pcm):
+        """写入PCM数据, 完整的包立即编码
+        """
+        self._packets.extend(self.encoder.encode(pcm))
+
+
+    def frames(self, frame_length: int, flush=False, end=False):
+        """读取打包好的设备帧
+        Args:
+            frame_length  设备帧长上限
+            flush         片段结束, 打包全部已编码的包(不足一个包的PCM留给下一片段)
+            end           音频流结束, 剩余PCM补静音编码后打包, 并重置编码器
+        Returns:
+            [bytes] 帧列表
+        """
+        if end:
+            self._packets.extend(self.encoder.encode(b'', flush=True))
+            flush = True
+        frames = []
+        while len(self._packets) > 0:
+            size = 0
+            count = 0
+            for packet in self._packets:
+                if size + PACKET_LENGTH_BYTES + len(packet) > frame_length:
+                    break
+                size += PACKET_LENGTH_BYTES + len(packet)
+                count += 1
+            # 帧未装满时等待后续的包
+            if count == len(self._packets) and not flush:
+                break
+            frame = bytearray()
+            for _ in range(max(count, 1)):
+                packet = self._packets.popleft()
+                frame += len(packet).to_bytes(PACKET_LENGTH_BYTES, 'big')
+                frame += packet
+            frames.append(bytes(frame))
+        if end:
+            self.encoder.reset()
+        return frames
+
+
+    def clear(self):
+        """清空缓冲数据并重置编码器
+        """
+        self._packets.clear()
+        self.encoder.reset()
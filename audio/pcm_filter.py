@@ -0,0 +1,110 @@
+# coding=utf-8
+"""合成音频后处理
+对tts合成的PCM音频(16bit单声道)按片段处理, 使用audio_common的向量化计算。
+1. 去除片段开头的静音(只保留keep_time), 减少首个音频帧的等待时间
+2. 音量调整(dB)
+"""
+import numpy as np
+
+import audio.audio_common as ac
+
+
+class PcmPostProcessor():
+    """PCM音频后处理, 输入任意长度的音频数据
+    Note:
+        有状态(开头静音检测及不足一个采样的数据), 每个合成片段使用独立的实例
+    """
+    def __init__(self, samplerate: int, gain_db=0.0, trim_silence=False, silence_threshold=100,
+            keep_time=0.05, frame_time=0.01):
+        """
+        Args:
+            samplerate         采样率
+            gain_db            音量增益(dB), 0不调整
+            trim_silence       是否去除开头静音
+            silence_threshold  静音能量阈值(RMS, 16bit采样值)
+            keep_time          保留的开头静音时长(s)
+            frame_time         静音检测帧时长(s)
+        """
+        self.gain_db = gain_db
+        self.trim_silence = trim_silence
+        self.silence_threshold = silence_threshold
+        self.frame_samples = max(1, int(samplerate * frame_time))
+        self.frame_length = self.frame_samples * 2
+        self.keep_length = int(samplerate * keep_time) * 2
+        self.reset()
+
+
+    @classmethod
+    def from_config(cls, samplerate: int, config: dict):
+        """根据配置创建
+        Args:
+            config  {'gain_db':, 'trim_silence':, 'silence_threshold':, 'keep_time': }
+        """
+        keys = ('gain_db', 'trim_silence', 'silence_threshold', 'keep_time')
+        return cls(samplerate, **{key: config[key] for key in keys if key in config})
+
+
+    def reset(self):
+        """重置状态, 用于新的片段
+        """
+        self._trimming = self.trim_silence
+        # 已去除的开头静音(最多keep_length)
+        self._silence = b''
+        # 不足一个采样的数据
+        self._carry = b''
+
+
+    def _trim(self, data: bytes):
+        """去除开头静音, 检测到语音后不再处理
+        """
+        voiced = np.flatnonzero(ac.rms(data, self.frame_samples) >= self.silence_threshold)
+        if len(voiced) == 0:
+            self._silence = (self._silence + data)[-self.keep_length:] if self.keep_length > 0 else b''
+            return b''
+        start = int(voiced[0]) * self.frame_length
+        silence = (self._silence + data[:start])[-self.keep_length:] if self.keep_length > 0 else b''
+        self._trimming = False
+        self._silence = b''
+        return silence + data[start:]
+
+
+    def process(self, pcm: bytes):
+        """处理一段音频
+        Args:
+            pcm  PCM数据(16bit单声道)
+        Returns:
+            bytes 处理后的音频, 开头静音时为空
+        """
+        data = self._carry + bytes(pcm)
+        length = len(data) // 2 * 2
+        self._carry = data[length:]
+        data = data[:length]
+        if self._trimming:
+            data = self._trim(data)
+        if self.gain_db != 0 and len(data) > 0:
+            data = ac.applyGain(data, self.gain_db)
+        return data
+
+
+if __name__=='__main__':
+    # 性能测试: 3s 16kHz合成音频(开头0.3s静音)按40ms块处理
+    import math
+    import timeit
+
+    samplerate = 16000
+    rng = np.random.default_rng(0)
+    t = np.arange(samplerate * 3) / samplerate
+    audio = (3000 * np.sin(2 * math.pi * 220 * t)).astype(np.int16)
+    audio[:int(samplerate * 0.3)] = rng.normal(0, 20, int(samplerate * 0.3)).astype(np.int16)
+    pcm = audio.tobytes()
+    chunks = [pcm[i:i + 1280] for i in range(0, len(pcm), 1280)]
+
+    def run():
+        processor = PcmPostProcessor(samplerate, gain_db=-3, trim_silence=True)
+        return b''.join(processor.process(chunk) for chunk in chunks)
+
+    number = 10
+    t = timeit.timeit(run, number=number) / number
+    output = run()
+    print('process {:.1f}s audio: {:.2f} ms, trimmed {:.3f}s, peak {:.2f} dBFS'.format(len(audio) / samplerate,
+        t * 1e3, (len(pcm) - len(output)) / 2 / samplerate, ac.toDb(ac.peak(output))))
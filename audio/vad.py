@@ -0,0 +1,189 @@
+# coding=utf-8
+"""语音活动检测(VAD)
+按帧(默认20ms)计算短时能量(RMS)和过零率, 使用NumPy对一个音频片段的所有帧批量计算。
+1. 说话开始前: 只保留最近pre_roll_time的音频, 连续start_time为语音后开始输出(带上保留的音频)
+2. 说话过程中: 静音帧暂存, 再次出现语音时一并输出(保留句中停顿)
+3. 静音持续end_silence_time后判定说话结束, 只输出tail_time的尾部静音
+噪声电平按非语音帧自适应, 能量阈值取 max(energy_threshold, 噪声电平*noise_ratio)。
+"""
+from collections import deque
+
+import numpy as np
+
+import audio.audio_common as ac
+from common.frame_buffer import FrameBuffer
+
+
+def frame_features(pcm: bytes, frame_samples: int):
+    """计算各帧能量及过零率
+    Args:
+        pcm            音频数据(16bit单声道), 长度为帧长整数倍
+        frame_samples  每帧采样点数
+    Returns:
+        rms, zcr  各帧均方根能量及过零率(np.ndarray)
+    """
+    signs = np.signbit(ac.pcmToArray(pcm).reshape(-1, frame_samples))
+    zcr = np.count_nonzero(signs[:, 1:] != signs[:, :-1], axis=1) / (frame_samples - 1)
+    return ac.rms(pcm, frame_samples), zcr
+
+
+class VoiceActivityDetector():
+    """语音活动检测, 去除首尾静音并检测说话结束
+    Note:
+        非线程安全, 每路音频流一个实例
+    """
+    def __init__(self, samplerate: int, frame_time=0.02, energy_threshold=300, zcr_threshold=0.25,
+            noise_ratio=3.0, start_time=0.06, end_silence_time=0.8, pre_roll_time=0.3, tail_time=0.2):
+        """
+        Args:
+            samplerate        采样率(16bit单声道)
+            frame_time        帧时长(s)
+            energy_threshold  语音能量阈值(RMS, 16bit采样值)
+            zcr_threshold     过零率阈值, 能量不低于阈值一半且过零率超过该值时也判为语音(清辅音)
+            noise_ratio       自适应能量阈值与噪声电平的比例
+            start_time        判定说话开始的连续语音时长(s)
+            end_silence_time  判定说话结束的连续静音时长(s)
+            pre_roll_time     说话开始前保留的音频时长(s)
+            tail_time         说话结束后保留的静音时长(s)
+        """
+        self.frame_samples = int(samplerate * frame_time)
+        self.frame_length = self.frame_samples * 2
+        self.energy_threshold = energy_threshold
+        self.zcr_threshold = zcr_threshold
+        self.noise_ratio = noise_ratio
+        self.start_frames = max(1, round(start_time / frame_time))
+        self.end_frames = max(1, round(end_silence_time / frame_time))
+        self.tail_frames = min(self.end_frames, round(tail_time / frame_time))
+
+        # 不足一帧的数据
+        self._buff = FrameBuffer()
+        # 说话开始前保留的帧
+        self._pre_roll = deque(maxlen=max(self.start_frames, round(pre_roll_time / frame_time)))
+        # 说话过程中暂存的静音帧
+        self._silence = []
+        # 连续语音帧数(说话开始前)
+        self._voice_count = 0
+        # 噪声电平, 0为未估计
+        self.noise_level = 0.0
+
+        self.speech_start = False
+        self.speech_end = False
+
+
+    @classmethod
+    def from_config(cls, samplerate: int, config: dict):
+        """根据配置创建检测器
+        Args:
+            config  {'energy_threshold':, 'zcr_threshold':, 'noise_ratio':, 'start_time':,
+                     'end_silence_time':, 'pre_roll_time':, 'tail_time': }
+        """
+        keys = ('energy_threshold', 'zcr_threshold', 'noise_ratio', 'start_time',
+            'end_silence_time', 'pre_roll_time', 'tail_time')
+        return cls(samplerate, **{key: config[key] for key in keys if key in config})
+
+
+    def is_voice(self, rms: float, zcr: float):
+        """单帧是否为语音, 非语音帧更新噪声电平
+        """
+        threshold = max(self.energy_threshold, self.noise_level * self.noise_ratio)
+        voice = rms >= threshold or (rms >= threshold / 2 and zcr >= self.zcr_threshold)
+        if not voice:
+            self.noise_level = rms if self.noise_level == 0 else 0.95 * self.noise_level + 0.05 * rms
+        return voice
+
+
+    def process(self, pcm: bytes):
+        """处理一段音频
+        Args:
+            pcm  音频数据(16bit单声道)
+        Returns:
+            bytes  需要识别的音频(已去除首尾静音), 说话结束后返回空
+        """
+        if self.speech_end:
+            return b''
+        self._buff.write(pcm)
+        count = len(self._buff) // self.frame_length
+        if count == 0:
+            return b''
+        data = self._buff.read(count * self.frame_length)
+        rms, zcr = frame_features(data, self.frame_samples)
+
+        output = []
+        for i in range(count):
+            frame = data[i * self.frame_length:(i + 1) * self.frame_length]
+            voice = self.is_voice(float(rms[i]), float(zcr[i]))
+            if not self.speech_start:
+                self._pre_roll.append(frame)
+                self._voice_count = self._voice_count + 1 if voice else 0
+                if self._voice_count >= self.start_frames:
+                    self.speech_start = True
+                    output.extend(self._pre_roll)
+                    self._pre_roll.clear()
+            elif voice:
+                output.extend(self._silence)
+                self._silence.clear()
+                output.append(frame)
+            else:
+                self._silence.append(frame)
+                if len(self._silence) >= self.end_frames:
+                    output.extend(self._silence[:self.tail_frames])
+                    self._silence.clear()
+                    self.speech_end = True
+                    break
+        return b''.join(output)
+
+
+    def finish(self):
+        """音频流结束, 返回暂存的尾部静音(最多tail_time)
+        """
+        output = b''.join(self._silence[:self.tail_frames])
+        self._silence.clear()
+        self._buff.clear()
+        self.speech_end = True
+        return output
+
+
+if __name__=='__main__':
+    # 性能测试: 10s 16kHz音频按20ms包处理, 与逐采样点计算对比
+    import math
+    import timeit
+
+    samplerate = 16000
+    rng = np.random.default_rng(0)
+    t = np.arange(samplerate * 2) / samplerate
+    voice = (3000 * np.sin(2 * math.pi * 220 * t)).astype(np.int16)
+    noise = rng.normal(0, 50, samplerate * 4).astype(np.int16)
+    audio = np.concatenate([noise[:samplerate], voice, noise[samplerate:], voice, noise[:samplerate * 2]])
+    pcm = audio.tobytes()
+    packets = [pcm[i:i + 640] for i in range(0, len(pcm), 640)]
+
+    def python_features(frame: bytes):
+        samples = np.frombuffer(frame, dtype='<i2').tolist()
+        rms = math.sqrt(sum(s * s for s in samples) / len(samples))
+        zcr = sum(1 for a, b in zip(samples, samples[1:]) if (a < 0) != (b < 0)) / (len(samples) - 1)
+        return rms, zcr
+
+    def run_python():
+        for packet in packets:
+            python_features(packet)
+
+    def run_numpy(packet_count=1):
+        vad = VoiceActivityDetector(samplerate, end_silence_time=5)
+        size = 640 * packet_count
+        return b''.join(vad.process(pcm[i:i + size]) for i in range(0, len(pcm), size)) + vad.finish()
+
+    number = 5
+    python_t = timeit.timeit(run_python, number=number) / number
+    numpy_t = timeit.timeit(run_numpy, number=number) / number
+    batch_t = timeit.timeit(lambda: run_numpy(50), number=number) / number
+    print('{:.1f}s audio, python: {:.2f} ms  numpy per packet: {:.2f} ms  numpy per 1s: {:.2f} ms'.format(
+        len(audio) / samplerate, python_t * 1e3, numpy_t * 1e3, batch_t * 1e3))
+    print('voice bytes: {} / {}'.format(len(run_numpy()), len(pcm)))
+
+    # 说话结束检测
+    vad = VoiceActivityDetector(samplerate)
+    for i, packet in enumerate(packets):
+        vad.process(packet)
+        if vad.speech_end:
+            print('speech end at {:.2f}s'.format((i + 1) * 0.02))
+            break
@@ -2,10 +2,35 @@
 # https://cookbook.openai.com/examples/how_to_format_inputs_to_chatgpt_models
 
 import os
-from openai import OpenAI
+import asyncio
+from openai import OpenAI, AsyncOpenAI
 
 from utility.mlogging import logger
-from common.sentence_segmenter import SentenceSegmenter
+from common.segmenter import Segmenter
+from chat.session_store import SessionStore
+from chat.token_counter import TokenCounter
+from chat.response_cache import ResponseCache
+
+
+class ChatStreamState():
+    """单次流式回答的解码状态, 并发请求各自独立
+    """
+    def __init__(self, segmenter, dev_id=None, text=None, speculative=False):
+        self.segmenter = segmenter
+        # 所属设备, 回答保存到该设备的对话消息
+        self.dev_id = dev_id
+        # 用户文本及其向量, 回答完成后写入回答缓存
+        self.text = text
+        self.vector = None
+        # 上一轮回答, 计入回答缓存键
+        self.context = ''
+
+        self.full_answer = ""
+        self.answer_seq = 0
+        # 推测请求, 确认(commit_speculation)前不保存对话消息
+        self.speculative = speculative
+        # 回答结束原因, None未结束
+        self.finish_reason = None
 
 
 class OpenAIChat():
@@ -43,6 +68,8 @@ class OpenAIChat():
 
         # 创建gpt客户端
         self.client = OpenAI(api_key=api_key, base_url=base_url)
+        # 异步客户端, 用于并发流式请求
+        self.async_client = AsyncOpenAI(api_key=api_key, base_url=base_url)
 
         # 模型选择
         self.model = gpt_config['model']
@@ -54,13 +81,137 @@ class OpenAIChat():
         self.prompt_content = gpt_config['prompt']
         self.prompt = self.prompt_defalut(self.prompt_content)
 
-        self.chat_messages = []
+        # 回答缓存, 常见问题不请求大模型
+        self.cache = None
+        cache_config = common_config.get('response_cache', {})
+        if cache_config.get('enable', False):
+            self.cache = ResponseCache.from_config(self.model, self.prompt_content, cache_config)
+        self.embedding_model = cache_config.get('embedding', {}).get('model', 'text-embedding-3-small')
+        # 向量请求超时(s), 超时按未命中处理, 限制缓存未命中时增加的延迟
+        self.embedding_timeout = cache_config.get('embedding', {}).get('timeout', 0.3)
+
+        # 各设备对话状态(消息窗口,解码状态), LRU淘汰, 可选落盘
+        self.token_counter = TokenCounter(self.model)
+        self.sessions = SessionStore.from_config(self.token_counter, common_config.get('session_store', {}))
         # 消息条数最大值(不含prompt)
         self.chat_messages_windows_size_max = common_config['message_windows_size'] 
+        # 对话消息token数上限(不含prompt), 0不限制
+        self.context_token_budget = common_config.get('context_token_budget', 0)
 
-        self.full_answer = ""
-        self.answer_seq = 0
-        self.segmenter = SentenceSegmenter(common_config['response_segment']['min'], common_config['response_segment']['max'])
+        # 回答断句, 断句符号按语言配置(zh/ar/en)
+        self.segment_config = common_config['response_segment']
+
+
+    def create_stream_state(self, dev_id=None, text=None, speculative=False):
+        """创建流式回答解码状态
+        Args:
+            dev_id       设备ID
+            text         用户文本, 非None时回答完成后写入回答缓存
+            speculative  是否为推测请求
+        """
+        segmenter = Segmenter.from_language(self.segment_config.get('language', 'zh'),
+            self.segment_config['min'], self.segment_config['max'])
+        state = ChatStreamState(segmenter, dev_id, text, speculative)
+        if text is not None:
+            state.context = self.cache_context(dev_id)
+        return state
+
+
+    def cache_context(self, dev_id=None):
+        """回答缓存上下文: 设备上一轮回答, 新对话为空
+        """
+        if self.cache is None:
+            return ''
+        for msg in reversed(self.sessions.get(dev_id).messages):
+            if msg['role'] == 'assistant':
+                return msg['content']
+        return ''
+
+
+    def commit_speculation(self, text: str, state: ChatStreamState):
+        """确认推测请求: 保存用户消息, 回答已结束时同时保存回答
+        Args:
+            text   最终用户文本
+            state  推测请求的解码状态
+        """
+        self.update_chat_messages('user', text, state.dev_id)
+        state.speculative = False
+        if state.finish_reason is not None:
+            self._save_answer(state)
+
+
+    async def cache_lookup(self, text: str, state: ChatStreamState):
+        """查询回答缓存, 精确匹配未命中时进行语义匹配
+        Args:
+            text   用户文本
+            state  解码状态, 保存查询时计算的文本向量
+        Returns:
+            None or 缓存的完整回答
+        """
+        if self.cache is None:
+            return None
+        answer = self.cache.get(text, state.context)
+        if answer is None and self.cache.index is not None:
+            try:
+                response = await asyncio.wait_for(
+                    self.async_client.embeddings.create(model=self.embedding_model, input=text),
+                    self.embedding_timeout)
+                state.vector = response.data[0].embedding
+            except asyncio.TimeoutError:
+                logger.warning('get embedding timeout: {}s'.format(self.embedding_timeout))
+            except Exception as e:
+                logger.warning('get embedding fail: {}'.format(e))
+            answer = self.cache.search(state.vector, state.context)
+        self.cache.record(answer is not None)
+        return answer
+
+
+    def replay_answer(self, text: str, answer: str, state: ChatStreamState, piece_size=4):
+        """按流式回答相同的方式输出缓存的回答(断句, seq编号, 保存对话消息)
+        Args:
+            text        用户文本
+            answer      缓存的完整回答
+            state       解码状态
+            piece_size  每次输入断句器的字符数
+        Returns:
+            [{'seq': 'text': }] 回答句子序列和文本
+        """
+        self.update_chat_messages('user', text, state.dev_id)
+        state.text = None  # 不重复写入缓存
+        results = []
+        for index in range(0, len(answer), piece_size):
+            result = self._decode_text(state, answer[index:index + piece_size], None)
+            if result is not None:
+                results.append(result)
+        result = self._decode_text(state, None, 'stop')
+        if result is not None:
+            results.append(result)
+        return results
+
+
+    def get_state(self, dev_id=None):
+        """获取设备同步请求使用的解码状态
+        """
+        session = self.sessions.get(dev_id)
+        if session.state is None:
+            session.state = self.create_stream_state(dev_id)
+        return session.state
+
+
+    def get_usage(self, dev_id=None):
+        """获取设备累计token用量
+        Returns:
+            {'requests':, 'prompt_tokens':, 'completion_tokens':, 'total_tokens':, 'last_prompt_tokens': }
+        """
+        return self.sessions.get(dev_id).usage
+
+
+    def close(self):
+        """保存设备对话状态及回答缓存
+        """
+        self.sessions.close()
+        if self.cache is not None:
+            self.cache.close()
 
 
     def prompt_assistant(self):
@@ -80,32 +231,33 @@ class OpenAIChat():
         return messages
 
 
-    def get_messages(self):
+    def get_messages(self, dev_id=None):
         """获取完整消息,用于请求
+        Args:
+            dev_id  设备ID
+        Note:
+            返回设备会话增量维护的消息列表, 不能修改
         """
-        messages = [] 
-        messages.extend(self.prompt)
-        messages.extend(self.chat_messages)
-        return messages
+        return self.sessions.get(dev_id).get_context(self.prompt)
 
 
-    def update_chat_messages(self, role: str, content: str):
+    def update_chat_messages(self, role: str, content: str, dev_id=None):
         """跟新对话消息
+        Args:
+            dev_id  设备ID
         """
-        msg = {"role": role, "content": content}
-        self.chat_messages.append(msg)
-        if len(self.chat_messages) > self.chat_messages_windows_size_max:
-            self.chat_messages = self.chat_messages[-self.chat_messages_windows_size_max : ]
+        self.sessions.add_message(dev_id, role, content, self.chat_messages_windows_size_max,
+            self.context_token_budget)
 
 
-    def chat(self, text: str):
+    def chat(self, text: str, dev_id=None):
         """执行一次对话
         """
-        self.update_chat_messages('user', text)
+        self.update_chat_messages('user', text, dev_id)
         # a ChatCompletion request
         response = self.client.chat.completions.create(
             model=self.model,
-            messages=self.get_messages(),
+            messages=self.get_messages(dev_id),
             temperature=self.temperature,
             stream=True,
             stream_options={"include_usage": True}, # retrieving token usage for stream response
@@ -122,24 +274,25 @@ class OpenAIChat():
                     print(chunk_message)
         # print('assistant:', full_answer)
         ## 保存回答
-        self.update_chat_messages('assistant', full_answer)
+        self.update_chat_messages('assistant', full_answer, dev_id)
         return full_answer
 
 
-    def get_response(self, text: str):
+    def get_response(self, text: str, dev_id=None):
         """执行一次对话请求,非流式返回
         Args:
             text  当前用户输入信息
+            dev_id  设备ID
         Returns:
             reponse  返回响应数据
             {'seq': 'text': } 回答句子序列和文本 seq取值-1
         """
         ## 更新当前聊天数据
-        self.update_chat_messages('user', text)
+        self.update_chat_messages('user', text, dev_id)
         # a ChatCompletion request
         response = self.client.chat.completions.create(
             model=self.model,
-            messages=self.get_messages(),
+            messages=self.get_messages(dev_id),
             temperature=self.temperature,
             stream=False,
         )
@@ -148,22 +301,74 @@ class OpenAIChat():
         completionMessage = response.choices[0].message
         # print(completionMessage.content)
         result['text'] = completionMessage.content
+        ## 保存回答及token用量
+        self.update_chat_messages('assistant', result['text'], dev_id)
+        if response.usage is not None:
+            self.sessions.add_usage(dev_id, response.usage.prompt_tokens, response.usage.completion_tokens)
         return result
 
 
-    def get_response_stream(self, text: str):
+    def get_response_stream(self, text: str, dev_id=None):
         """执行一次对话请求,流式返回
         Args:
             text  当前用户输入信息
+            dev_id  设备ID
         Returns:
             reponse  返回流式响应数据，由多个chunk组成
         """
         ## 更新当前聊天数据
-        self.update_chat_messages('user', text)
+        self.update_chat_messages('user', text, dev_id)
         # a ChatCompletion request
         response = self.client.chat.completions.create(
             model=self.model,
-            messages=self.get_messages(),
+            messages=self.get_messages(dev_id),
+            temperature=self.temperature,
+            stream=True,
+            stream_options={"include_usage": True}, # retrieving token usage for stream response
+        )
+        return response
+
+
+    async def get_response_async(self, text: str, dev_id=None):
+        """执行一次对话请求,非流式返回(异步)
+        Args:
+            text  当前用户输入信息
+            dev_id  设备ID
+        Returns:
+            {'seq': 'text': } 回答句子序列和文本 seq取值-1
+        """
+        self.update_chat_messages('user', text, dev_id)
+        response = await self.async_client.chat.completions.create(
+            model=self.model,
+            messages=self.get_messages(dev_id),
+            temperature=self.temperature,
+            stream=False,
+        )
+        text = response.choices[0].message.content
+        ## 保存回答及token用量
+        self.update_chat_messages('assistant', text, dev_id)
+        if response.usage is not None:
+            self.sessions.add_usage(dev_id, response.usage.prompt_tokens, response.usage.completion_tokens)
+        return {'seq': -1, 'text': text}
+
+
+    async def get_response_stream_async(self, text: str, dev_id=None, speculative=False):
+        """执行一次对话请求,流式返回(异步)
+        Args:
+            text  当前用户输入信息
+            dev_id  设备ID
+            speculative  推测请求, 不修改对话消息(确认后由commit_speculation保存)
+        Returns:
+            reponse  异步流式响应数据(async for 读取chunk), 调用close()中止请求
+        """
+        if speculative:
+            messages = self.get_messages(dev_id) + [{"role": "user", "content": text}]
+        else:
+            self.update_chat_messages('user', text, dev_id)
+            messages = self.get_messages(dev_id)
+        response = await self.async_client.chat.completions.create(
+            model=self.model,
+            messages=messages,
             temperature=self.temperature,
             stream=True,
             stream_options={"include_usage": True}, # retrieving token usage for stream response
@@ -171,48 +376,77 @@ class OpenAIChat():
         return response
 
 
-    def decode_chunk(self, chunk):
+    def decode_chunk(self, chunk, state=None):
         """解码对话流式响应数据,分句返回回答结果
         Args:
             chunk   流式响应response的元素
+            state   解码状态(ChatStreamState), None使用默认设备同步请求的解码状态
         Note:
             openai 和 dashscope 数据返回有所区别, openai最后一条消息为None
         Returns:
             None(未就绪) or {'seq': 'text': } 回答句子序列和文本 seq取值[0,1,2,3...-n] 0 代表开始, seq=-n 代表尾句
         """
+        if state is None:
+            state = self.get_state()
+        ## 最后一条消息携带本次请求的token用量(stream_options include_usage)
+        usage = getattr(chunk, 'usage', None)
+        if usage is not None:
+            self.sessions.add_usage(state.dev_id, usage.prompt_tokens, usage.completion_tokens)
+
+        choices = chunk.choices
+        if len(choices) == 0:
+            return None
+        msg = chunk.choices[0].delta.content  # extract the message
+        finish_reason = chunk.choices[0].finish_reason
+        if msg == '':  # 开始  
+            state.answer_seq = 0
+        return self._decode_text(state, msg, finish_reason)
+
+
+    def _decode_text(self, state: ChatStreamState, msg, finish_reason):
+        """断句处理一段回答文本
+        Args:
+            state          解码状态
+            msg            回答文本, 可为None
+            finish_reason  None(未结束) or 结束原因
+        Returns:
+            None(未就绪) or {'seq': 'text': }
+        """
         result = {}
         answer = None
-        # finish_reason='stop'
-        choices = chunk.choices
-        if len(choices) != 0:
-            msg = chunk.choices[0].delta.content  # extract the message
-            finish_reason = chunk.choices[0].finish_reason
-
-            if msg == '':  # 开始  
-                self.answer_seq = 0
-
-            # get answer
-            if finish_reason == 'stop':
-                if msg is not None:
-                    answer = self.segmenter.flush(text=msg)
-                else: 
-                    answer = self.segmenter.flush()
-                self.full_answer = ""
-            else:
-                if msg is not None and msg != '': # 中间数据
-                    self.full_answer += msg
-                    answer = self.segmenter.update(msg)
-
-            if answer != None:
-                self.answer_seq = self.answer_seq + 1
-                if finish_reason:
-                    self.answer_seq = -1 * self.answer_seq
-                ## 保存回答到chat messages
-                self.update_chat_messages('assistant', self.full_answer)
+        if msg is not None:
+            state.full_answer += msg
+
+        # get answer
+        if finish_reason is not None:  # 结束(stop/length等)
+            if msg is not None:
+                answer = state.segmenter.flush(text=msg)
+            else: 
+                answer = state.segmenter.flush()
+            state.finish_reason = finish_reason
+            ## 推测请求确认前不保存
+            if not state.speculative:
+                self._save_answer(state)
+        elif msg is not None and msg != '': # 中间数据
+            answer = state.segmenter.update(msg)
+
+        if answer != None:
+            state.answer_seq = state.answer_seq + 1
+            if finish_reason:
+                state.answer_seq = -1 * state.answer_seq
         logger.debug('answer:{}'.format(answer))
 
         if answer == None:
             return None
-        result['seq'] = self.answer_seq
+        result['seq'] = state.answer_seq
         result['text'] = answer
         return result
+
+
+    def _save_answer(self, state: ChatStreamState):
+        """回答完成, 保存完整回答到chat messages(每个回答一条), 并写入回答缓存
+        """
+        self.update_chat_messages('assistant', state.full_answer, state.dev_id)
+        if self.cache is not None and state.finish_reason == 'stop' and state.text is not None:
+            self.cache.put(state.text, state.full_answer, state.vector, state.context)
+        state.full_answer = ""
@@ -0,0 +1,245 @@
+# coding=utf-8
+"""对话回答缓存
+常见问题(问候、口诀、数数等)直接返回缓存的回答, 不请求大模型。
+1. 精确匹配: 归一化用户文本 + 上一轮回答 + prompt + 模型作为键, TTL/LRU淘汰
+2. 语义匹配(可选): 用户文本向量与已缓存问题的余弦相似度超过阈值时命中, 向量保存在本地文件,
+   只匹配键前缀(prompt + 模型 + 上一轮回答)相同的条目
+上一轮回答计入键, 依赖上下文的追问(如"然后呢")不会命中其它对话的回答。
+"""
+import os
+import json
+import time
+import hashlib
+import unicodedata
+from collections import OrderedDict
+
+import numpy as np
+
+from utility.mlogging import logger
+
+
+def normalize_text(text: str):
+    """归一化用户文本: 全半角统一, 小写, 去除空白和标点符号
+    """
+    text = unicodedata.normalize('NFKC', text).lower()
+    return ''.join(char for char in text
+        if not char.isspace() and not unicodedata.category(char).startswith(('P', 'S')))
+
+
+class EmbeddingIndex():
+    """问题向量索引, 保存在本地npz文件
+    """
+    def __init__(self, path: str, threshold=0.92, max_entries=5000):
+        """
+        Args:
+            path         向量文件路径(.npz)
+            threshold    命中的余弦相似度阈值
+            max_entries  最大条目数, 超出后删除最早的条目
+        """
+        self.path = path
+        self.threshold = threshold
+        self.max_entries = max_entries
+        # 归一化后的向量矩阵及对应条目 {'key':, 'answer':, 'time': }
+        self.vectors = None
+        self.entries = []
+        # 未保存的新增条目数
+        self._dirty = 0
+        self.load()
+
+
+    def load(self):
+        """读取向量文件
+        """
+        if not os.path.exists(self.path):
+            return
+        try:
+            with np.load(self.path) as data:
+                self.vectors = data['vectors']
+                self.entries = json.loads(str(data['entries']))
+            logger.info('load response vectors: {}'.format(len(self.entries)))
+        except Exception as e:
+            logger.warning('load response vectors fail: {}'.format(e))
+            self.vectors = None
+            self.entries = []
+
+
+    def save(self):
+        """保存向量文件
+        """
+        if self._dirty == 0 or self.vectors is None:
+            return
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        np.savez(self.path, vectors=self.vectors, entries=np.array(json.dumps(self.entries, ensure_ascii=False)))
+        self._dirty = 0
+
+
+    def search(self, vector, prefix: str, ttl=0):
+        """查询最相似的问题
+        Args:
+            vector  问题向量
+            prefix  条目键前缀, 只匹配相同模型/prompt/上下文的条目
+            ttl     条目有效时间(s), 0不过期
+        Returns:
+            None or answer
+        """
+        if self.vectors is None or len(self.entries) == 0:
+            return None
+        mask = np.fromiter((entry['key'].startswith(prefix) for entry in self.entries), dtype=bool,
+            count=len(self.entries))
+        if not mask.any():
+            return None
+        vector = np.asarray(vector, dtype=np.float32)
+        vector = vector / (np.linalg.norm(vector) + 1e-12)
+        scores = np.where(mask, self.vectors @ vector, -np.inf)
+        index = int(np.argmax(scores))
+        entry = self.entries[index]
+        if scores[index] < self.threshold:
+            return None
+        if ttl > 0 and time.time() - entry['time'] > ttl:
+            return None
+        logger.debug('response vector hit, score: {:.3f}'.format(scores[index]))
+        return entry['answer']
+
+
+    def add(self, key: str, vector, answer: str):
+        """添加问题向量及回答
+        """
+        vector = np.asarray(vector, dtype=np.float32)
+        vector = (vector / (np.linalg.norm(vector) + 1e-12)).reshape(1, -1)
+        if self.vectors is None or self.vectors.shape[1] != vector.shape[1]:
+            self.vectors = vector
+            self.entries = []
+        else:
+            self.vectors = np.vstack([self.vectors, vector])
+        self.entries.append({'key': key, 'answer': answer, 'time': time.time()})
+        if len(self.entries) > self.max_entries:
+            remove = len(self.entries) - self.max_entries
+            self.vectors = self.vectors[remove:]
+            self.entries = self.entries[remove:]
+        self._dirty += 1
+        # 定期保存
+        if self._dirty >= 20:
+            self.save()
+
+
+class ResponseCache():
+    """回答缓存
+    Note:
+        非线程安全, 只在chat节点事件循环中使用
+    """
+    def __init__(self, model: str, prompt: str, max_entries=1000, ttl=0, index=None):
+        """
+        Args:
+            model        模型名称
+            prompt       prompt内容
+            max_entries  精确匹配最大条目数(LRU)
+            ttl          条目有效时间(s), 0不过期
+            index        语义匹配索引(EmbeddingIndex), None不使用
+        """
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.index = index
+        # 模型与prompt不同时回答不同, 计入缓存键
+        self._scope = hashlib.sha1('{}\0{}'.format(model, prompt).encode('utf-8')).hexdigest()
+        # key: (answer, time)
+        self.entries = OrderedDict()
+        # 命中统计
+        self.hits = 0
+        self.misses = 0
+
+
+    @classmethod
+    def from_config(cls, model: str, prompt: str, config: dict):
+        """根据配置创建缓存
+        Args:
+            config  {'max_entries':, 'ttl':, 'embedding': {'enable':, 'path':, 'threshold':, 'max_entries':, 'timeout': }}
+        """
+        index = None
+        embedding_config = config.get('embedding', {})
+        if embedding_config.get('enable', False):
+            index = EmbeddingIndex(embedding_config.get('path', './temp/chat/response_vectors.npz'),
+                threshold=embedding_config.get('threshold', 0.92),
+                max_entries=embedding_config.get('max_entries', 5000))
+        return cls(model, prompt, config.get('max_entries', 1000), config.get('ttl', 0), index)
+
+
+    def prefix(self, context=''):
+        """缓存键前缀: prompt + 模型 + 上一轮回答
+        Args:
+            context  上一轮回答, 新对话为空
+        """
+        if context == '':
+            return '{}::'.format(self._scope)
+        context_hash = hashlib.sha1(normalize_text(context).encode('utf-8')).hexdigest()[:16]
+        return '{}:{}:'.format(self._scope, context_hash)
+
+
+    def key(self, text: str, context=''):
+        """缓存键: 键前缀 + 归一化文本
+        """
+        return self.prefix(context) + normalize_text(text)
+
+
+    def get(self, text: str, context=''):
+        """精确匹配查询
+        Args:
+            text     用户文本
+            context  上一轮回答
+        Returns:
+            None or answer
+        """
+        key = self.key(text, context)
+        entry = self.entries.get(key, None)
+        if entry is not None and self.ttl > 0 and time.time() - entry[1] > self.ttl:
+            del self.entries[key]
+            entry = None
+        if entry is None:
+            return None
+        self.entries.move_to_end(key)
+        return entry[0]
+
+
+    def search(self, vector, context=''):
+        """语义匹配查询
+        Returns:
+            None or answer
+        """
+        if self.index is None or vector is None:
+            return None
+        return self.index.search(vector, self.prefix(context), self.ttl)
+
+
+    def record(self, hit: bool):
+        """记录命中统计
+        """
+        if hit:
+            self.hits += 1
+        else:
+            self.misses += 1
+        logger.info('response cache {}, hits: {} misses: {}'.format('hit' if hit else 'miss', self.hits, self.misses))
+
+
+    def put(self, text: str, answer: str, vector=None, context=''):
+        """缓存回答
+        Args:
+            text     用户文本
+            answer   完整回答
+            vector   用户文本向量, 语义匹配时使用
+            context  上一轮回答
+        """
+        if answer is None or answer.strip() == '':
+            return
+        key = self.key(text, context)
+        self.entries[key] = (answer, time.time())
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+        if self.index is not None and vector is not None:
+            self.index.add(key, vector, answer)
+
+
+    def close(self):
+        """保存向量文件
+        """
+        if self.index is not None:
+            self.index.save()
@@ -0,0 +1,245 @@
+# coding=utf-8
+"""设备对话状态存储
+每个设备(dev_id)独立保存对话消息窗口及解码状态, 避免多设备对话串扰。
+1. LRU淘汰: 会话数或消息占用内存超出上限时, 淘汰最久未使用的会话
+2. 落盘: 配置spill后, 淘汰的会话消息写入本地sqlite或文件, 设备再次请求时恢复
+3. 上下文窗口: 每条消息只计算一次token数, 按token预算裁剪, 请求消息列表增量维护
+"""
+import os
+import json
+import time
+import hashlib
+import sqlite3
+from collections import OrderedDict
+
+from utility.mlogging import logger
+
+
+class ChatSession():
+    """单个设备的对话状态
+    """
+    def __init__(self, dev_id, counter, messages=None):
+        """
+        Args:
+            dev_id    设备ID
+            counter   token计数(TokenCounter)
+            messages  对话消息(不含prompt)
+        """
+        self.dev_id = dev_id
+        self.counter = counter
+        self.messages = messages if messages is not None else []
+        # 各消息token数缓存
+        self.token_counts = [counter.count_message(msg) for msg in self.messages]
+        self.tokens = sum(self.token_counts)
+        # 请求消息列表(prompt + messages), 首次请求时创建, 之后增量更新
+        self.context = None
+        # 同步请求使用的解码状态(ChatStreamState)
+        self.state = None
+        # token用量统计(服务端返回的usage), last_prompt_tokens为最近一次请求的输入token数
+        self.usage = {'requests': 0, 'prompt_tokens': 0, 'completion_tokens': 0,
+            'total_tokens': 0, 'last_prompt_tokens': 0}
+        # 消息占用内存估算(字节)
+        self.size = sum(self._message_size(msg) for msg in self.messages)
+        self.update_time = time.time()
+
+
+    @staticmethod
+    def _message_size(msg: dict):
+        return len(msg['content'].encode('utf-8')) + 64
+
+
+    def get_context(self, prompt: list):
+        """获取请求消息列表(prompt + 对话消息)
+        Args:
+            prompt  prompt消息
+        Note:
+            返回的列表由会话增量维护, 调用方不能修改
+        """
+        if self.context is None:
+            self.context = list(prompt) + self.messages
+        return self.context
+
+
+    def add_message(self, role: str, content: str, window_size: int, token_budget=0):
+        """添加对话消息, 超出条数或token预算时删除最早的消息(至少保留最新一条)
+        Args:
+            role          user / assistant
+            content       消息内容
+            window_size   消息条数最大值
+            token_budget  对话消息token数上限(不含prompt), 0不限制
+        """
+        msg = {"role": role, "content": content}
+        self.messages.append(msg)
+        self.token_counts.append(self.counter.count_message(msg))
+        self.tokens += self.token_counts[-1]
+        self.size += self._message_size(msg)
+        if self.context is not None:
+            self.context.append(msg)
+        while len(self.messages) > 1 and (len(self.messages) > window_size
+                or (token_budget > 0 and self.tokens > token_budget)):
+            self._pop_message()
+        self.update_time = time.time()
+
+
+    def add_usage(self, prompt_tokens: int, completion_tokens: int):
+        """记录一次请求的token用量
+        """
+        self.usage['requests'] += 1
+        self.usage['prompt_tokens'] += prompt_tokens
+        self.usage['completion_tokens'] += completion_tokens
+        self.usage['total_tokens'] += prompt_tokens + completion_tokens
+        self.usage['last_prompt_tokens'] = prompt_tokens
+
+
+    def _pop_message(self):
+        """删除最早的消息
+        """
+        msg = self.messages.pop(0)
+        self.tokens -= self.token_counts.pop(0)
+        self.size -= self._message_size(msg)
+        if self.context is not None:
+            del self.context[len(self.context) - len(self.messages) - 1]
+
+
+class SqliteSpill():
+    """会话落盘: sqlite
+    """
+    def __init__(self, path: str):
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute('CREATE TABLE IF NOT EXISTS sessions '
+            '(dev_id TEXT PRIMARY KEY, messages TEXT, update_time REAL)')
+        self.conn.commit()
+
+    def save(self, session: ChatSession):
+        self.conn.execute('REPLACE INTO sessions VALUES (?, ?, ?)',
+            (str(session.dev_id), json.dumps(session.messages), session.update_time))
+        self.conn.commit()
+
+    def load(self, dev_id):
+        row = self.conn.execute('SELECT messages FROM sessions WHERE dev_id = ?', (str(dev_id),)).fetchone()
+        return None if row is None else json.loads(row[0])
+
+    def close(self):
+        self.conn.close()
+
+
+class FileSpill():
+    """会话落盘: 每个设备一个json文件
+    """
+    def __init__(self, path: str):
+        os.makedirs(path, exist_ok=True)
+        self.path = path
+
+    def _file(self, dev_id):
+        name = hashlib.md5(str(dev_id).encode('utf-8')).hexdigest()
+        return os.path.join(self.path, name + '.json')
+
+    def save(self, session: ChatSession):
+        with open(self._file(session.dev_id), 'w', encoding='utf-8') as f:
+            json.dump(session.messages, f, ensure_ascii=False)
+
+    def load(self, dev_id):
+        file = self._file(dev_id)
+        if not os.path.exists(file):
+            return None
+        with open(file, 'r', encoding='utf-8') as f:
+            return json.load(f)
+
+    def close(self):
+        pass
+
+
+class SessionStore():
+    """设备对话状态存储(LRU)
+    Note:
+        非线程安全, 只在chat节点事件循环中使用
+    """
+    def __init__(self, counter, max_sessions=1000, max_bytes=16*1024*1024, spill=None):
+        """
+        Args:
+            counter       token计数(TokenCounter)
+            max_sessions  内存中最大会话数
+            max_bytes     内存中会话消息占用上限(字节)
+            spill         落盘存储(SqliteSpill/FileSpill), None淘汰后丢弃
+        """
+        self.counter = counter
+        self.max_sessions = max_sessions
+        self.max_bytes = max_bytes
+        self.spill = spill
+        # dev_id: ChatSession, 按使用顺序排列
+        self.sessions = OrderedDict()
+        self.size = 0
+
+
+    @classmethod
+    def from_config(cls, counter, config: dict):
+        """根据配置创建存储
+        Args:
+            counter  token计数(TokenCounter)
+            config   {'max_sessions':, 'max_bytes':, 'spill': 'none'/'sqlite'/'file', 'path': }
+        """
+        spill = None
+        spill_type = config.get('spill', 'none')
+        if spill_type == 'sqlite':
+            spill = SqliteSpill(config.get('path', './temp/chat/sessions.db'))
+        elif spill_type == 'file':
+            spill = FileSpill(config.get('path', './temp/chat/sessions'))
+        return cls(counter, config.get('max_sessions', 1000), config.get('max_bytes', 16*1024*1024), spill)
+
+
+    def get(self, dev_id):
+        """获取设备会话, 不存在时从落盘存储恢复或新建
+        """
+        session = self.sessions.get(dev_id, None)
+        if session is not None:
+            self.sessions.move_to_end(dev_id)
+            return session
+        messages = None
+        if self.spill is not None:
+            messages = self.spill.load(dev_id)
+        session = ChatSession(dev_id, self.counter, messages)
+        self.sessions[dev_id] = session
+        self.size += session.size
+        self._evict()
+        return session
+
+
+    def add_message(self, dev_id, role: str, content: str, window_size: int, token_budget=0):
+        """添加设备对话消息
+        """
+        session = self.get(dev_id)
+        self.size -= session.size
+        session.add_message(role, content, window_size, token_budget)
+        self.size += session.size
+        self._evict()
+
+
+    def add_usage(self, dev_id, prompt_tokens: int, completion_tokens: int):
+        """记录设备一次请求的token用量
+        """
+        session = self.get(dev_id)
+        session.add_usage(prompt_tokens, completion_tokens)
+        logger.debug('chat usage, dev_id: {} prompt: {} completion: {} context tokens: {}'.format(
+            dev_id, prompt_tokens, completion_tokens, session.tokens))
+
+
+    def _evict(self):
+        """超出上限时淘汰最久未使用的会话(保留最近使用的会话)
+        """
+        while len(self.sessions) > 1 and (len(self.sessions) > self.max_sessions or self.size > self.max_bytes):
+            dev_id, session = self.sessions.popitem(last=False)
+            self.size -= session.size
+            if self.spill is not None:
+                self.spill.save(session)
+            logger.debug('evict chat session, dev_id: {}'.format(dev_id))
+
+
+    def close(self):
+        """保存所有会话并关闭落盘存储
+        """
+        if self.spill is None:
+            return
+        for session in self.sessions.values():
+            self.spill.save(session)
+        self.spill.close()
@@ -0,0 +1,47 @@
+# coding=utf-8
+"""对话消息token计数
+安装tiktoken时按模型编码精确计数, 否则按字符估算(中日韩字符1 token, 其它约4字符1 token)。
+"""
+from utility.mlogging import logger
+
+try:
+    import tiktoken
+except ImportError:
+    tiktoken = None
+
+
+# 每条消息的格式开销(role及分隔符)
+MESSAGE_OVERHEAD = 4
+
+
+class TokenCounter():
+    """token计数
+    """
+    def __init__(self, model: str):
+        """
+        Args:
+            model  模型名称, 用于选择tiktoken编码
+        """
+        self.encoding = None
+        if tiktoken is not None:
+            try:
+                self.encoding = tiktoken.encoding_for_model(model)
+            except KeyError:
+                self.encoding = tiktoken.get_encoding('cl100k_base')
+        else:
+            logger.info('tiktoken not installed, estimate token count by characters.')
+
+
+    def count(self, text: str):
+        """文本token数
+        """
+        if self.encoding is not None:
+            return len(self.encoding.encode(text))
+        cjk = sum(1 for char in text if '⺀' <= char <= '鿿' or '가' <= char <= '힯')
+        return cjk + (len(text) - cjk + 3) // 4
+
+
+    def count_message(self, msg: dict):
+        """消息token数(含格式开销)
+        """
+        return self.count(msg['content']) + MESSAGE_OVERHEAD
@@ -0,0 +1,60 @@
+# coding=utf-8
+"""二进制音频帧
+用于设备->bridge->asr的音频数据传输, 替代json内的base64编码, 减少数据量及编解码次数
+帧格式(大端):
+    magic       2 bytes  b'AL'
+    version     1 byte
+    format      1 byte   音频格式, 见FORMAT_CODES
+    chat_id     4 bytes  无符号整数, 本次聊天交互序列号
+    seq_id      4 bytes  有符号整数, 音频片段序号(小于0代表结束)
+    samplerate  2 bytes  无符号整数, 采样率
+    audio       n bytes  音频数据
+"""
+import struct
+
+FRAME_MAGIC = b'AL'
+FRAME_VERSION = 1
+
+_HEADER = struct.Struct('>2sBBIiH')
+# 帧头长度
+HEADER_SIZE = _HEADER.size
+
+# 音频格式编码
+FORMAT_CODES = {'raw': 0, 'opus': 1, 'mp3': 2}
+FORMAT_NAMES = {code: name for name, code in FORMAT_CODES.items()}
+
+
+def pack_frame(chat_id: int, seq_id: int, audio_format: str, samplerate: int, audio: bytes) -> bytes:
+    """打包音频帧
+    Args:
+        chat_id       本次聊天交互序列号
+        seq_id        音频片段序号
+        audio_format  音频格式 raw/opus/mp3
+        samplerate    采样率
+        audio         音频数据
+    Returns:
+        帧数据
+    """
+    header = _HEADER.pack(FRAME_MAGIC, FRAME_VERSION, FORMAT_CODES[audio_format], chat_id, seq_id, samplerate)
+    return header + audio
+
+
+def unpack_frame(frame: bytes):
+    """解析音频帧
+    Args:
+        frame  帧数据
+    Returns:
+        None(非法帧) or {'chat_id':, 'seq_id':, 'format':, 'samplerate':, 'audio': memoryview}
+    """
+    if len(frame) < HEADER_SIZE:
+        return None
+    magic, version, format_code, chat_id, seq_id, samplerate = _HEADER.unpack_from(frame)
+    if magic != FRAME_MAGIC or version != FRAME_VERSION:
+        return None
+    return {
+        'chat_id': chat_id,
+        'seq_id': seq_id,
+        'format': FORMAT_NAMES.get(format_code, 'unknown'),
+        'samplerate': samplerate,
+        'audio': memoryview(frame)[HEADER_SIZE:],
+    }
@@ -0,0 +1,167 @@
+# coding=utf-8
+"""ws客户端负载编解码线程池
+gzip压缩/解压(zlib执行时释放GIL)及json编解码在共享的有界线程池中执行, 不阻塞节点主循环。
+每个客户端使用CodecLane按提交顺序获取结果, 保证请求发送及响应读取的顺序不变。
+"""
+import gzip
+import threading
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+
+from utility.mlogging import logger
+
+
+# 小于该长度的数据直接在调用线程处理(线程切换开销大于编解码耗时)
+INLINE_MAX_BYTES = 4096
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_executor(max_workers=2):
+    """获取共享线程池, 首次调用时创建
+    Args:
+        max_workers  最大线程数
+    """
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='codec')
+    return _executor
+
+
+def compress(data: bytes, level: int):
+    """gzip压缩
+    Args:
+        data   数据
+        level  压缩等级 1-9, 0不压缩
+    """
+    if level == 0:
+        return data
+    return gzip.compress(data, compresslevel=level)
+
+
+class CodecLane():
+    """按提交顺序输出编解码结果
+    1. 结果有回调时, 按顺序调用回调(如发送请求)
+    2. 没有回调时, 按顺序由get()读取(如读取响应), 结果就绪时调用完成通知(set_notify)
+    """
+    def __init__(self, max_workers=2):
+        """
+        Args:
+            max_workers  共享线程池最大线程数(首次创建线程池时生效)
+        """
+        self.executor = get_executor(max_workers)
+        # 未输出的任务 (future, callback), 按提交顺序排列
+        self._pending = deque()
+        # 已完成待读取的结果
+        self._results = deque()
+        self._lock = threading.Lock()
+        # 完成通知, 有结果可读取时调用
+        self._notify = None
+
+
+    def set_notify(self, callback):
+        """设置完成通知, 线程池中的任务完成后唤醒读取线程
+        Args:
+            callback  无参数回调, 可能在线程池线程中执行, 需线程安全且不阻塞
+        """
+        self._notify = callback
+
+
+    def submit(self, fn, *args, callback=None, offload=True):
+        """提交编解码任务
+        Args:
+            fn        编解码函数
+            args      函数参数
+            callback  结果回调, None时由get()读取
+            offload   是否在线程池中执行, False时在调用线程执行
+        """
+        if offload:
+            future = self.executor.submit(fn, *args)
+        else:
+            future = Future()
+            try:
+                future.set_result(fn(*args))
+            except Exception as e:
+                future.set_exception(e)
+        with self._lock:
+            self._pending.append((future, callback))
+        future.add_done_callback(lambda _: self._drain())
+
+
+    def get(self):
+        """读取下一个结果
+        Returns:
+            (True, result) or (False, None) 结果未就绪
+        """
+        self._drain()
+        with self._lock:
+            if len(self._results) == 0:
+                return False, None
+            return True, self._results.popleft()
+
+
+    def clear(self):
+        """丢弃未输出的任务及结果, 连接关闭或重连时调用
+        Note:
+            执行中的任务无法取消, 完成后不在队列中, 结果直接丢弃
+        """
+        with self._lock:
+            pending = [future for future, _ in self._pending]
+            self._pending.clear()
+            self._results.clear()
+        # 取消未执行的任务会同步调用完成回调(_drain), 需在释放锁后执行
+        for future in pending:
+            future.cancel()
+
+
+    def _drain(self):
+        """按顺序输出已完成的任务, 队首未完成时等待
+        """
+        ready = False
+        with self._lock:
+            while len(self._pending) > 0 and self._pending[0][0].done():
+                future, callback = self._pending.popleft()
+                if future.cancelled():
+                    continue
+                try:
+                    result = future.result()
+                except Exception as e:
+                    logger.error('codec task fail: {}'.format(e))
+                    continue
+                if callback is None:
+                    self._results.append(result)
+                    ready = True
+                else:
+                    callback(result)
+        if ready and self._notify is not None:
+            self._notify()
+
+
+if __name__=='__main__':
+    # 性能测试: 4路128KB PCM gzip压缩, 主线程同步执行与线程池执行对比
+    import math
+    import array
+    import random
+    import time
+
+    random.seed(0)
+    pcm = array.array('h', (int(3000 * math.sin(i / 8) + random.randint(-200, 200)) for i in range(64 * 1024))).tobytes()
+    for level in (9, 1):
+        start = time.perf_counter()
+        for _ in range(4):
+            compress(pcm, level)
+        sync_t = time.perf_counter() - start
+
+        lanes = [CodecLane(max_workers=4) for _ in range(4)]
+        outputs = []
+        start = time.perf_counter()
+        for lane in lanes:
+            lane.submit(compress, pcm, level, callback=outputs.append)
+        submit_t = time.perf_counter() - start
+        while len(outputs) < 4:
+            time.sleep(0.0001)
+        pool_t = time.perf_counter() - start
+        print('level {}: sync {:.2f} ms, pool submit (main loop blocked) {:.3f} ms, pool done {:.2f} ms'.format(
+            level, sync_t * 1e3, submit_t * 1e3, pool_t * 1e3))
@@ -0,0 +1,114 @@
+# coding=utf-8
+"""音频帧缓冲区
+数据写入bytearray, 通过读位置和memoryview切片读取, 读取时不复制剩余数据,
+已读数据超过一半时才整体前移, 分帧开销与数据长度成线性关系。
+用于TTS音频分帧及ASR音频片段缓冲。
+"""
+
+
+class FrameBuffer():
+    """可复用的音频帧缓冲区
+    Note:
+        非线程安全, 只在单个线程中使用
+    """
+    def __init__(self):
+        self._buff = bytearray()
+        # 读位置, 之前的数据已读取
+        self._start = 0
+
+
+    def __len__(self):
+        return len(self._buff) - self._start
+
+
+    def write(self, data):
+        """写入数据
+        Args:
+            data  bytes / bytearray / memoryview
+        """
+        self._buff += data
+
+
+    def read(self, size=None):
+        """读取数据
+        Args:
+            size  读取长度, None读取全部
+        Returns:
+            bytes, 数据不足时返回剩余全部数据
+        """
+        end = len(self._buff) if size is None else min(self._start + size, len(self._buff))
+        with memoryview(self._buff) as view:
+            data = bytes(view[self._start:end])
+        self._start = end
+        self._compact()
+        return data
+
+
+    def frames(self, frame_length: int, flush=False):
+        """读取所有完整帧
+        Args:
+            frame_length  帧长
+            flush         是否同时读取剩余不足一帧的数据(作为最后一帧)
+        Returns:
+            [bytes] 帧列表
+        """
+        frames = []
+        end = len(self._buff)
+        with memoryview(self._buff) as view:
+            start = self._start
+            while end - start >= frame_length:
+                frames.append(bytes(view[start:start + frame_length]))
+                start += frame_length
+            if flush and end > start:
+                frames.append(bytes(view[start:end]))
+                start = end
+        self._start = start
+        self._compact()
+        return frames
+
+
+    def clear(self):
+        """清空缓冲区
+        """
+        self._buff.clear()
+        self._start = 0
+
+
+    def _compact(self):
+        """已读数据超过一半时, 删除已读数据
+        """
+        if self._start == len(self._buff):
+            self.clear()
+        elif self._start > len(self._buff) // 2:
+            del self._buff[:self._start]
+            self._start = 0
+
+
+if __name__=='__main__':
+    # 分帧性能测试: 单次写入n秒音频(16k 16bit pcm), 按512字节分帧, 与bytes拼接+切片对比
+    import os
+    import timeit
+
+    frame_length = 512
+
+    def split_bytes(audio):
+        buff = b''
+        buff += audio
+        frames = []
+        while len(buff) >= frame_length:
+            frames.append(buff[:frame_length])
+            buff = buff[frame_length:]
+        return frames
+
+    def split_frame_buffer(audio):
+        buff = FrameBuffer()
+        buff.write(audio)
+        return buff.frames(frame_length)
+
+    for seconds in [1, 2, 4, 8, 16]:
+        audio = os.urandom(32000 * seconds)
+        number = 20
+        bytes_t = timeit.timeit(lambda: split_bytes(audio), number=number) / number
+        buffer_t = timeit.timeit(lambda: split_frame_buffer(audio), number=number) / number
+        print('{:2}s audio ({:7} bytes)  bytes slice: {:8.2f} ms  FrameBuffer: {:6.2f} ms'.format(
+            seconds, len(audio), bytes_t * 1e3, buffer_t * 1e3))
@@ -0,0 +1,131 @@
+# coding=utf-8
+"""RabbitMQ消息序列化
+编码方式通过AMQP content_type声明, 接收端根据content_type选择解码方式, 不同版本节点可以混合使用
+    json     标准库json(默认)
+    orjson   orjson, 与json格式相同(content_type相同), 速度更快
+    msgpack  msgpack二进制格式, 体积更小, 需所有接收节点支持
+"""
+import json
+
+from utility.mlogging import logger
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+
+JSON_CONTENT_TYPE = 'application/json'
+MSGPACK_CONTENT_TYPE = 'application/msgpack'
+
+
+class JsonCodec():
+    """标准库json
+    """
+    name = 'json'
+    content_type = JSON_CONTENT_TYPE
+
+    def encode(self, obj):
+        return json.dumps(obj)
+
+    def decode(self, body):
+        return json.loads(body)
+
+
+class OrjsonCodec():
+    """orjson, 输出与json兼容
+    """
+    name = 'orjson'
+    content_type = JSON_CONTENT_TYPE
+
+    def encode(self, obj):
+        return orjson.dumps(obj)
+
+    def decode(self, body):
+        return orjson.loads(body)
+
+
+class MsgpackCodec():
+    """msgpack
+    """
+    name = 'msgpack'
+    content_type = MSGPACK_CONTENT_TYPE
+
+    def encode(self, obj):
+        return msgpack.packb(obj, use_bin_type=True)
+
+    def decode(self, body):
+        return msgpack.unpackb(body, raw=False)
+
+
+def _available_codecs():
+    """当前环境可用的编码方式
+    """
+    codecs = {'json': JsonCodec()}
+    if orjson is not None:
+        codecs['orjson'] = OrjsonCodec()
+    if msgpack is not None:
+        codecs['msgpack'] = MsgpackCodec()
+    return codecs
+
+
+CODECS = _available_codecs()
+
+
+def get_codec(name: str):
+    """获取编码器, 不可用时使用json
+    Args:
+        name  json / orjson / msgpack
+    """
+    codec = CODECS.get(name, None)
+    if codec is None:
+        logger.warning('mq codec: {} not available, use json.'.format(name))
+        codec = CODECS['json']
+    return codec
+
+
+def get_decoder(content_type):
+    """根据content_type获取解码器, 未声明content_type(旧版本节点)时按json解码
+    Args:
+        content_type  AMQP消息属性content_type
+    Returns:
+        None(不支持) or codec
+    """
+    if content_type is None or content_type == JSON_CONTENT_TYPE:
+        # json格式优先使用更快的orjson解码
+        return CODECS.get('orjson', CODECS['json'])
+    if content_type == MSGPACK_CONTENT_TYPE:
+        return CODECS.get('msgpack', None)
+    return None
+
+
+if __name__=='__main__':
+    # 编解码性能测试, 使用音频帧(request/asr)和TTS响应(chat/response)的典型消息
+    import base64
+    import os
+    import timeit
+
+    asr_msg = {'type': 'object', 'data': {
+        'node': 'linker_dev', 'dev_id': 'dev-0001', 'topic': 'request/asr', 'type': 'json',
+        'data': {'chat_id': 12, 'seq_id': 35, 'audio': {
+            'samplerate': 16000, 'bits': 16, 'channels': 1, 'format': 'opus',
+            'buff': base64.b64encode(os.urandom(80)).decode()}}}}
+    tts_msg = {'type': 'object', 'data': {
+        'node': 'tts', 'dev_id': 'dev-0001', 'topic': 'chat/response', 'type': 'json',
+        'data': {'chat_id': 12, 'chat_end': 0, 'seg_end': 0, 'text': ' ', 'audio': {
+            'samplerate': 16000, 'bits': 16, 'channels': 1, 'format': 'mp3',
+            'buff': base64.b64encode(os.urandom(512)).decode()}}}}
+
+    number = 20000
+    for msg_name, msg in [('request/asr', asr_msg), ('chat/response', tts_msg)]:
+        for codec in CODECS.values():
+            body = codec.encode(msg)
+            encode_t = timeit.timeit(lambda: codec.encode(msg), number=number) / number
+            decode_t = timeit.timeit(lambda: codec.decode(body), number=number) / number
+            print('{:14} {:8} size: {:5} bytes  encode: {:6.2f} us  decode: {:6.2f} us'.format(
+                msg_name, codec.name, len(body), encode_t * 1e6, decode_t * 1e6))
@@ -1,9 +1,14 @@
 # coding=utf-8
 """RabbitMQ通信
 """
-import json
 import pika
 
+from utility.mlogging import logger
+from common.mq_codec import get_codec, get_decoder
+
+# 二进制消息体类型, 消息其它字段保存在AMQP headers中
+BINARY_CONTENT_TYPE = 'application/octet-stream'
+
 class MqTransport():
     """RabbitMQ消息发布订阅
     """
@@ -31,6 +36,10 @@ class MqTransport():
         self.queue_id = self.queue_result.method.queue
         self.receive_active = False
 
+        # 消息编码方式 json/orjson/msgpack, 通过content_type告知接收端
+        self.codec = get_codec(config.get('codec', 'json'))
+        self._properties = pika.BasicProperties(content_type=self.codec.content_type)
+
 
     def close(self):
         """关闭连接
@@ -42,8 +51,9 @@ class MqTransport():
     def _send(self, routing_key: str, msg: dict):
         """序列化后发送
         """
-        json_str = json.dumps(msg)
-        self.channel.basic_publish(exchange=self.exchange_id, routing_key=routing_key, body=json_str)
+        body = self.codec.encode(msg)
+        self.channel.basic_publish(exchange=self.exchange_id, routing_key=routing_key, body=body,
+            properties=self._properties)
 
 
     def send_str(self, routing_key: str, msg: str):
@@ -61,6 +71,18 @@ class MqTransport():
         self._send(routing_key, data)
 
 
+    def send_bytes(self, routing_key: str, msg: dict):
+        """发布二进制消息, 消息体为msg['data']原始数据, 不进行序列化
+        Args:
+            routing_key 路由
+            msg  {'node':, 'topic':, 'type': 'binary', 'data': bytes, ...}
+        """
+        headers = {key: value for key, value in msg.items() if key != 'data' and value is not None}
+        properties = pika.BasicProperties(content_type=BINARY_CONTENT_TYPE, headers=headers)
+        self.channel.basic_publish(exchange=self.exchange_id, routing_key=routing_key,
+            body=msg['data'], properties=properties)
+
+
     def enable_receive(self, routing_keys = None):
         """绑定监听队列
         Args:
@@ -74,6 +96,58 @@ class MqTransport():
         self.receive_active = True
 
 
+    def enable_consume(self, on_message, routing_keys = None):
+        """绑定监听队列,以推送方式(basic_consume)接收消息
+        Args:
+            on_message    消息回调函数, 参数格式与receive()返回值相同
+            routing_keys  要监听的路由,默认监听交换机下的所有路由
+        Note:
+            回调在process_events()所在线程中执行
+        """
+        self.enable_receive(routing_keys)
+
+        def _on_message(channel, method, properties, body):
+            result = self._decode(method.routing_key, properties, body)
+            if result is not None:
+                on_message(result)
+
+        self.channel.basic_consume(queue=self.queue_id, on_message_callback=_on_message, auto_ack=True)
+
+
+    def process_events(self, time_limit=None):
+        """处理连接事件(发送心跳, 分发推送消息), 无事件时阻塞
+        Args:
+            time_limit  最长阻塞时间(s), None一直阻塞直到有事件
+        """
+        self.connection.process_data_events(time_limit=time_limit)
+
+
+    def add_callback_threadsafe(self, callback):
+        """从其它线程请求在连接所在线程执行回调(唯一线程安全的接口)
+        Args:
+            callback  无参数回调函数
+        """
+        self.connection.add_callback_threadsafe(callback)
+
+
+    def _decode(self, routing_key: str, properties, body):
+        """反序列化接收到的消息
+        Returns:
+            None(不支持的编码) or {'routing_key':, 'type':, 'data': }
+        """
+        if properties.content_type == BINARY_CONTENT_TYPE:
+            data = dict(properties.headers or {})
+            data['data'] = body
+            return {'routing_key': routing_key, 'type': 'object', 'data': data}
+        decoder = get_decoder(properties.content_type)
+        if decoder is None:
+            logger.warning('unsupported content type: {}, drop msg.'.format(properties.content_type))
+            return None
+        result = decoder.decode(body)
+        result['routing_key'] = routing_key
+        return result
+
+
     def receive(self):
         """单次接收消息,主动查询非阻塞
         """
@@ -83,7 +157,4 @@ class MqTransport():
         method, properties, body = self.channel.basic_get(queue=self.queue_id, auto_ack=True)
         if method is None:
             return None
-        result = {'routing_key': method.routing_key}
-        data = json.loads(body)
-        result.update(data)
-        return result
+        return self._decode(method.routing_key, properties, body)
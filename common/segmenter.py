@@ -0,0 +1,243 @@
+# coding=utf-8
+"""增量断句
+每次追加文本只扫描新增部分, 记录最后一个断句位置, 流式输出时总开销与文本长度成线性关系。
+断句符号按语言配置, 见LANGUAGES。
+未断句文本不超过threshold_min时不扫描(此时不会断句), 追加文本不含断句符号时直接跳过。
+"""
+import re
+from functools import lru_cache
+
+
+# 各语言断句配置
+#   boundaries     断句符号
+#   abbreviations  英文缩写, 其后的'.'不断句
+# Note: 中文与原断句规则一致, 全角逗号'，'不作为断句符号(避免tts片段过碎, 保持原有分句及语音停顿)
+LANGUAGES = {
+    'zh': {
+        'boundaries': "。？！,.?",
+    },
+    'ar': {
+        # 阿拉伯语问号、逗号、句号
+        'boundaries': "。？！,.?؟،۔",
+    },
+    'en': {
+        'boundaries': ".?!,;",
+        'abbreviations': ('mr', 'mrs', 'ms', 'dr', 'prof', 'sr', 'jr', 'st', 'vs', 'etc',
+            'e.g', 'i.e', 'a.m', 'p.m', 'u.s', 'no', 'fig', 'inc', 'ltd', 'co'),
+    },
+}
+
+
+@lru_cache(maxsize=None)
+def _compile(boundaries: str, abbreviations: tuple):
+    """断句符号正则及缩写集合, 按配置缓存(每轮回答创建断句器)
+    """
+    return re.compile('[{}]'.format(re.escape(boundaries))), frozenset(abbreviations)
+
+
+class Segmenter:
+    """语段分句输出
+    1. 文本长度超过threshold_min后, 在最后一个断句符号处断句
+    2. 断句片段长度超过threshold_min时输出
+    3. 未断句文本长度超过threshold_max时强制输出
+    """
+    def __init__(self, threshold_min, threshold_max, boundaries="。？！,.?", abbreviations=()):
+        """
+        Args:
+            threshold_min  断句最小长度
+            threshold_max  未断句文本最大长度
+            boundaries     断句符号
+            abbreviations  缩写(小写), 其后的'.'不断句
+        """
+        self.threshold_min = threshold_min
+        self.threshold_max = threshold_max
+        self._pattern, self.abbreviations = _compile(boundaries, tuple(abbreviations))
+
+        self.sentence = ""  # 保存未断句文本
+        self.current_sentence = ""  # 保存当前句子片段
+        # 已扫描位置
+        self._scan_index = 0
+        # 最后一个断句位置(断句符号之后), 0为无
+        self._cut_index = 0
+
+
+    @classmethod
+    def from_language(cls, language: str, threshold_min, threshold_max):
+        """根据语言创建断句器, 不支持的语言使用中文配置
+        Args:
+            language  zh / ar / en
+        """
+        config = LANGUAGES.get(language, LANGUAGES['zh'])
+        return cls(threshold_min, threshold_max, **config)
+
+
+    def _is_boundary(self, index: int):
+        """'.'是否为断句符号(排除小数点和缩写)
+        Returns:
+            True/False, None(位于文本末尾, 需要后续文本判断)
+        """
+        if index + 1 == len(self.sentence):
+            return None
+        if index > 0 and self.sentence[index - 1].isdigit() and self.sentence[index + 1].isdigit():
+            return False
+        if self.abbreviations:
+            start = index
+            while start > 0 and (self.sentence[start - 1].isalpha() or self.sentence[start - 1] == '.'):
+                start -= 1
+            if self.sentence[start:index].lower() in self.abbreviations:
+                return False
+        return True
+
+
+    def _scan(self):
+        """扫描新增文本, 更新最后一个断句位置
+        """
+        # 新增文本不含断句符号(流式输出的多数token)
+        if self._pattern.search(self.sentence, self._scan_index) is None:
+            self._scan_index = len(self.sentence)
+            return
+        for match in self._pattern.finditer(self.sentence, self._scan_index):
+            index = match.start()
+            if self.sentence[index] == '.':
+                is_boundary = self._is_boundary(index)
+                if is_boundary is None:
+                    # 末尾的'.'等待后续文本再判断
+                    self._scan_index = index
+                    return
+                if not is_boundary:
+                    continue
+            self._cut_index = index + 1
+        self._scan_index = len(self.sentence)
+
+
+    def update(self, text):
+        """
+        追加字符串到当前句子，并返回最新的断句片段，若没有则返回None。
+        """
+        self.sentence += text
+        ## 断句, 未超过最小长度时延后扫描
+        if len(self.sentence) > self.threshold_min:
+            self._scan()
+            if self._cut_index > 0:
+                self.current_sentence += self.sentence[:self._cut_index]
+                self.sentence = self.sentence[self._cut_index:]
+                self._scan_index -= self._cut_index
+                self._cut_index = 0
+        elif not self.current_sentence:
+            return None
+
+        sentence = None
+        if len(self.current_sentence) > self.threshold_min:
+            sentence = self.current_sentence
+            self.current_sentence = ""
+
+        if len(self.sentence) > self.threshold_max:
+            sentence = (sentence or "") + self.current_sentence + self.sentence
+            self._reset()
+
+        return sentence
+
+
+    def flush(self, text=''):
+        """清空输出,用在句子结束时
+        Args:
+            text: 清空时附带输入的字串
+        """
+        sentence = self.current_sentence + self.sentence + text
+        # 清空本轮数据
+        self._reset()
+        return sentence
+
+
+    def _reset(self):
+        self.current_sentence = ""
+        self.sentence = ""
+        self._scan_index = 0
+        self._cut_index = 0
+
+
+if __name__=='__main__':
+    # 断句性能测试: 10k token流(每token 2字符), 与逐token全量扫描对比
+    import timeit
+
+    class FullScanSegmenter:
+        """每次追加后扫描全部未断句文本(旧实现)
+        """
+        def __init__(self, threshold_min, threshold_max):
+            self.threshold_min = threshold_min
+            self.threshold_max = threshold_max
+            self.sentence = ""
+            self.current_sentence = ""
+
+        def update(self, text):
+            self.sentence += text
+            if len(self.sentence) > self.threshold_min:
+                split_indexs = [i for i in range(len(self.sentence)) if self.sentence[i] in "。？！,.?"]
+                if len(split_indexs) > 0:
+                    cut_index = split_indexs[-1]
+                    self.current_sentence += self.sentence[:cut_index+1]
+                    self.sentence = self.sentence[cut_index+1:]
+            sentence = None
+            if len(self.current_sentence) > self.threshold_min:
+                sentence = self.current_sentence
+                self.current_sentence = ""
+            if len(self.sentence) > self.threshold_max:
+                sentence = self.sentence
+                self.current_sentence = ""
+                self.sentence = ""
+            return sentence
+
+        def flush(self, text=''):
+            sentence = self.current_sentence + self.sentence + text
+            self.current_sentence = ""
+            self.sentence = ""
+            return sentence
+
+    # 典型回答: 30-100字(prompt限制回答字数), 每轮回答新建断句器
+    replies = [
+        "我是个聪明自信的AI，擅长快速解答问题，帮你提供简洁明了的答案。",
+        "有一个小男孩叫小明，他非常喜欢探险。一天，他决定去探索森林深处。在那里，他发现了一个神秘的洞穴。小明充满好奇，毫不犹豫地走了进去。",
+        "Sure. I can help with that, what do you need?",
+    ]
+
+    def run_replies(factory, tokens):
+        for _ in range(100):
+            segmenter = factory()
+            for token in tokens:
+                segmenter.update(token)
+            segmenter.flush()
+
+    for reply in replies:
+        tokens = [reply[i:i + 2] for i in range(0, len(reply), 2)]
+        number = 5
+        full_t = timeit.timeit(lambda: run_replies(lambda: FullScanSegmenter(10, 100), tokens), number=number) / number
+        inc_t = timeit.timeit(lambda: run_replies(lambda: Segmenter.from_language('zh', 10, 100), tokens), number=number) / number
+        print('reply {:3} chars x100  full scan: {:6.2f} ms  incremental: {:6.2f} ms'.format(
+            len(reply), full_t * 1e3, inc_t * 1e3))
+
+    # 10k token流. 短句: 断句符号密集; 长句: 每400字一个断句符号(全角逗号不断句)
+    texts = {
+        'short': "有一个小男孩叫小明，他非常喜欢探险。一天，他决定去探索森林深处。在那里，他发现了一个神秘的洞穴。" * 200,
+        'long': ("他发现了一个神秘的洞穴，" * 33 + "好。") * 50,
+    }
+
+    def run(segmenter, tokens):
+        for token in tokens:
+            segmenter.update(token)
+
+    for name, text in texts.items():
+        tokens = [text[i:i + 2] for i in range(0, 20000, 2)]
+        for threshold_min, threshold_max in [(10, 100), (50, 1000)]:
+            number = 5
+            full_t = timeit.timeit(lambda: run(FullScanSegmenter(threshold_min, threshold_max), tokens), number=number) / number
+            inc_t = timeit.timeit(lambda: run(Segmenter.from_language('zh', threshold_min, threshold_max), tokens), number=number) / number
+            print('{:5} sentences {} tokens min: {:3} max: {:5}  full scan: {:8.2f} ms  incremental: {:6.2f} ms'.format(
+                name, len(tokens), threshold_min, threshold_max, full_t * 1e3, inc_t * 1e3))
+
+    # 英文缩写及小数
+    segmenter = Segmenter.from_language('en', 10, 200)
+    for t in "Dr. Smith paid 3.5 dollars, e.g. for coffee. Then he left!":
+        s = segmenter.update(t)
+        if s is not None:
+            print(s)
+    print(segmenter.flush())
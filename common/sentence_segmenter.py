@@ -1,75 +1,15 @@
 # coding=utf-8
 """语段断句
 """
+from common.segmenter import Segmenter, LANGUAGES
 
-class SentenceSegmenter:
-    """语段分句输出
+
+class SentenceSegmenter(Segmenter):
+    """语段分句输出(中文断句配置)
     """
     def __init__(self, threshold_min, threshold_max):
+        super().__init__(threshold_min, threshold_max, **LANGUAGES['zh'])
 
-        self.threshold_min = threshold_min 
-        self.threshold_max = threshold_max 
-        self.sentence = ""  # 保存原始句子
-        self.current_sentence = ""  # 保存当前句子片段
-
-    def filter(self, sentence: str):
-        """去除特殊符号
-        """
-        print(sentence)
-
-
-    def update(self, text):
-        """
-        追加字符串到当前句子，并返回最新的断句片段，若没有则返回None。
-        """
-        self.sentence += text
-        if len(self.sentence) > self.threshold_min:
-            # 找到最近的标点符号位置
-            split_indexs = []
-            for i in range(0, len(self.sentence), 1):
-                if self.sentence[i] in "。？！,.?":
-                    # print('find split:{}'.format(i))
-                    split_indexs.append(i)
-            ## 断句
-            if len(split_indexs) > 0: 
-                cut_index = split_indexs[-1]
-                # print('cut index: ', cut_index)
-                self.current_sentence += self.sentence[:cut_index+1]
-                # print('current sentence: ', self.current_sentence)
-                self.sentence = self.sentence[cut_index+1:]
-                # print('self sentence: ', self.sentence)
-
-        sentence = None
-        if len(self.current_sentence) > self.threshold_min: 
-            sentence = self.current_sentence
-            self.current_sentence = ""
-
-        if len(self.sentence) > self.threshold_max:
-            sentence = self.sentence
-            self.current_sentence = ""
-            self.sentence = ""
-
-        # sentence = self.filter(sentence)
-        return sentence
-
-
-    def flush(self, text=''):
-        """清空输出,用在句子结束时
-        Args:
-            text: 清空时附带输入的字串
-        """
-        sentence = ""
-        if self.current_sentence != '':  # 当前断句可能未输出
-            sentence += self.current_sentence
-
-        sentence += self.sentence 
-        sentence += text
-        # 清空本轮数据
-        self.current_sentence = ""
-        self.sentence = ""
-        # sentence = self.filter(sentence)
-        return sentence
-        
 
 if __name__=='__main__':
 
@@ -87,4 +27,3 @@ if __name__=='__main__':
         if s is not None:
             print(s)  # 输出最新的断句片段
     print(segmenter.flush(text[-1]))  # 输出最新的断句片段
-
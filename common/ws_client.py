@@ -2,9 +2,12 @@
 """websocket client
 """
 # import json
-from typing import Union
+import time
+import threading
+from typing import Callable, Union
 from tornado.ioloop import IOLoop, PeriodicCallback
 from tornado import gen
+from tornado.queues import Queue
 from tornado.websocket import websocket_connect
 from tornado.httpclient import HTTPRequest
 
@@ -16,11 +19,16 @@ from common.ws_enum_types import WsEnumTypes
 
 
 class WsClient():
-    def __init__(self, url: Union[str, HTTPRequest], que_max_len=10):
+    """websocket客户端, 在独立线程中运行ioloop
+    1. 发送: 调用线程通过IOLoop.add_callback(线程安全)将消息放入发送队列, 发送协程等待队列, 无轮询
+    2. 接收: 每个连接一个接收协程, 消息写入接收队列并唤醒等待读取的调用线程(read), 调用接收通知(set_receive_notify)
+    """
+    def __init__(self, url: Union[str, HTTPRequest, Callable], que_max_len=10, ping_interval=0):
         """
         Args:
-            url: str or httpclient.HTTPRequest
+            url: str or httpclient.HTTPRequest or 创建url的函数(每次连接时调用, 用于带时效签名的url)
             que_max_len   队列缓冲区最大值
+            ping_interval 连接健康检测(ping)间隔(s), 超时无响应自动断开, 0不检测
 
         Example:
             header = {"Authorization": f"Bearer"}
@@ -31,16 +39,28 @@ class WsClient():
         self.url = url
         # self.timeout = timeout
 
-        self.send_que = deque() 
+        # ioloop启动前提交的消息, 启动后转入发送队列
+        self.send_que = deque()
         self.send_que_max_len = que_max_len
+        # 发送队列(tornado.queues.Queue), 只在ioloop线程中访问
+        self._send_queue = None
+        self._send_lock = threading.Lock()
 
         self.receive_que = deque()
         self.receive_que_max_len = que_max_len
+        # 唤醒等待读取的调用线程
+        self._receive_cond = threading.Condition()
+        # 接收通知, 消息写入接收队列后调用(ioloop线程)
+        self._receive_notify = None
 
         self.ws = None
+        self.ping_interval = ping_interval
+        # 是否正在连接
+        self.connecting = False
+        # 最近一次收发数据时间, 用于空闲检测
+        self.last_active = time.time()
 
         self.keep_alive_task = False
-        self.send_task = None
         self.ioloop = None
 
 
@@ -48,12 +68,27 @@ class WsClient():
         self.keep_alive_enable = enable
 
 
+    def set_receive_notify(self, callback):
+        """设置接收通知, 调用者无需轮询auto_read
+        Args:
+            callback  无参数回调, 在ioloop线程中执行, 需线程安全且不阻塞(如threading.Event.set)
+        """
+        self._receive_notify = callback
+
+
     def run(self, connect = False, keep_alive_enable = False):
         """启动客户端
         Args:
             connect 是否连接
         """
-        self.ioloop = IOLoop.instance()
+        ioloop = IOLoop.current()
+
+        ## 创建发送队列, 转入启动前提交的消息
+        with self._send_lock:
+            self._send_queue = Queue()
+            while len(self.send_que) > 0:
+                self._send_queue.put_nowait(self.send_que.popleft())
+            self.ioloop = ioloop
 
         ## ws连接
         if connect:
@@ -64,63 +99,87 @@ class WsClient():
             self.keep_alive_task = PeriodicCallback(self._keep_alive_callback, 5000)
             self.keep_alive_task.start()
 
-        ## 创建自动发送定时任务
-        self.send_task = PeriodicCallback(self._execute_callback, 50)
-        self.receive_task = PeriodicCallback(self._receive_callback, 50)
-
-        self.send_task.start()
-        self.receive_task.start()
+        ## 启动发送协程
+        ioloop.spawn_callback(self._execute_callback)
 
-        self.ioloop.start()
+        ioloop.start()
 
 
     def close(self):
         """退出客户端
         """
-        if self.send_task is not None:
-            if self.send_task.is_running():
-                self.send_task.stop()
         if self.ioloop is not None:
-            self.ioloop.stop()
+            self.ioloop.add_callback(self.ioloop.stop)
         logger.info("ws client exit.")
 
 
     def connect_close(self):
         """关闭连接
         """
+        if self.ioloop is None:
+            return
+        self.ioloop.add_callback(self._connect_close)
+
+
+    def _connect_close(self):
         if self.ws is not None:
             self.ws.close()
             logger.info("ws connect close.")
 
 
+    def is_connected(self):
+        """是否已连接
+        """
+        return self.ws is not None
+
+
+    def is_connecting(self):
+        """是否正在连接
+        """
+        return self.connecting
+
+
+    def idle_time(self):
+        """空闲时长(s)
+        """
+        return time.time() - self.last_active
+
+
     @gen.coroutine # 将普通的生成器函数转换为Tornado协程
     def connect(self):
         logger.info("ws trying to connect")
+        self.connecting = True
         try:
-            self.ws = yield websocket_connect(self.url)
+            url = self.url() if callable(self.url) else self.url
+            self.ws = yield websocket_connect(url, ping_interval=self.ping_interval or None)
         except Exception as e:
             logger.error("ws connection error: {}".format(e))
         else:
             logger.info("ws connected")
+            self.last_active = time.time()
             self._write_receive_que(WsEnumTypes.STATUS_CONNECTED)
+            IOLoop.current().spawn_callback(self._receive_callback, self.ws)
+        finally:
+            self.connecting = False
 
 
     @gen.coroutine
-    def _receive_callback(self):
-        """ws数据接收
+    def _receive_callback(self, ws):
+        """ws数据接收, 连接断开后退出
+        Args:
+            ws  websocket连接
         """
         while True:
-            yield gen.sleep(0.001)
-            if self.ws == None:
-                continue
-            msg = yield self.ws.read_message()
+            msg = yield ws.read_message()
             if msg is None:
                 logger.info("ws connection closed")
-                self.ws = None
+                if self.ws is ws:
+                    self.ws = None
                 ## 返回连接断开消息
                 self._write_receive_que(WsEnumTypes.STATUS_CLOSE)
                 break
             # print('ws receive:', msg)
+            self.last_active = time.time()
             # 写入消息接收队列
             self._write_receive_que(WsEnumTypes.STATUS_MSG_OK, msg)
 
@@ -138,31 +197,29 @@ class WsClient():
 
     @gen.coroutine
     def _execute_callback(self, audo_connect = True):
-        """读取队列内容(str msg)并发送
+        """等待发送队列内容(str msg)并发送
             1. 若有消息需要发送且,检测到连接断开,会先自动连接
         Note: 若连接断未及时检测到，会存在发送不成功的情形
         """
         while True:
-            yield gen.sleep(0.001)
-            data = Udeque.read_deque(self.send_que, pop=True)
-            if data is None:
-                yield gen.sleep(0.005)  # 延时5ms
-                continue
+            data = yield self._send_queue.get()
             status = data['status']
             msg = data['msg']
 
             ## 判断是否需要执行重连操作
-            if status == WsEnumTypes.ACTION_CONNECT or (msg is not None and self.ws == None and audo_connect):
+            if status == WsEnumTypes.ACTION_CONNECT and self.ws is not None:
+                # 已连接(如连接池预热), 无需重连
+                self.connecting = False
+            elif status == WsEnumTypes.ACTION_CONNECT or (msg is not None and self.ws == None and audo_connect):
                 logger.info("ws connect ...")
-                yield self.connect()
                 # 等待连接完成
-                while True:
-                    yield gen.sleep(0.01)  # 延时10ms
-                    if self.ws is not None:
-                        break
+                yield self.connect()
+                if self.ws is None:
+                    logger.warning("ws connect fail.")
             # print('send', msg)
             ## 进行消息发送
             if msg is not None and self.ws is not None:
+                self.last_active = time.time()
                 if type(msg) is bytes:
                     yield self.ws.write_message(msg, True) #注意开启binary模式
                 else:
@@ -178,7 +235,11 @@ class WsClient():
         data = {}
         data['status'] = status
         data['msg'] = msg
-        Udeque.write_deque(self.receive_que, data, self.receive_que_max_len)
+        with self._receive_cond:
+            Udeque.write_deque(self.receive_que, data, self.receive_que_max_len)
+            self._receive_cond.notify_all()
+        if self._receive_notify is not None:
+            self._receive_notify()
 
 
     def _auto_execute(self, status, msg=None):
@@ -190,7 +251,21 @@ class WsClient():
         data = {}
         data['status'] = status
         data['msg'] = msg
-        Udeque.write_deque(self.send_que, data, self.send_que_max_len)
+        with self._send_lock:
+            if self.ioloop is None:
+                # ioloop未启动, 暂存
+                Udeque.write_deque(self.send_que, data, self.send_que_max_len)
+                return
+        self.ioloop.add_callback(self._put_send_queue, data)
+
+
+    def _put_send_queue(self, data):
+        """写入发送队列(ioloop线程), 超出最大长度时丢弃最早的消息
+        """
+        if self._send_queue.qsize() >= self.send_que_max_len:
+            logger.warning('ws send queue length[{}] out of range, auto pop data.'.format(self._send_queue.qsize()))
+            self._send_queue.get_nowait()
+        self._send_queue.put_nowait(data)
 
 
     def auto_send(self, msg):
@@ -208,10 +283,23 @@ class WsClient():
         """
         return Udeque.read_deque(self.receive_que, pop)
 
+
+    def read(self, timeout=None):
+        """等待并读取接收队列的消息, 有消息时立即唤醒
+        Args:
+            timeout  最长等待时间(s), None一直等待
+        Returns:
+            None(超时) or 数据消息
+        """
+        with self._receive_cond:
+            self._receive_cond.wait_for(lambda: len(self.receive_que) > 0, timeout)
+            return Udeque.read_deque(self.receive_que, pop=True)
+
     
     def auto_connect(self):
         """自动连接,写入连接命令到队列
         Returns:
         """
+        self.connecting = True
         self._auto_execute(WsEnumTypes.ACTION_CONNECT)
 
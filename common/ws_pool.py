@@ -0,0 +1,148 @@
+# coding=utf-8
+"""websocket客户端池
+"""
+import time
+from collections import deque
+
+from utility.mlogging import logger
+
+
+class WsClientPool():
+    """ws客户端池, 每个客户端对应一个ws连接, 一次只服务一个请求
+    1. 预热: 保持warm_size个空闲连接, 请求到来时无需等待连接建立
+    2. 空闲检测: 超出预热数量的空闲连接, 空闲超过idle_timeout后断开
+    3. 后台重连: 预热连接断开(服务器关闭或健康检测失败)后自动重连
+    客户端需实现: launch() close() auto_connect() connect_close()
+                 is_connected() is_connecting() idle_time() set_receive_notify()
+    Note:
+        只在节点主线程中使用, 连接操作在客户端线程中异步执行
+    """
+    def __init__(self, factory, size: int, warm_size=0, idle_timeout=0, ping_interval=0):
+        """
+        Args:
+            factory        客户端创建函数 factory(ping_interval)
+            size           客户端数量
+            warm_size      预热(保持连接)的空闲客户端数量
+            idle_timeout   空闲连接断开时间(s), 0不断开
+            ping_interval  连接健康检测(ping)间隔(s), 0不检测
+        """
+        self.size = size
+        self.warm_size = min(warm_size, size)
+        self.idle_timeout = idle_timeout
+        self.ping_interval = ping_interval
+        self.clients = [factory(ping_interval) for _ in range(size)]
+        self._idle = deque(self.clients)
+
+        # 维护任务执行间隔(s)
+        self._maintain_interval = 1
+        self._maintain_time = 0
+
+
+    @classmethod
+    def from_config(cls, factory, config: dict):
+        """根据配置创建连接池
+        Args:
+            factory  客户端创建函数 factory(ping_interval)
+            config   连接池配置 {'size':, 'warm_size':, 'idle_timeout':, 'ping_interval': }
+        """
+        return cls(factory, config.get('size', 1), warm_size=config.get('warm_size', 0),
+            idle_timeout=config.get('idle_timeout', 0), ping_interval=config.get('ping_interval', 0))
+
+
+    def set_receive_notify(self, callback):
+        """设置所有客户端的接收通知, 有响应可读取(get_result)时调用, 用于唤醒节点主循环
+        Args:
+            callback  无参数回调, 在客户端线程中执行, 需线程安全且不阻塞
+        """
+        for client in self.clients:
+            client.set_receive_notify(callback)
+
+
+    def launch(self):
+        """启动所有客户端, 并建立预热连接
+        """
+        for client in self.clients:
+            client.launch()
+        self.prewarm(self.warm_size)
+        logger.info('ws client pool launch, size: {}, warm size: {}'.format(self.size, self.warm_size))
+
+
+    def close(self):
+        """退出所有客户端
+        """
+        for client in self.clients:
+            client.close()
+
+
+    def acquire(self):
+        """获取空闲客户端, 优先使用已连接的客户端
+        Returns:
+            None(无空闲客户端) or client
+        """
+        if len(self._idle) == 0:
+            return None
+        client = None
+        for index in range(len(self._idle)):
+            if self._idle[index].is_connected():
+                client = self._idle[index]
+                del self._idle[index]
+                break
+        if client is None:
+            client = self._idle.popleft()
+        # 补充预热连接
+        self.prewarm(self.warm_size)
+        return client
+
+
+    def release(self, client, close=False):
+        """归还客户端
+        Args:
+            client  客户端
+            close   是否关闭连接(异常时使用)
+        """
+        if close:
+            client.connect_close()
+        self._idle.append(client)
+
+
+    def idle_count(self):
+        """空闲客户端数量
+        """
+        return len(self._idle)
+
+
+    def prewarm(self, count=1):
+        """确保至少count个空闲客户端已连接或正在连接(不阻塞)
+        Args:
+            count  预连接数量
+        """
+        ready = 0
+        for client in self._idle:
+            if client.is_connected() or client.is_connecting():
+                ready += 1
+        for client in self._idle:
+            if ready >= count:
+                break
+            if not client.is_connected() and not client.is_connecting():
+                client.auto_connect()
+                ready += 1
+
+
+    def maintain(self):
+        """连接维护, 在节点主循环中调用
+        """
+        now = time.time()
+        if now - self._maintain_time < self._maintain_interval:
+            return
+        self._maintain_time = now
+
+        ## 关闭超出预热数量的空闲连接
+        if self.idle_timeout > 0:
+            connected = [client for client in self._idle if client.is_connected()]
+            for client in connected[self.warm_size:]:
+                if client.idle_time() > self.idle_timeout:
+                    logger.info('close idle connection, idle: {:.1f}s'.format(client.idle_time()))
+                    client.connect_close()
+
+        ## 预热连接断开后重连
+        self.prewarm(self.warm_size)
@@ -3,40 +3,32 @@ from collections import deque
 import tornado.web
 from tornado.ioloop import IOLoop
 import tornado.websocket
-from tornado.ioloop import PeriodicCallback
-from tornado.websocket import WebSocketHandler
+from tornado.websocket import WebSocketHandler, WebSocketClosedError
 import asyncio
 
 from utility.mlogging import logger
 
-from common.u_deque import Udeque  
+from common.u_deque import Udeque
 
 
 
 class WsServerBase(WebSocketHandler):
-    """tornado websocket server
-    Args: 
+    """tornado websocket server, 每个连接对应一个实例(会话)
+    Args:
     """
-    # 当前连接
-    active_connections = 0
-    # 最大连接
-    max_connections = 1
-
-    def initialize(self, send_que: deque, receive_que: deque, que_max_len, close_event: asyncio.Event):
+    def initialize(self, server):
         """连接初始化(每次连接成功会调用)
+        Args:
+            server  所属WsServer
         """
-        self.que_max_len = que_max_len
-        # 保存待发送信息
-        self.send_que = send_que
-        self.send_que_max_len = self.que_max_len
-        # 保存接收信息
-        self.receive_que = receive_que
-        self.receive_que_max_len = self.que_max_len
-
-        self._close_event = close_event
-
-        self.close_task = None
-        self.send_task = None
+        self.server = server
+        # 连接绑定的设备ID(收到设备消息后绑定)
+        self.dev_id = None
+        # 本连接待发送信息
+        self.send_que = deque()
+        self.send_que_max_len = server.que_max_len
+        # 发送任务是否在执行
+        self._sending = False
 
 
     async def _async_send(self, msg):
@@ -49,56 +41,48 @@ class WsServerBase(WebSocketHandler):
         else:
             await self.write_message(msg)
 
-    
-    async def open(self):
+
+    def open(self):
         """ 连接成功回调
         """
-        if WsServerBase.active_connections >= WsServerBase.max_connections:
+        if not self.server.add_connection(self):
             logger.warning('Connection refused: maximum number of connections reached.')
             self.close()  # Close the connection if the limit is reached
             return
-
-        WsServerBase.active_connections += 1
-        logger.info('ws connected. Active connections: {}'.format(WsServerBase.active_connections))
-
+        # 支持连接时通过url参数绑定设备, 如: /linker-dev?dev_id=xxx
+        dev_id = self.get_argument('dev_id', None)
+        if dev_id is not None:
+            self.server.bind_session(self, dev_id)
         # self.set_nodelay(True)  #小包发送,降低延迟（可能占用更多带宽）
-        # 启动异步定时器，每秒 n ms执行一次回调函数
-        self.send_task = PeriodicCallback(self._send_callback, 50)
-        self.send_task.start()
-
-        self.close_task = PeriodicCallback(self._close_callback, 50)
-        self.close_task.start()
-
-
-    async def _send_callback(self):
-        """异步消息自动发送
-        """
-        while True:
-            await asyncio.sleep(0.005)
-            msg = Udeque.read_deque(self.send_que, pop=False)
-            if msg is not None:
-                await self._async_send(msg)
-                _ = Udeque.read_deque(self.send_que, pop=True)
-            else:
-                break
 
 
-    def _close(self):
-        """关闭服务器
+    def send(self, msg):
+        """写入本连接发送缓冲区并启动发送(需在ioloop线程调用)
+        Args:
+            msg 复合类型消息数据
         """
-        self.close()  # 关闭连接
-        if self.send_task is not None:
-            if self.send_task.is_running():
-                self.send_task.stop()
-        if self.close_task is not None:
-            self.close_task.stop()
+        Udeque.write_deque(self.send_que, msg, self.send_que_max_len)
+        if not self._sending:
+            self._sending = True
+            IOLoop.current().spawn_callback(self._send_loop)
 
 
-    def _close_callback(self):
-        """ 主动关闭连接回调
+    async def _send_loop(self):
+        """发送缓冲区数据, 发送间隔控制设备接收频率, 各连接互不影响
         """
-        if self._close_event.is_set():
-            self._close()
+        try:
+            while True:
+                msg = Udeque.read_deque(self.send_que, pop=True)
+                if msg is None:
+                    break
+                await self._async_send(msg)
+                if self.server.send_interval > 0:
+                    await asyncio.sleep(self.server.send_interval)
+        except WebSocketClosedError:
+            logger.warning('ws send fail, connection closed. dev_id: {}'.format(self.dev_id))
+            self.send_que.clear()
+        finally:
+            self._sending = False
 
 
     def on_message(self, message):
@@ -106,66 +90,163 @@ class WsServerBase(WebSocketHandler):
         消息接收回调
         """
         # logger.info("ws receive: {}".format(message))
-        #将消息写入接收队列
-        Udeque.write_deque(self.receive_que, message, self.receive_que_max_len)
+        self.server.on_message(self, message)
 
 
     def on_close(self):
         """连接关闭回调
         """
-        WsServerBase.active_connections -= 1
-        logger.info('ws connection close. Active connections: {}'.format(WsServerBase.active_connections))
-        self._close()
+        self.server.remove_connection(self)
+        self.send_que.clear()
 
 
 class WsServer():
-    def __init__(self, url: str, port: int, que_max_len = 10):
+    def __init__(self, url: str, port: int, que_max_len = 10, max_connections = 1, send_interval = 0.0):
         """
         Args:
             url   addr, 如 '/'
-            port  server port 
+            port  server port
             que_max_len  缓冲队列最大长度
+            max_connections 最大连接数
+            send_interval  单个连接消息发送间隔(s), 控制设备接收频率
         """
         self.url = url
         self.port= port
 
         self.que_max_len = que_max_len
-        self.send_que = deque()
+        self.max_connections = max_connections
+        self.send_interval = send_interval
+        # 未设置接收回调时, 接收消息写入该队列
         self.receive_que = deque()
 
-        self.close_event = asyncio.Event()
+        # 所有连接
+        self.connections = set()
+        # 已绑定设备ID的连接 str(dev_id): WsServerBase
+        self.sessions = {}
+        # 消息接收回调, 参数(conn, message), 在ioloop线程中执行
+        self.receive_callback = None
+
+        self.ioloop = None
 
 
     def run(self):
         """ws server启动
         """
-        self.ioloop = IOLoop.instance()
-        app = tornado.web.Application([ 
-            tornado.web.url(self.url, WsServerBase, dict(send_que=self.send_que, receive_que=self.receive_que,
-            que_max_len=self.que_max_len, close_event=self.close_event) )]) 
+        asyncio.set_event_loop(asyncio.new_event_loop())
+        self.ioloop = IOLoop.current()
+        app = tornado.web.Application([
+            tornado.web.url(self.url, WsServerBase, dict(server=self))])
         app.listen(self.port)
-        logger.info('ws server is running on port {}'.format(self.port))
+        logger.info('ws server is running on port {}, max connections: {}'.format(self.port, self.max_connections))
         self.ioloop.start()
 
-    
+
     def close(self):
         """关闭连接并退出服务器
         """
-        self.close_event.set()
         if self.ioloop is not None:
-            self.ioloop.stop()
+            self.ioloop.add_callback(self._shutdown)
         logger.info("ws server exit.")
 
 
+    def _shutdown(self):
+        """关闭所有连接并停止ioloop(ioloop线程)
+        """
+        for conn in list(self.connections):
+            conn.close()
+        self.ioloop.stop()
+
+
+    def set_receive_callback(self, callback):
+        """设置消息接收回调
+        Args:
+            callback  回调函数 callback(conn, message), 在ioloop线程中执行
+        """
+        self.receive_callback = callback
+
+
+    def add_connection(self, conn: WsServerBase):
+        """新增连接
+        Returns:
+            True 成功  False 超出最大连接数
+        """
+        if len(self.connections) >= self.max_connections:
+            return False
+        self.connections.add(conn)
+        logger.info('ws connected. Active connections: {}'.format(len(self.connections)))
+        return True
+
+
+    def remove_connection(self, conn: WsServerBase):
+        """移除连接及其设备会话
+        """
+        if conn not in self.connections:
+            return
+        self.connections.discard(conn)
+        if conn.dev_id is not None and self.sessions.get(str(conn.dev_id)) is conn:
+            del self.sessions[str(conn.dev_id)]
+        logger.info('ws connection close, dev_id: {}. Active connections: {}'.format(conn.dev_id, len(self.connections)))
+
+
+    def bind_session(self, conn: WsServerBase, dev_id):
+        """绑定设备ID到连接,同一设备重连时替换旧连接(ioloop线程)
+        Note:
+            会话按str(dev_id)索引, url参数(字符串)与json消息(可能为数字)中的dev_id视为同一设备;
+            连接保存最近消息中的原始dev_id, 转发设备二进制帧时使用
+        """
+        if conn.dev_id == dev_id:
+            return
+        if conn.dev_id is not None and self.sessions.get(str(conn.dev_id)) is conn:
+            del self.sessions[str(conn.dev_id)]
+        conn.dev_id = dev_id
+        self.sessions[str(dev_id)] = conn
+        logger.info('ws session bind, dev_id: {}. Active sessions: {}'.format(dev_id, len(self.sessions)))
+
+
+    def on_message(self, conn: WsServerBase, message):
+        """连接接收到消息
+        """
+        if self.receive_callback is not None:
+            self.receive_callback(conn, message)
+        else:
+            Udeque.write_deque(self.receive_que, message, self.que_max_len)
+
+
+    def _send_to(self, dev_id, msg):
+        """发送消息到指定设备, dev_id为None时发送到所有连接(ioloop线程)
+        """
+        if dev_id is None:
+            for conn in self.connections:
+                conn.send(msg)
+            return
+        conn = self.sessions.get(str(dev_id))
+        if conn is None:
+            logger.warning('no session for dev_id: {}, drop msg.'.format(dev_id))
+            return
+        conn.send(msg)
+
+
+    def send_to(self, dev_id, msg):
+        """发送消息到指定设备(线程安全)
+        Args:
+            dev_id  设备ID, None发送到所有连接
+            msg 复合类型消息数据
+        """
+        if self.ioloop is None:
+            logger.warning('ws server not running, drop msg.')
+            return
+        self.ioloop.add_callback(self._send_to, dev_id, msg)
+
+
     def auto_send(self, msg):
-        """数据写入ws发送缓冲区, 自动发送
+        """发送消息到所有连接(线程安全)
         Args:
             msg 复合类型消息数据
         """
-        Udeque.write_deque(self.send_que, msg, self.que_max_len)
+        self.send_to(None, msg)
 
 
     def auto_read(self, pop=True):
-        """从ws接收缓冲区读取数据
+        """从ws接收缓冲区读取数据(未设置接收回调时有效)
         """
         return Udeque.read_deque(self.receive_que, pop)
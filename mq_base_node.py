@@ -11,6 +11,12 @@ from common.u_deque import Udeque
 from common.mq_transport import MqTransport
 
 
+# data字段为bytes, 以二进制消息体发送的消息类型
+#   binary  二进制数据(如音频帧), bridge以binary帧发送至设备
+#   wire    已编码的设备端json消息, bridge以text帧原样发送至设备
+BYTES_TYPES = ('binary', 'wire')
+
+
 def mq_close(func):
     """关闭rabbitmq连接
     """
@@ -48,12 +54,23 @@ class MqBaseNode:
         # 发送缓冲队列最大长度
         self.send_que_max_len = 10
 
+        # 接收方式: 'consume' 服务器推送(默认), 'poll' 主动查询(basic_get)
+        self.receive_mode = self.mq_config.get('receive_mode', 'consume')
+        # 接收到数据(mq消息或ws客户端响应)时置位, 用于唤醒等待中的节点主循环
+        self._wakeup_event = threading.Event()
+        # 推送模式下传输线程是否已就绪, 以及是否已请求发送
+        self._transport_ready = False
+        self._flush_pending = False
+
         # 线程退出控制信号
         self._transport_stop_event = threading.Event()
         # 创建子线程进行与其它节点进行数据交互
         self._transport_thread = threading.Thread(target=self.transport, 
             args=(self._transport_stop_event, self._send_que, self._receive_que))
 
+        # 发送过滤函数, 返回False的消息在发送前丢弃(传输线程中执行)
+        self._send_filter = None
+
         # rabbitmq发布订阅实例
         self.mqtr = None
 
@@ -65,6 +82,14 @@ class MqBaseNode:
         self.receive_que_max_len = max_len
 
 
+    def set_send_filter(self, send_filter):
+        """设置发送过滤函数, 用于丢弃缓冲区中已失效的消息(如已取消聊天的响应)
+        Args:
+            send_filter  send_filter(data_obj) -> bool, 在传输线程中执行, None不过滤
+        """
+        self._send_filter = send_filter
+
+
     def mqtr_close(self):
         """关闭连接
         """
@@ -77,6 +102,8 @@ class MqBaseNode:
         """退出数据传输线程,关闭连接
         """
         self._transport_stop_event.set()
+        # 唤醒阻塞中的传输线程
+        self._wakeup_transport(lambda: None)
         self._transport_thread.join()
 
 
@@ -91,38 +118,112 @@ class MqBaseNode:
         """
         # 创建mq传输实例
         self.mqtr = MqTransport(self.mq_config)
-        self.mqtr.enable_receive(routing_keys=self.listening_node)
-        logger.info('transport thread start, node: [{}] listenging: {}'.format(self.node_name, self.listening_node))
+        logger.info('transport thread start, node: [{}] listenging: {} mode: {}'.format(self.node_name, self.listening_node, self.receive_mode))
 
+        if self.receive_mode == 'poll':
+            self._transport_poll(stop_event, send_que)
+        else:
+            self._transport_consume(stop_event)
+
+        # 关闭连接
+        self._transport_ready = False
+        self.mqtr_close()
+
+
+    def _transport_consume(self, stop_event):
+        """推送模式: 消息由服务器推送, 发送由auto_send唤醒, 空闲时阻塞不占用CPU
+        """
+        self.mqtr.enable_consume(self._on_mq_receive, routing_keys=self.listening_node)
+        self._transport_ready = True
+        # 发送启动前已写入的消息
+        self._flush_send_que()
+        while not stop_event.is_set():
+            self.mqtr.process_events(time_limit=1)
+
+
+    def _transport_poll(self, stop_event, send_que):
+        """查询模式: 循环发送缓冲区消息并主动查询接收
+        """
+        self.mqtr.enable_receive(routing_keys=self.listening_node)
         while not stop_event.is_set():
             logger.debug('transport thread...')
             sleep(0.001)
             ##自动发送消息
             while True:
-                sleep(0.001)
                 msg_obj = Udeque.read_deque(send_que)
                 if msg_obj is not None:
-                    self.mqtr.send_obj(self.node_name, msg_obj)
+                    self._publish(msg_obj)
                 else:
                     break
             ##自动接收消息
             ret = self.mqtr.receive()
-            if ret is None:
-                continue
-            if ret['routing_key'] in self.listening_node:
-                logger.debug('write queue, receive from: {}'.format(ret['data']['node']))
-                Udeque.write_deque(receive_que, ret['data'], max_len=self.receive_que_max_len)
+            if ret is not None:
+                self._on_mq_receive(ret)
 
-        # 关闭连接
-        self.mqtr_close()
+
+    def _flush_send_que(self):
+        """发送缓冲区所有消息(在传输线程中执行)
+        """
+        self._flush_pending = False
+        while True:
+            msg_obj = Udeque.read_deque(self._send_que)
+            if msg_obj is None:
+                break
+            self._publish(msg_obj)
+
+
+    def _publish(self, msg_obj: dict):
+        """发布消息, type为binary/wire的消息以二进制消息体发送
+        """
+        if self._send_filter is not None and not self._send_filter(msg_obj):
+            logger.debug('send filter drop msg, topic: {}'.format(msg_obj.get('topic')))
+            return
+        if msg_obj.get('type') in BYTES_TYPES:
+            self.mqtr.send_bytes(self.node_name, msg_obj)
+        else:
+            self.mqtr.send_obj(self.node_name, msg_obj)
+
+
+    def _wakeup_transport(self, callback):
+        """请求传输线程执行回调(推送模式)
+        Returns:
+            True 请求成功  False 传输线程未就绪或请求失败
+        """
+        if not self._transport_ready:
+            return False
+        try:
+            self.mqtr.add_callback_threadsafe(callback)
+        except Exception as e:
+            logger.warning('wakeup transport fail: {}'.format(e))
+            return False
+        return True
+
+
+    def _on_mq_receive(self, ret: dict):
+        """接收到mq消息(传输线程中执行)
+        """
+        if ret['routing_key'] in self.listening_node:
+            logger.debug('write queue, receive from: {}'.format(ret['data']['node']))
+            self._on_receive(ret['data'])
+
+
+    def _on_receive(self, data_obj: dict):
+        """接收数据写入接收缓冲区并唤醒节点, 子类可重写以直接处理消息
+        """
+        Udeque.write_deque(self._receive_que, data_obj, max_len=self.receive_que_max_len)
+        self._wakeup_event.set()
 
 
     def auto_send(self, data_obj: dict):
         """写入数据到发送缓冲区，自动发送
         Args:
-            data_obj  待发送数据
+            data_obj  待发送数据, type为binary/wire时data字段为bytes, 不进行序列化
         """
         Udeque.write_deque(self._send_que, data_obj, max_len=self.send_que_max_len)
+        if self.receive_mode != 'poll' and not self._flush_pending:
+            self._flush_pending = True
+            if not self._wakeup_transport(self._flush_send_que):
+                self._flush_pending = False
 
 
     def auto_read(self, pop=True):
@@ -133,3 +234,24 @@ class MqBaseNode:
             None or data_obj        
         """
         return Udeque.read_deque(self._receive_que, pop)
+
+
+    def wait_read(self, timeout=None):
+        """等待并读取接收缓冲区数据,无数据时阻塞,不进行轮询
+        Args:
+            timeout  最长等待时间(s), None一直等待
+        Returns:
+            None or data_obj
+        """
+        msg_obj = self.auto_read()
+        if msg_obj is None and self._wakeup_event.wait(timeout):
+            # 唤醒后清除事件再读取, 之后写入的数据会再次唤醒; 由wakeup()唤醒时返回None, 由调用者处理客户端响应
+            self._wakeup_event.clear()
+            msg_obj = self.auto_read()
+        return msg_obj
+
+
+    def wakeup(self):
+        """唤醒等待中的节点主循环(线程安全), 用作ws客户端的接收通知
+        """
+        self._wakeup_event.set()
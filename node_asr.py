@@ -1,9 +1,10 @@
 # coding=utf-8
 # 在线ASR节点
 import sys
+import time
 import base64
 import json
-from time import sleep
+from collections import deque
 
 #1.日志系统初始化,配置log等级
 from utility import mlogging
@@ -13,14 +14,73 @@ from utility.mlogging import logger
 # from utility.keyboard import KBHit
 
 import audio.audio_common as ac
-from audio.opus_decoder import OpusDecoder
+from audio.opus_decoder import OpusDecoderPool
+from audio.vad import VoiceActivityDetector
+from common.audio_frame import unpack_frame
+from common.frame_buffer import FrameBuffer
+from common.ws_pool import WsClientPool
 
 from mq_base_node import MqBaseNode, mq_close
 from asr.volc_asr import VolcASR
 
 
+# 会话状态
+SESSION_WAIT_CLIENT = 0  # 等待空闲asr连接
+SESSION_WAIT_START = 1   # 已发送开始请求, 等待响应
+SESSION_READY = 2        # 可发送音频片段
+SESSION_WAIT_END = 3     # 已发送结束片段, 等待识别结果
+SESSION_DONE = 4         # 结束
+
+# 丢包恢复(FEC/PLC)的最大包数, 超出部分不补偿
+LOST_PACKETS_MAX = 5
+
+
+class AsrSession():
+    """语音识别会话, 对应一个设备的一轮聊天(dev_id, chat_id)
+    """
+    def __init__(self, dev_id, chat_id: int, decoder, vad=None):
+        """
+        Args:
+            dev_id      设备ID
+            chat_id     本轮聊天ID
+            decoder     opus解码器(OpusDecoder)
+            vad         语音活动检测(VoiceActivityDetector), None不检测
+        """
+        self.dev_id = dev_id
+        self.chat_id = chat_id
+        # 每路音频流独立解码器(opus解码有状态)
+        self.decoder = decoder
+        # 最近收到的音频片段序号, 用于检测丢包
+        self.last_seq = -1
+        # 占用的asr客户端
+        self.client = None
+        self.status = SESSION_WAIT_CLIENT
+        # 连接断开后是否需要重新发送开始请求
+        self.re_request = False
+        self.vad = vad
+        # 进行片段缓冲
+        self.audio_buff = FrameBuffer()
+        # 服务就绪前待发送的片段 (audio_bytes, end_seq)
+        self.pending = deque()
+        # 已发送未确认片段的发送时间, 用于计算服务端确认延时
+        self.send_times = deque()
+        # 最近发布的中间识别结果
+        self.partial_text = ''
+        # 本次请求所有音频数据缓冲
+        self.audio_buff_all = bytearray()
+        # 最近活动时间, 用于超时检测
+        self.update_time = time.time()
+
+
+    @property
+    def key(self):
+        return (self.dev_id, self.chat_id)
+
+
 class ASRNode(MqBaseNode):
     """asr节点
+    多会话并发: 每个(dev_id, chat_id)一个会话, 从连接池获取asr连接, 响应处理不阻塞,
+    单个会话响应慢不影响其它设备。
     """
     def __init__(self, config: dict):
         """初始化
@@ -38,13 +98,14 @@ class ASRNode(MqBaseNode):
         # self.keyboard = KBHit()
         self.node_exit = False
 
-        self.asr = VolcASR(config=self.asr_config)
+        # asr连接池, 连接数即最大并发识别数, 保持预热连接减少请求等待
+        self.pool = WsClientPool.from_config(
+            lambda ping_interval: VolcASR(config=self.asr_config, ping_interval=ping_interval),
+            self.asr_config.get('pool', {}))
 
         self.audio_samplerate = self.asr_config['common']['audio']['samplerate']
-        self.decoder = OpusDecoder(samplerate=self.audio_samplerate, channels=1, seq_time=0.02)
-
-        # 进行片段缓冲
-        self.audio_buff = bytearray()  
+        ## opus解码器池, 每路音频流(dev_id, chat_id)一个解码器, 结束后复用
+        self.decoder_pool = OpusDecoderPool(self.audio_samplerate, channels=1, seq_time=0.02)
 
         # 最小片段长度
         # self.audio_seg_min = 640*10
@@ -52,19 +113,33 @@ class ASRNode(MqBaseNode):
         # 一次发送就好(响应速度差不多)
         self.audio_seg_min = 640*200
 
-        self.audio_req_ready = False
+        ## 流式识别: 按小片段(默认200ms)发送音频并发布中间识别结果(asr/partial),
+        ## 片段时长按服务端确认延时自适应; 最终结果仍为服务端对完整音频的识别结果(VOICE_ALL)
+        streaming_config = self.asr_config.get('streaming', {})
+        self.streaming = streaming_config.get('enable', False)
+        self.chunk_time = streaming_config.get('chunk_time', 0.2)
+        self.chunk_time_min = streaming_config.get('chunk_time_min', 0.1)
+        self.chunk_time_max = streaming_config.get('chunk_time_max', 1.0)
+        ## 服务端片段确认延时(s), 指数平均
+        self.ack_latency = None
+
         # 识别有效文本最小长度,小于该值丢弃
         self.valid_text_min = self.asr_config['valid_text_min']
         ## 是否保存音频到本地
         self.save_audio_opus_enable = self.asr_config['save_audio_opus']
         self.save_audio_wav_enable = self.asr_config['save_audio_wav']
-        # 本次请求所有音频数据缓冲
-        self.audio_buff_all = bytearray()  
 
-        ## TODO:默认静音片段去除
+        ## 静音检测: 去除首尾静音, 检测到说话结束时不等待设备结束片段
+        self.vad_config = self.asr_config.get('vad', {})
+        ## 各设备静音检测提前结束的chat_id, 之后收到的该轮音频直接丢弃
+        self.vad_end_chat_ids = {}
 
-        ## 本轮聊天id
-        self.chat_id = 0
+        ## 会话表 (dev_id, chat_id): AsrSession
+        self.sessions = {}
+        ## 等待空闲连接的会话
+        self._wait_client_que = deque()
+        ## 会话无响应超时时间(s)
+        self.session_timeout = self.asr_config.get('session_timeout', 30)
 
     '''
     def keyboard_control(self):
@@ -81,19 +156,21 @@ class ASRNode(MqBaseNode):
     def close(self):
         """关闭节点
         """
-        self.asr.close()
+        self.pool.close()
         self.node_exit = True
         logger.info('app exit')
 
 
-    def create_asr_msg(self, text: str, chat_id: int):
+    def create_asr_msg(self, text: str, chat_id: int, dev_id=None):
         """创建asr识别结果消息(发送至chat节点)
         Args:
             text     聊天响应消息
             chat_id  本轮聊天ID
+            dev_id   设备ID
         """
         data_obj = {
             'node': "asr",
+            'dev_id': dev_id,
             'topic': "asr/response",
             'type': "json",
             'data':{
@@ -104,14 +181,36 @@ class ASRNode(MqBaseNode):
         return data_obj
 
 
-    def create_answer_msg_one(self, text: str, chat_id: int):
+    def create_partial_msg(self, text: str, chat_id: int, dev_id=None):
+        """创建中间识别结果消息(流式识别)
+        Args:
+            text     当前识别文本
+            chat_id  本轮聊天ID
+            dev_id   设备ID
+        """
+        data_obj = {
+            'node': "asr",
+            'dev_id': dev_id,
+            'topic': "asr/partial",
+            'type': "json",
+            'data':{
+                'chat_id': chat_id,
+                'text': text,
+            }    
+        }
+        return data_obj
+
+
+    def create_answer_msg_one(self, text: str, chat_id: int, dev_id=None):
         """创建单条聊天响应消息,用于用户提示(直接发送至tts节点)
         Args:
             text     聊天响应消息
             chat_id  本轮聊天ID
+            dev_id   设备ID
         """
         data_obj = {
             'node': "asr",
+            'dev_id': dev_id,
             'topic': "chat/answer",
             'type': "json",
             'data':{
@@ -139,131 +238,266 @@ class ASRNode(MqBaseNode):
             file.write(opus_bytes)
 
 
-    def handle_execute_error(self):
-        """处理执行错误情况
+    def create_session(self, dev_id, chat_id: int):
+        """创建会话并申请asr连接
+        """
+        vad = None
+        if self.vad_config.get('enable', False):
+            vad = VoiceActivityDetector.from_config(self.audio_samplerate, self.vad_config)
+        session = AsrSession(dev_id, chat_id, self.decoder_pool.acquire((dev_id, chat_id)), vad)
+        self.sessions[session.key] = session
+        session.client = self.pool.acquire()
+        if session.client is None:
+            logger.warning("no idle asr connection, session wait. dev_id: {}, chat_id: {}".format(dev_id, chat_id))
+            self._wait_client_que.append(session.key)
+        else:
+            self.start_request(session)
+        return session
+
+
+    def start_request(self, session: AsrSession):
+        """发送开始请求
         """
-        self.asr.connect_close()
-        self.audio_req_ready = False
+        logger.info("voice start... dev_id: {}, chat_id: {}".format(session.dev_id, session.chat_id))
+        # 丢弃连接上次请求残留的响应
+        while session.client.get_result() is not None:
+            pass
+        session.client.execute_start_req()
+        session.status = SESSION_WAIT_START
 
 
-    def execute(self, seq_id: int, audio_bytes: bytes):
-        """执行ASR,并发布结果
-        TODO: 增加超时机制，处理部分异常情况,如: 
-              1.接收到开始音频信号，却没收到结束音频信号
+    def finish_session(self, session: AsrSession, close=False):
+        """结束会话, 归还asr连接
         Args:
-            seq_id:       音频片段id
-            audio_bytes:  音频片段数据
+            session  会话
+            close    是否关闭连接(异常时使用)
         """
-        wait_start_response = False 
-        wait_end_response = False 
-        wait_midle_response = False 
+        session.status = SESSION_DONE
+        if self.sessions.get(session.key) is session:
+            del self.sessions[session.key]
+            self.decoder_pool.release(session.key)
+        if session.client is not None:
+            self.pool.release(session.client, close)
+            session.client = None
+            self._assign_waiting_sessions()
+
+
+    def _assign_waiting_sessions(self):
+        """为等待中的会话分配空闲连接
+        """
+        while self.pool.idle_count() > 0 and len(self._wait_client_que) > 0:
+            session = self.sessions.get(self._wait_client_que.popleft(), None)
+            if session is None or session.status != SESSION_WAIT_CLIENT:
+                continue
+            session.client = self.pool.acquire()
+            self.start_request(session)
 
-        ## 发送开始请求
-        if seq_id == 0:
-            logger.info("voice start...")
-            self.asr.execute_start_req()
-            self.audio_req_ready = False
-            wait_start_response = True
-
-        ## 等待开始信号
-        if wait_start_response:
-            ## 等待成功请求响应, TODO: 若响应失败会陷入循环
-            re_request = False
-            while True:
-                # print('0000')
-                sleep(0.001)
-                res = self.asr.get_result()
-                if res == None:
-                    continue
-                if 'status' not in res:
-                    logger.warning('asr response invaild.')
-                    self.handle_execute_error()
-                    return
-                if res['status'] == "DISCONNECT":
-                    logger.info('ws already disconnect.')
-                    # 进行自动重连
-                    self.asr.auto_connect()
-                    re_request = True
-                elif res['status'] == "CONNECTED":
-                    if re_request == True: # 再次发送请求
-                        re_request = False
-                        self.asr.execute_start_req()
-                elif res['status'] == "REQ_OK":
-                    logger.info("asr server ready, can start send audio segment.")
-                    # 记录时间
-                    self.audio_req_ready = True
-                    break
-
-        ## 判断是否可以进行音频请求
-        if not self.audio_req_ready:
-            logger.warning("asr server no ready, please ensure start request success.")
+
+    def send_audio(self, session: AsrSession, audio_bytes: bytes, end_seq: bool):
+        """发送音频片段,服务未就绪时缓存
+        Args:
+            session      会话
+            audio_bytes  音频数据(pcm)
+            end_seq      是否为结束片段
+        """
+        if session.status != SESSION_READY:
+            session.pending.append((audio_bytes, end_seq))
             return
+        if end_seq:
+            logger.info("voice end. dev_id: {}, chat_id: {}".format(session.dev_id, session.chat_id))
+            session.status = SESSION_WAIT_END
+        else:
+            logger.debug("voice active...")
+        session.send_times.append(time.time())
+        session.client.execute_audio_req(audio_bytes, end_seq=end_seq)
+
+
+    def segment_length(self):
+        """音频片段发送长度(字节)
+        """
+        if not self.streaming:
+            return self.audio_seg_min
+        return int(self.chunk_time * self.audio_samplerate) * 2
+
+
+    def handle_ack(self, session: AsrSession):
+        """音频片段确认: 统计确认延时, 流式识别时调整片段时长
+        确认延时超过片段时长说明服务端处理不及, 增大片段; 远小于片段时长时减小片段, 降低中间结果延时
+        """
+        if len(session.send_times) == 0:
+            return
+        latency = time.time() - session.send_times.popleft()
+        self.ack_latency = latency if self.ack_latency is None else 0.8 * self.ack_latency + 0.2 * latency
+        if not self.streaming:
+            return
+        if self.ack_latency > self.chunk_time:
+            self.chunk_time = min(self.chunk_time_max, self.chunk_time * 1.5)
+        elif self.ack_latency < self.chunk_time / 2:
+            self.chunk_time = max(self.chunk_time_min, self.chunk_time * 0.9)
+        logger.debug('asr ack latency: {:.3f}s, chunk time: {:.3f}s'.format(self.ack_latency, self.chunk_time))
+
+
+    def handle_result(self, session: AsrSession, res: dict):
+        """处理asr响应
+        """
+        if 'status' not in res:
+            logger.warning('asr response invaild.')
+            self.finish_session(session, close=True)
+            return
+
+        status = res['status']
+        if status == "DISCONNECT":
+            if session.status == SESSION_WAIT_START:
+                logger.info('ws already disconnect.')
+                # 进行自动重连
+                session.client.auto_connect()
+                session.re_request = True
+            else:
+                logger.warning('ws disconnect.')
+                self.finish_session(session)
+        elif status == "CONNECTED":
+            if session.re_request:  # 再次发送请求
+                session.re_request = False
+                session.client.execute_start_req()
+        elif status == "REQ_OK":
+            if session.status == SESSION_WAIT_START:
+                logger.info("asr server ready, can start send audio segment.")
+                session.status = SESSION_READY
+                while len(session.pending) > 0 and session.status == SESSION_READY:
+                    audio_bytes, end_seq = session.pending.popleft()
+                    self.send_audio(session, audio_bytes, end_seq)
+            else:
+                self.handle_ack(session)
+        elif status == "VOICE_PART":
+            logger.debug(res)
+            self.handle_ack(session)
+            text = res['result'][0]['text'] if res.get('result') else ''
+            if self.streaming and len(text) > 0 and text != session.partial_text:
+                ## 发布中间识别结果
+                session.partial_text = text
+                self.auto_send(self.create_partial_msg(text, session.chat_id, session.dev_id))
+        elif status == "VOICE_ALL":
+            text = res['result'][0]['text']
+            logger.info('识别结果: {}'.format(text))
+            if len(text) >= self.valid_text_min:
+                ## 发布语音识别结果
+                self.auto_send(self.create_asr_msg(text, session.chat_id, session.dev_id))
+            else:
+                logger.warning('recognition text too less.')
+                self.auto_send(self.create_answer_msg_one('我没听清,可以再说一遍吗', session.chat_id, session.dev_id))
+            self.finish_session(session)
+        elif status == "VOICE_NOT":
+            logger.warning("no found voice.")
+            # TODO: 判断是否为语音
+            self.auto_send(self.create_answer_msg_one('', session.chat_id, session.dev_id))
+            self.finish_session(session)
+
+
+    def poll_sessions(self):
+        """处理各会话asr响应(非阻塞), 并检测超时
+        TODO: 接收到开始音频信号，却没收到结束音频信号时, 依赖超时结束会话
+        """
+        now = time.time()
+        for session in list(self.sessions.values()):
+            if session.client is not None:
+                while session.status != SESSION_DONE:
+                    res = session.client.get_result()
+                    if res is None:
+                        break
+                    session.update_time = now
+                    self.handle_result(session, res)
+            if session.status != SESSION_DONE and now - session.update_time > self.session_timeout:
+                logger.warning('asr session timeout, dev_id: {}, chat_id: {}'.format(session.dev_id, session.chat_id))
+                self.finish_session(session, close=session.client is not None)
+
+
+    def handle_audio(self, dev_id, chat_id: int, seq_id: int, audio_format: str, samplerate: int, audio_bytes: bytes):
+        """处理一个音频片段: 解码, 缓冲并请求ASR
+        Args:
+            dev_id        设备ID
+            chat_id       本轮聊天ID
+            seq_id        音频片段序号(小于0代表结束)
+            audio_format  音频格式
+            samplerate    采样率
+            audio_bytes   音频片段数据(opus)
+        """
+        logger.debug('receive audio, samplerate: {}, format: {}, len: {}'.format(samplerate, audio_format, len(audio_bytes)))
+        logger.debug("got audio, seq id: {}".format(seq_id))
 
-        ## 发送音频请求
+        session = self.sessions.get((dev_id, chat_id), None)
+        if seq_id == 0:
+            if session is not None:
+                logger.warning('asr session restart, dev_id: {}, chat_id: {}'.format(dev_id, chat_id))
+                self.finish_session(session, close=session.client is not None)
+            session = self.create_session(dev_id, chat_id)
+        elif session is not None and session.vad is not None and session.vad.speech_end:
+            return
+        elif session is None and chat_id <= self.vad_end_chat_ids.get(dev_id, -1):
+            # 静音检测已结束本轮语音
+            return
+        elif session is None:
+            logger.warning('no asr session, dev_id: {}, chat_id: {}, drop audio seq: {}'.format(dev_id, chat_id, seq_id))
+            return
+        session.update_time = time.time()
+
+        ## 2.音频解码, 序号不连续时对丢失的包进行FEC/PLC恢复
+        packets = [audio_bytes]
+        if seq_id > 0 and session.last_seq >= 0 and seq_id > session.last_seq + 1:
+            lost = seq_id - session.last_seq - 1
+            logger.warning('audio packet lost: {}, dev_id: {}, chat_id: {}'.format(lost, dev_id, chat_id))
+            packets = [None] * min(lost, LOST_PACKETS_MAX) + packets
         if seq_id >= 0:
-            logger.debug("voice active...")
-            self.asr.execute_audio_req(audio_bytes, end_seq=False)
-            wait_midle_response = True
-        else :
-            logger.info("voice end.")
-            self.asr.execute_audio_req(audio_bytes, end_seq=True)
-            wait_end_response = True
-
-        ## 中间片段状态响应消息,不处理
-        # TODO: 增加超时退出机制
-        if wait_midle_response:
-            while True:
-                sleep(0.001)
-                res = self.asr.get_result()
-                if res == None:
-                    break
-                if 'status' not in res:
-                    logger.warning('asr response invaild.')
-                    self.handle_execute_error()
-                    return
-                if res['status'] == "DISCONNECT":
-                    logger.warning('ws disconnect.')
-                    self.audio_req_ready = False
-                    break
-
-        ## 等待结束信号
-        if wait_end_response:
-            while True:
-                sleep(0.001)
-                # print(222)
-                ## 等待成功请求响应
-                res = self.asr.get_result()
-                if res is None:
-                    continue
-                if 'status' not in res:
-                    logger.warning('asr response invaild.')
-                    self.handle_execute_error()
-                    return
-                # print(res)
-                if res['status'] == "DISCONNECT":
-                    logger.warning('ws disconnect.')
-                    self.audio_req_ready = False
-                    break
-                if res['status'] == "VOICE_PART":
-                    logger.debug(res)
-                elif res['status'] == "VOICE_ALL":
-                    self.audio_req_ready = False
-                    text = res['result'][0]['text']
-                    logger.info('识别结果: {}'.format(text))
-                    if len(text) >= self.valid_text_min:
-                        ## 发布语音识别结果
-                        self.auto_send(self.create_asr_msg(text, self.chat_id))
-                    else:
-                        logger.warning('recognition text too less.')
-                        self.auto_send(self.create_answer_msg_one('我没听清,可以再说一遍吗', self.chat_id))
-                    break
-                elif res['status'] == "VOICE_NOT":
-                    logger.warning("no found voice.")
-                    # TODO: 判断是否为语音
-                    # self.auto_send(self.create_answer_msg_one('我没听清,可以再说一遍吗', self.chat_id))
-                    self.auto_send(self.create_answer_msg_one('', self.chat_id))
-                    self.audio_req_ready = False
-                    break
+            session.last_seq = seq_id
+        # 解码结果指向解码器内部缓冲区, 下次解码前有效
+        decode_bytes = session.decoder.decode_batch(packets)
+        # logger.debug("decode bytes len: {}".format(len(decode_bytes)))
+        if len(decode_bytes) != 640 * len(packets):
+            logger.warning("decode bytes fail, len: {}".format(len(decode_bytes)))
+
+        ## 3.发送音频请求
+        if session.vad is not None:
+            self.handle_vad(session, decode_bytes, seq_id < 0)
+        elif seq_id == 0:
+            # 首次直接执行ASR请求
+            self.send_audio(session, bytes(decode_bytes), end_seq=False)
+        else:
+            ## 后续请求进行片段缓冲, 减少发送片段，可提高响应速度
+            session.audio_buff.write(decode_bytes)
+            if len(session.audio_buff) >= self.segment_length() or seq_id < 0:
+                self.send_audio(session, session.audio_buff.read(), end_seq=seq_id < 0)
+
+        ## 音频数据保存
+        if self.save_audio_opus_enable:
+            ## 保存文件到本地
+            if audio_format == 'opus':
+                self.save_audio_opus(audio_bytes, seq_id)
+            else:
+                logger.error("invalid format: {}, not support.".format(audio_format))
+            # print(audio_bytes)
+
+        if self.save_audio_wav_enable:
+            session.audio_buff_all.extend(decode_bytes)
+            if seq_id < 0:
+                ac.saveWav('./temp/asr/asr.wav', session.audio_buff_all, samplerate)
+                session.audio_buff_all.clear()
+
+
+    def handle_vad(self, session: AsrSession, pcm: bytes, end_seq: bool):
+        """静音检测后缓冲并请求ASR: 说话开始前的静音不发送, 检测到说话结束时发送结束片段
+        Args:
+            session  会话
+            pcm      解码后的音频
+            end_seq  设备是否已结束发送
+        """
+        session.audio_buff.write(session.vad.process(pcm))
+        if session.vad.speech_end:
+            logger.info("vad speech end. dev_id: {}, chat_id: {}".format(session.dev_id, session.chat_id))
+            self.vad_end_chat_ids[session.dev_id] = session.chat_id
+            end_seq = True
+        elif end_seq:
+            session.audio_buff.write(session.vad.finish())
+        if len(session.audio_buff) >= self.segment_length() or end_seq:
+            self.send_audio(session, session.audio_buff.read(), end_seq=end_seq)
 
 
     def handle_mq_msg(self, msg: dict):
@@ -278,49 +512,24 @@ class ASRNode(MqBaseNode):
                 logger.warning("get data from msg fail. msg: {}", msg)
                 return
 
-            self.chat_id = msg['data']['chat_id']
+            dev_id = msg.get('dev_id', None)
+
+            ## 二进制音频帧, 无需json及base64解码
+            if msg.get('type') == 'binary':
+                frame = unpack_frame(msg['data'])
+                if frame is None:
+                    logger.warning("invalid audio frame, dev_id: {}".format(dev_id))
+                    return
+                self.handle_audio(dev_id, frame['chat_id'], frame['seq_id'], frame['format'], frame['samplerate'], frame['audio'])
+                return
+
+            chat_id = msg['data']['chat_id']
             seq_id = msg['data']['seq_id']
             audio_info = msg['data']['audio']
             # print(audio_info)
-            audio_format = audio_info['format']
-            samplerate = audio_info['samplerate']
             ## 1.音频数据解码(Base64解码)
             audio_bytes = base64.b64decode(audio_info['buff'])
-            logger.debug('receive audio, samplerate: {}, format: {}, len: {}'.format(samplerate, audio_format, len(audio_bytes)))
-            logger.debug("got audio, seq id: {}".format(seq_id))
-
-            ## 2.音频解码
-            decode_bytes = self.decoder.decode(audio_bytes)
-            # logger.debug("decode bytes len: {}".format(len(decode_bytes)))
-            if len(decode_bytes) != 640:
-                logger.warning("decode bytes fail, len: {}".format(len(decode_bytes)))
-
-            ## 3.发送音频请求
-            if seq_id == 0:
-                # 首次直接执行ASR请求
-                self.execute(seq_id, decode_bytes)
-            else:
-                ## 后续请求进行片段缓冲, 减少发送片段，可提高响应速度
-                self.audio_buff.extend(decode_bytes)
-                if len(self.audio_buff) >= self.audio_seg_min or seq_id < 0:
-                    self.execute(seq_id, self.audio_buff)
-                    self.audio_buff.clear()
-
-                        
-            ## 音频数据保存
-            if self.save_audio_opus_enable:
-                ## 保存文件到本地
-                if audio_format == 'opus':
-                    self.save_audio_opus(audio_bytes, seq_id)
-                else:
-                    logger.error("invalid format: {}, not support.".format(audio_format))
-                # print(audio_bytes)
-
-            if self.save_audio_wav_enable:
-                self.audio_buff_all.extend(decode_bytes)
-                if seq_id < 0:
-                    ac.saveWav('./temp/asr/asr.wav', bytes(self.audio_buff_all), samplerate)
-                    self.audio_buff_all.clear()
+            self.handle_audio(dev_id, chat_id, seq_id, audio_info['format'], audio_info['samplerate'], audio_bytes)
 
 
     def launch(self):
@@ -329,18 +538,19 @@ class ASRNode(MqBaseNode):
         ## 启动rabbbitmq传输子线程
         self.transport_start()
 
-        ## 启动asr client
-        self.asr.launch()
+        ## 启动asr client, 收到asr响应时唤醒主循环
+        self.pool.set_receive_notify(self.wakeup)
+        self.pool.launch()
 
         while not self.node_exit:
             # logger.info('asr main loop.')
-            # await asyncio.sleep(0.01)
-            sleep(0.01)
             # self.keyboard_control()
-            ## 获取接收队列数据
-            mq_msg = self.auto_read()
+            ## 等待接收队列数据或asr响应, 超时用于会话超时检测及连接维护
+            mq_msg = self.wait_read(timeout=0.1)
             if mq_msg is not None:
                 self.handle_mq_msg(mq_msg)
+            self.poll_sessions()
+            self.pool.maintain()
 
    
 def main(config: dict):
@@ -27,7 +27,8 @@ from mq_base_node import MqBaseNode, mq_close
 
 class Bridge(MqBaseNode):
     """ws-rabitmq桥接,数据转发
-    TODO: 当前收发消息缓存区共用, 只支持单设备连接, 后续改进根据设备ID区分, 加入多设备支持。
+    多设备支持: 每个ws连接按设备消息中的dev_id绑定会话, 各连接独立发送缓冲区,
+    mq消息根据dev_id发送至对应设备, 无dev_id的消息只有广播主题(ws.broadcast_topics)发送至所有设备, 其余丢弃。
     """
 
     def __init__(self, config: dict):
@@ -51,8 +52,18 @@ class Bridge(MqBaseNode):
         # 队列缓冲区最大长度
         self.ws_que_max_len = self.que_max_len
 
+        # 最大设备连接数
+        self.max_connections = self.ws_config.get('max_connections', 1)
+        # 单个设备消息发送间隔(s), 控制发送频率
+        self.send_interval = self.ws_config.get('send_interval', 0.015)
+        # 无dev_id时发送至所有设备的主题, 其余无dev_id的消息丢弃(避免多设备同时播放)
+        self.broadcast_topics = set(self.ws_config.get('broadcast_topics', []))
+
         # 创建websocket server线程
-        self._ws = WsServer(self.ws_config['url'], self.ws_config['port'], self.que_max_len)
+        self._ws = WsServer(self.ws_config['url'], self.ws_config['port'], self.ws_que_max_len,
+            max_connections=self.max_connections, send_interval=self.send_interval)
+        # 设备消息在ws线程中直接转发至rabbitmq
+        self._ws.set_receive_callback(self._on_ws_message)
         # self.stop_event = threading.Event()
         self._ws_thread = threading.Thread(target=self._ws.run, args=())
         # 发送握手消息
@@ -89,6 +100,51 @@ class Bridge(MqBaseNode):
             return None
 
 
+    def _binary_to_obj(self, conn, msg: bytes):
+        """二进制音频帧转为mq消息,帧数据不做解析直接转发
+        Args:
+            conn  设备连接
+            msg   二进制音频帧
+        Returns:
+            None or data_obj
+        """
+        if conn.dev_id is None:
+            logger.warning('binary frame from unbound connection, drop.')
+            return None
+        data_obj = {
+            'node': self.node_name,
+            'dev_id': conn.dev_id,
+            'topic': 'request/asr',
+            'type': 'binary',
+            'data': msg
+        }
+        return data_obj
+
+
+    def _on_ws_message(self, conn, msg):
+        """ws(设备)消息回调,绑定设备会话并转发至rabitmq(ws线程)
+        Args:
+            conn  设备连接
+            msg   json字符串 or 二进制音频帧
+        """
+        if isinstance(msg, bytes):
+            ws_msg = self._binary_to_obj(conn, msg)
+            if ws_msg is not None:
+                self.auto_send(ws_msg)
+            return
+        ws_msg = self._msg_to_obj(msg)
+        if ws_msg is None:
+            return
+        dev_id = ws_msg.get('dev_id', None)
+        if dev_id is not None:
+            self._ws.bind_session(conn, dev_id)
+        logger.debug("got ws msg from: {} dev_id: {} topic: {}".format(ws_msg['node'], dev_id, ws_msg['topic']))
+        ## 设备取消聊天, 丢弃该连接尚未发送的响应
+        if ws_msg['topic'] == 'request/cancel':
+            conn.send_que.clear()
+        self.auto_send(ws_msg)
+
+
     def launch(self):
         """bridge main run
         """
@@ -99,30 +155,38 @@ class Bridge(MqBaseNode):
         self.transport_start()
 
         while not self.node_exit:
-            sleep(0.005) # 控制发送频率
             # self.keyboard_control()
-            ## 读取ws数据(设备)发送至rabitmq
-            ws_msg = self._ws.auto_read()
-            ws_msg = self._msg_to_obj(ws_msg)
-            if ws_msg is not None:
-                logger.debug("got ws msg from: {} topic: {}".format(ws_msg['node'], ws_msg['topic']))
-                self.auto_send(ws_msg)
-
             ## 读取rabitmq数据发送至ws(设备)
-            mq_msg = self.auto_read()
-            if mq_msg is not None:
-                sleep(0.015) # 控制发送频率
-                logger.debug("got mq msg from: {} topic: {}".format(mq_msg['node'], mq_msg['topic']))
-                ## 检查消息长度是否超出限制范围
-                mq_msg_str = json.dumps(mq_msg)
-                mq_msg_str_length = len(mq_msg_str)
-                # print(mq_msg_str)
-                logger.debug("send to dev, msg length: {}".format(mq_msg_str_length))
-                if mq_msg_str_length > self.dev_receive_length_max:
-                    # logger.info("exception msg : {}.".format(mq_msg_str))
+            mq_msg = self.wait_read(timeout=0.1)
+            if mq_msg is None:
+                continue
+            dev_id = mq_msg.get('dev_id', None)
+            logger.debug("got mq msg from: {} dev_id: {} topic: {}".format(mq_msg['node'], dev_id, mq_msg['topic']))
+            if dev_id is None and mq_msg['topic'] not in self.broadcast_topics:
+                logger.warning("mq msg without dev_id, drop. node: {} topic: {}".format(mq_msg['node'], mq_msg['topic']))
+                continue
+            ## 二进制消息直接以binary帧发送
+            if mq_msg.get('type') == 'binary':
+                if len(mq_msg['data']) > self.dev_receive_length_max:
+                    logger.error("msg length must be less than: {}.".format(self.dev_receive_length_max))
+                else:
+                    self._ws.send_to(dev_id, mq_msg['data'])
+                continue
+            ## 已编码的设备端消息, 不再序列化, 以text帧发送
+            if mq_msg.get('type') == 'wire':
+                if len(mq_msg['data']) > self.dev_receive_length_max:
                     logger.error("msg length must be less than: {}.".format(self.dev_receive_length_max))
                 else:
-                    self._ws.auto_send(mq_msg_str)
+                    self._ws.send_to(dev_id, mq_msg['data'].decode())
+                continue
+            ## 检查消息长度是否超出限制范围
+            mq_msg_str = json.dumps(mq_msg)
+            mq_msg_str_length = len(mq_msg_str)
+            logger.debug("send to dev, msg length: {}".format(mq_msg_str_length))
+            if mq_msg_str_length > self.dev_receive_length_max:
+                logger.error("msg length must be less than: {}.".format(self.dev_receive_length_max))
+            else:
+                self._ws.send_to(dev_id, mq_msg_str)
 
     @mq_close
     def close(self):
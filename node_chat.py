@@ -3,9 +3,7 @@
 import sys
 # import base64
 import json
-from time import sleep
-from collections import deque
-import threading
+import asyncio
 
 #1.日志系统初始化,配置log等级
 from utility import mlogging
@@ -17,6 +15,28 @@ from utility.mlogging import logger
 
 from mq_base_node import MqBaseNode, mq_close
 from chat.openai_chat import OpenAIChat
+from chat.response_cache import normalize_text
+
+
+class Speculation():
+    """推测对话请求: 中间识别结果稳定后提前请求大模型, 最终识别结果一致时确认并发送回答
+    """
+    def __init__(self, dev_id, chat_id: int, text: str, state):
+        """
+        Args:
+            dev_id   设备ID
+            chat_id  聊天ID
+            text     中间识别文本
+            state    解码状态(ChatStreamState)
+        """
+        self.dev_id = dev_id
+        self.chat_id = chat_id
+        self.text = text
+        self.state = state
+        self.task = None
+        # 确认前缓存的回答
+        self.answers = []
+        self.committed = False
 
 
 class ChatNode(MqBaseNode):
@@ -42,10 +62,29 @@ class ChatNode(MqBaseNode):
 
         self.chat = OpenAIChat(self.chat_config)
 
-        ## 本轮聊天ID
-        self.chat_id = 0
-        ## 取消的聊天ID
-        self.cancel_chat_id = -1
+        ## 同时进行的对话请求数
+        self.max_concurrency = self.chat_config['common'].get('max_concurrency', 4)
+        ## 各设备已取消的聊天ID dev_id: chat_id
+        self.cancel_chat_ids = {}
+        ## 进行中的对话任务 (dev_id, chat_id): asyncio.Task
+        self.tasks = {}
+
+        ## 推测请求: asr中间识别结果(asr/partial)稳定stable_time(s)后提前请求大模型
+        speculation_config = self.chat_config['common'].get('speculation', {})
+        self.speculation_enable = speculation_config.get('enable', False)
+        self.speculation_stable_time = speculation_config.get('stable_time', 0.3)
+        ## 各设备进行中的推测请求 dev_id: Speculation
+        self.speculations = {}
+        ## 各设备等待中间结果稳定的定时器 dev_id: asyncio.TimerHandle
+        self._partial_timers = {}
+        ## 推测命中统计
+        self.speculation_hits = 0
+        self.speculation_misses = 0
+
+        # 事件循环及接收队列, 在launch中启动传输线程前创建
+        self._loop = None
+        self._mq_que = None
+        self._semaphore = None
 
     '''
     def keyboard_control(self):
@@ -62,17 +101,21 @@ class ChatNode(MqBaseNode):
     def close(self):
         """关闭节点
         """
+        self.chat.close()
         self.node_exit = True
         logger.info('app exit')
 
     
-    def create_answer_msg(self, msg: dict, chat_id: int):
+    def create_answer_msg(self, msg: dict, chat_id: int, dev_id=None):
         """创建聊天响应消息
         Args:
             msg, 聊天响应消息
+            chat_id  本轮聊天ID
+            dev_id   设备ID
         """
         data_obj = {
             'node': "chat",
+            'dev_id': dev_id,
             'topic': "chat/answer",
             'type': "json",
             'data':{
@@ -84,58 +127,251 @@ class ChatNode(MqBaseNode):
         return data_obj
 
 
+    def _on_receive(self, data_obj: dict):
+        """接收数据转入事件循环队列(传输线程中执行), 事件循环启动前接收的数据在启动后处理
+        """
+        self._loop.call_soon_threadsafe(self._mq_que.put_nowait, data_obj)
+
+
+    def is_canceled(self, dev_id, chat_id: int):
+        """聊天是否已取消
+        """
+        return chat_id <= self.cancel_chat_ids.get(dev_id, -1)
+
+
+    def cancel_chat(self, dev_id, chat_id: int):
+        """取消设备该ID及之前的对话, 进行中的流式请求立即中止
+        Args:
+            dev_id   设备ID
+            chat_id  聊天ID
+        """
+        self.cancel_chat_ids[dev_id] = max(chat_id, self.cancel_chat_ids.get(dev_id, -1))
+        for (task_dev_id, task_chat_id), task in self.tasks.items():
+            if task_dev_id == dev_id and task_chat_id <= chat_id:
+                logger.info('cancel chat task, dev_id: {} chat_id: {}'.format(dev_id, task_chat_id))
+                task.cancel()
+        spec = self.speculations.get(dev_id, None)
+        if spec is not None and spec.chat_id <= chat_id:
+            self.drop_speculation(dev_id)
+
+
+    async def chat_task(self, text: str, dev_id, chat_id: int, stream=True):
+        """单次对话任务, 取消任务时中止流式请求
+        Args:
+            text     用户输入
+            dev_id   设备ID
+            chat_id  聊天ID
+            stream   是否启动流式响应
+        """
+        async with self._semaphore:
+            if self.is_canceled(dev_id, chat_id):
+                return
+            if not stream:
+                answer_msg = await self.chat.get_response_async(text, dev_id)
+                logger.info("{:2} {}".format(answer_msg['seq'], answer_msg['text']))
+                self.auto_send(self.create_answer_msg(answer_msg, chat_id, dev_id))
+                return
+
+            ## 缓存命中时按流式回答相同的方式发送缓存的回答
+            state = self.chat.create_stream_state(dev_id, text)
+            answer = await self.chat.cache_lookup(text, state)
+            if answer is not None:
+                for answer_msg in self.chat.replay_answer(text, answer, state):
+                    logger.info("{:2} {} (cache)".format(answer_msg['seq'], answer_msg['text']))
+                    self.auto_send(self.create_answer_msg(answer_msg, chat_id, dev_id))
+                return
+
+            ## 流式对话
+            response = await self.chat.get_response_stream_async(text, dev_id)
+            try:
+                async for chunk in response:
+                    answer_msg = self.chat.decode_chunk(chunk, state)
+                    if answer_msg is not None:
+                        logger.info("{:2} {}".format(answer_msg['seq'], answer_msg['text']))
+                        self.auto_send(self.create_answer_msg(answer_msg, chat_id, dev_id))
+            finally:
+                # 关闭http连接(任务取消时中止响应流)
+                await response.close()
+
+
+    async def speculate_task(self, spec: Speculation):
+        """推测对话任务, 确认前缓存回答, 确认后直接发送
+        """
+        async with self._semaphore:
+            response = await self.chat.get_response_stream_async(spec.text, spec.dev_id, speculative=True)
+            try:
+                async for chunk in response:
+                    answer_msg = self.chat.decode_chunk(chunk, spec.state)
+                    if answer_msg is None:
+                        continue
+                    if spec.committed:
+                        logger.info("{:2} {}".format(answer_msg['seq'], answer_msg['text']))
+                        self.auto_send(self.create_answer_msg(answer_msg, spec.chat_id, spec.dev_id))
+                    else:
+                        spec.answers.append(answer_msg)
+            finally:
+                await response.close()
+
+
+    def handle_partial(self, dev_id, chat_id: int, text: str):
+        """中间识别结果: 文本变化时取消已过期的推测请求, 重新等待文本稳定
+        """
+        if self.is_canceled(dev_id, chat_id):
+            return
+        spec = self.speculations.get(dev_id, None)
+        if spec is not None and spec.chat_id == chat_id and spec.text == text:
+            return
+        self.drop_speculation(dev_id)
+        self._partial_timers[dev_id] = self._loop.call_later(self.speculation_stable_time,
+            self.start_speculation, dev_id, chat_id, text)
+
+
+    def start_speculation(self, dev_id, chat_id: int, text: str):
+        """中间识别结果已稳定, 开始推测请求
+        设备有进行中的对话(上下文未完成)或回答缓存命中时不推测
+        """
+        self._partial_timers.pop(dev_id, None)
+        if self.is_canceled(dev_id, chat_id) or any(key[0] == dev_id for key in self.tasks):
+            return
+        if self.chat.cache is not None and self.chat.cache.get(text, self.chat.cache_context(dev_id)) is not None:
+            return
+        logger.info('speculate chat, dev_id: {} chat_id: {} text: {}'.format(dev_id, chat_id, text))
+        spec = Speculation(dev_id, chat_id, text, self.chat.create_stream_state(dev_id, text, speculative=True))
+        spec.task = self._loop.create_task(self.speculate_task(spec))
+        spec.task.add_done_callback(lambda task: self._on_task_done((dev_id, chat_id), task))
+        self.speculations[dev_id] = spec
+
+
+    def drop_speculation(self, dev_id):
+        """取消设备未确认的推测请求(记为未命中)及等待中的定时器
+        """
+        timer = self._partial_timers.pop(dev_id, None)
+        if timer is not None:
+            timer.cancel()
+        spec = self.speculations.pop(dev_id, None)
+        if spec is not None:
+            spec.task.cancel()
+            self.record_speculation(False)
+
+
+    def commit_speculation(self, dev_id, chat_id: int, text: str):
+        """最终识别结果与推测文本一致时确认推测请求, 发送已缓存的回答, 否则取消
+        Returns:
+            True 已确认, False 需要重新请求
+        """
+        spec = self.speculations.get(dev_id, None)
+        if spec is None or spec.chat_id != chat_id or normalize_text(spec.text) != normalize_text(text) \
+                or (spec.task.done() and (spec.task.cancelled() or spec.task.exception() is not None)):
+            self.drop_speculation(dev_id)
+            return False
+        del self.speculations[dev_id]
+        self.record_speculation(True)
+        self.chat.commit_speculation(text, spec.state)
+        spec.committed = True
+        for answer_msg in spec.answers:
+            logger.info("{:2} {}".format(answer_msg['seq'], answer_msg['text']))
+            self.auto_send(self.create_answer_msg(answer_msg, chat_id, dev_id))
+        spec.answers.clear()
+        if not spec.task.done():
+            self.tasks[(dev_id, chat_id)] = spec.task
+        return True
+
+
+    def record_speculation(self, hit: bool):
+        """记录推测命中统计
+        """
+        if hit:
+            self.speculation_hits += 1
+        else:
+            self.speculation_misses += 1
+        logger.info('speculation {}, hits: {} misses: {}'.format('hit' if hit else 'miss',
+            self.speculation_hits, self.speculation_misses))
+
+
+    def _on_task_done(self, key, task: asyncio.Task):
+        """对话任务结束
+        """
+        if self.tasks.get(key) is task:
+            del self.tasks[key]
+        if task.cancelled():
+            logger.info('chat task canceled, dev_id: {} chat_id: {}'.format(*key))
+        elif task.exception() is not None:
+            logger.error('chat task fail, dev_id: {} chat_id: {} error: {}'.format(key[0], key[1], task.exception()))
+
+
     def handle_mq_msg(self, msg: dict, stream=True):
-        """mq 消息处理, 根据请求执行相应操作
+        """mq 消息处理, 根据请求执行相应操作(事件循环中执行, 不阻塞)
         Args: 
             msg  从订阅节点接收到的消息
             stream 是否启动流失响应
-        TODO: 增加聊天打断检测
         """
         logger.debug("got mq msg, topic: {}".format(msg['topic']))
         topic = msg['topic']
+        dev_id = msg.get('dev_id', None)
 
         if topic == 'request/cancel':
-            self.cancel_chat_id = msg['data']['chat_id']
-            logger.info('receive cancel signal,current chat_id: {}, cancel chat_id: {}'.format(self.chat_id, self.cancel_chat_id))
+            logger.info('receive cancel signal, dev_id: {}, cancel chat_id: {}'.format(dev_id, msg['data']['chat_id']))
+            self.cancel_chat(dev_id, msg['data']['chat_id'])
 
         elif topic == 'asr/response':
             logger.debug(msg)
             text = msg['data']['text']
-            self.chat_id = msg['data']['chat_id']
+            chat_id = msg['data']['chat_id']
             logger.info('user: {}'.format(text))
 
             ## 判断是否为取消的ID,如果是则不进行chat请求
-            if self.chat_id <= self.cancel_chat_id:
-                logger.info('this chat already cancel, chat_id: {}, cancel chat_id: {}'.format(self.chat_id, self.cancel_chat_id))
+            if self.is_canceled(dev_id, chat_id):
+                logger.info('this chat already cancel, chat_id: {}, cancel chat_id: {}'.format(chat_id, self.cancel_chat_ids[dev_id]))
                 return
 
-            if stream:
-                ## 流式对话
-                reponse = self.chat.get_response_stream(text)
-                for chunk in reponse:
-                    answer_msg = self.chat.decode_chunk(chunk)
-                    if answer_msg is not None:
-                        logger.info("{:2} {}".format(answer_msg['seq'], answer_msg['text']))
-                        self.auto_send(self.create_answer_msg(answer_msg, self.chat_id))
-            else:
-                answer_msg = self.chat.get_response(text)
-                logger.info("{:2} {}".format(answer_msg['seq'], answer_msg['text']))
-                self.auto_send(self.create_answer_msg(answer_msg, self.chat_id))
+            ## 新一轮聊天抢占该设备未完成的旧对话
+            self.cancel_chat(dev_id, chat_id - 1)
+
+            ## 推测请求命中时直接使用其回答
+            if self.speculation_enable and stream and self.commit_speculation(dev_id, chat_id, text):
+                return
+
+            key = (dev_id, chat_id)
+            task = self._loop.create_task(self.chat_task(text, dev_id, chat_id, stream))
+            task.add_done_callback(lambda task: self._on_task_done(key, task))
+            self.tasks[key] = task
+
+        elif topic == 'asr/partial':
+            if self.speculation_enable:
+                self.handle_partial(dev_id, msg['data']['chat_id'], msg['data']['text'])
+
+
+    async def run(self):
+        """事件循环主任务
+        """
+        self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        while not self.node_exit:
+            try:
+                mq_msg = await asyncio.wait_for(self._mq_que.get(), timeout=0.1)
+            except asyncio.TimeoutError:
+                continue
+            self.handle_mq_msg(mq_msg)
+
+        for task in list(self.tasks.values()):
+            task.cancel()
+        for dev_id in list(self.speculations):
+            self.drop_speculation(dev_id)
 
 
     def launch(self):
         """循环任务
         """
+        ## 先创建事件循环及接收队列, 传输线程接收的数据均转入事件循环
+        self._loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self._loop)
+        self._mq_que = asyncio.Queue()
         ## 启动rabitmq transport线程
         self.transport_start()
-
-        while not self.node_exit:
-            sleep(0.001)
-            # self.keyboard_control()
-            ## 读取rabitmq数据
-            mq_msg = self.auto_read()
-            if mq_msg is not None:
-                self.handle_mq_msg(mq_msg)
+        try:
+            self._loop.run_until_complete(self.run())
+        finally:
+            self._loop.run_until_complete(self._loop.shutdown_asyncgens())
+            self._loop.close()
 
 
 def main(config: dict):
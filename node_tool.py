@@ -113,7 +113,7 @@ class ToolNode(MqBaseNode):
                     file_path = './test_output/mic_right.wav'
                 else:
                     file_path = './test_output/mic_left.wav'
-                ac.saveWav(file_path, bytes(self.save_audio_buff), samplerate)
+                ac.saveWav(file_path, self.save_audio_buff, samplerate)
                 logger.info("save wav audio to: {}".format(file_path))
                 self.save_audio_buff.clear()
                         
@@ -125,12 +125,9 @@ class ToolNode(MqBaseNode):
         self.transport_start()
 
         while not self.node_exit:
-            # logger.info('asr main loop.')
-            # await asyncio.sleep(0.01)
-            sleep(0.01)
             self.keyboard_control()
-            ## 获取接收队列数据
-            mq_msg = self.auto_read()
+            ## 等待接收队列数据(超时用于键盘检测)
+            mq_msg = self.wait_read(timeout=0.01)
             if mq_msg is not None:
                 self.handle_mq_msg(mq_msg)
 
@@ -1,7 +1,6 @@
 # coding=utf-8
 # 在线TTS节点
 import sys
-import base64
 import json
 from time import sleep
 
@@ -14,6 +13,13 @@ from utility.mlogging import logger
 # from utility.keyboard import KBHit
 
 from mq_base_node import MqBaseNode, mq_close
+from common.audio_frame import unpack_frame
+from common.ws_pool import WsClientPool
+from audio.opus_encoder import OpusEncoder, OpusFrameBuffer
+from audio.pcm_filter import PcmPostProcessor
+from tts.tts_pipeline import TTSPipeline, SynthesisJob, SegmentFrameBuffer
+from tts.frame_encoder import ResponseFrameEncoder
+from tts.audio_cache import AudioCache
 from tts.volc_tts import VolcTTS
 from tts.xfai_tts import XFaiTTS
 
@@ -40,80 +46,88 @@ class TTSNode(MqBaseNode):
         # self.keyboard = KBHit()
         self.node_exit = False
 
-        # tts实例
-        self.tts = None
+        # tts连接池, 保持预热连接, 避免合成请求等待连接建立
+        tts_class = None
         service = self.tts_config['service']
         if service == 'volc':
-            self.tts = VolcTTS(config=self.tts_config)
+            tts_class = VolcTTS
         elif service == 'xfai':
-            self.tts = XFaiTTS(config=self.tts_config)
+            tts_class = XFaiTTS
         else:
             logger.error('invalid tts service: {}'.format(service))
+        self.pool = WsClientPool.from_config(
+            lambda ping_interval: tts_class(config=self.tts_config, ping_interval=ping_interval),
+            self.tts_config.get('pool', {}))
+        # 默认音色, 及各设备指定的音色 dev_id: voice_type
+        # 连接池中的连接由各设备共用, 任务总是携带音色, 避免使用连接上其它设备设置的音色
+        self.default_voice_type = self.tts_config.get(service, {}).get('voice_type', None)
+        self.voice_types = {}
 
         # 单次TTS请求文本长度限制为 1024 字节(不要超出服务商API要求的限制)
         self._tts_text_bytes_max = 1024
 
-        # 音频数据缓冲区大小(固定,需要和硬件API匹配)
-        self._audio_frame_length = 512
-        self._audio_frame_buff = b''
-
-        # 聊天语句缓冲
-        self.chat_answers = ''
+        # opus输出: 合成的PCM音频转码为opus包发送, 减少下行数据量
+        output_audio_config = self.tts_config['common']['audio']
+        frame_buffer = SegmentFrameBuffer
+        opus_config = self.tts_config['common'].get('opus_output', {})
+        if opus_config.get('enable', False):
+            if self.audio_format != 'raw':
+                logger.error('opus output needs raw tts audio, codec: {}, disable opus output.'.format(self.audio_format))
+            else:
+                output_audio_config = dict(output_audio_config, codec='opus')
+                # 每个设备一个编码器, 各片段音频连续编码
+                frame_buffer = lambda: OpusFrameBuffer(OpusEncoder(self.audio_samplerate, self.audio_channels,
+                    opus_config.get('frame_time', 0.02), bitrate=opus_config.get('bitrate', 24000),
+                    complexity=opus_config.get('complexity', 5)))
+
+        # 合成音频后处理(去除开头静音, 音量调整)
+        audio_filter = None
+        process_config = self.tts_config['common'].get('audio_process', {})
+        if process_config.get('enable', False):
+            if self.audio_format != 'raw':
+                logger.error('audio process needs raw tts audio, codec: {}, disable audio process.'.format(self.audio_format))
+            else:
+                audio_filter = lambda: PcmPostProcessor.from_config(self.audio_samplerate, process_config)
+
+        # 响应消息编码, 音频帧长按设备单次接收的最大消息长度计算(不超过硬件API的帧长512)
+        receive_length_max = config.get('dev', {}).get('receive_length_max', 2048)
+        self.frame_encoder = ResponseFrameEncoder(self.node_name, output_audio_config, receive_length_max)
+        self._audio_frame_length = self.frame_encoder.frame_length
+
+        # 音频缓存, 相同文本及音色不再请求合成
+        self.audio_cache = None
+        cache_config = self.tts_config.get('cache', {})
+        if cache_config.get('enable', False):
+            # 服务商及默认音色影响合成结果, 计入缓存键
+            scope = '{}:{}'.format(service, self.tts_config.get(service, {}).get('voice_type', ''))
+            self.audio_cache = AudioCache.from_config(self.tts_config['common']['audio'], scope, cache_config)
+
+        # 流水线合成, 当前片段发送时后续片段已在其它连接上合成
+        self.pipeline = TTSPipeline(self.pool, self._audio_frame_length, self.send_response_msg,
+            max_ahead=self.tts_config['common'].get('pipeline_depth', 2),
+            timeout=self.tts_config['common'].get('synthesis_timeout', 30),
+            cache=self.audio_cache,
+            frame_buffer=frame_buffer,
+            audio_filter=audio_filter)
+
+        # 各设备聊天语句缓冲 dev_id: str
+        self.chat_answers = {}
         # 前n句直接合成，不等待
         self.direct_n = self.tts_config['common']['direct_n']
 
-        # 本轮聊天ID
-        self.chat_id = 0
-        # 已取消的聊天ID
-        self.cancel_chat_id = -1
+        # 各设备已取消的聊天ID dev_id: chat_id
+        self.cancel_chat_ids = {}
+        # 发送缓冲区中已取消聊天的响应在发送前丢弃
+        self.set_send_filter(self._response_filter)
 
     @mq_close
     def close(self):
         """关闭节点
         """
-        self.tts.close()
+        self.pool.close()
         self.node_exit = True
         logger.info('app exit')
 
-    def create_response_msg(self, chat_id: int, chat_end: int, seg_end: int, text=None, audio=None):
-        """创建响应消息
-        Args:
-            chat_id: 本轮聊天ID
-            chat_end: 1 or 0, 响应完全结束
-            seg_end: 1 or 0, 一段结束
-            text:  本次合成的文本(一次请求的完整文本，并未对应语音片段)
-            audio: 合成的音频数据 
-        Note:
-            确保整体数据包长度不超过硬件设定值,默认(2048)
-        """
-        data_obj = {
-            'node': self.node_name,
-            'topic': "chat/response",
-            'type': "json",
-            'data':{
-                'chat_id': chat_id,  
-                'chat_end': chat_end,  
-                'seg_end': seg_end,  
-            }    
-        }
-        if text is not None:
-            ## TODO: 未防止包大小超出最大值,需要控制text文本长度,需要改为分句发送
-            # data_obj['data']['text'] = text
-            data_obj['data']['text'] = ' '
-        if audio is not None:
-            # 对音频数据进行base64编码
-            audiob64 = base64.b64encode(audio).decode()
-            # print(audiob64)
-            data_obj['data']['audio'] = {
-                "samplerate": self.audio_samplerate,
-                "bits": 16, 
-                "channels": self.audio_channels, 
-                "format": self.audio_format,
-                "buff": audiob64
-            }
-        return data_obj
-
-
     def create_voice_type_msg(self, voice_type: dict):
         """创建voice_type消息
         Args:
@@ -154,179 +168,85 @@ class TTSNode(MqBaseNode):
             self.execute(type['example_text'], type['id'])
 
 
-    def _process_audio_frame(self, audio: bytes, flush=False):
-        """处理音频数据
-        1. 数据帧处理,限制帧长
-        Args:
-            audio:  音频数据 
-            flush:  是否清空缓冲区剩余数据
-        Returns:
-            frames: 音频数据帧列表，含n帧数据
+    def is_canceled(self, dev_id, chat_id: int):
+        """聊天是否已取消
         """
-        frames = []
-        self._audio_frame_buff += audio
+        return chat_id <= self.cancel_chat_ids.get(dev_id, -1)
 
-        # 每次循环处理一帧长度的音频数据
-        while len(self._audio_frame_buff) >= self._audio_frame_length:
-            # 从音频缓冲区中取出一帧长度的数据
-            frame = self._audio_frame_buff[:self._audio_frame_length]
-            frames.append(frame)  # 将取出的帧数据加入帧列表
-            self._audio_frame_buff = self._audio_frame_buff[self._audio_frame_length:]  # 更新音频缓冲区
 
-        if flush and len(self._audio_frame_buff) > 0:
-            # 如果开启了 flush
-            # padding = bytes([0] * (self._audio_frame_length - len(self._audio_frame_buff)))
-            frame = self._audio_frame_buff 
-            frames.append(frame)
-            self._audio_frame_buff = b''  # 清空音频缓冲区
-
-        return frames
+    def _response_filter(self, msg: dict):
+        """发送过滤, 丢弃已取消聊天的响应(传输线程中执行)
+        Returns:
+            True 发送  False 丢弃
+        """
+        if msg.get('topic') != 'chat/response':
+            return True
+        return not self.is_canceled(msg.get('dev_id', None), msg['chat_id'])
 
 
-    def _clear_audio_frame(self):
-        """清空音频缓冲区
+    def cancel_chat(self, dev_id, chat_id: int):
+        """取消聊天, 中止合成中的任务并丢弃未发送的响应
+        Args:
+            dev_id   设备ID
+            chat_id  取消该ID及之前的聊天
         """
-        self._audio_frame_buff = b''
+        self.cancel_chat_ids[dev_id] = max(chat_id, self.cancel_chat_ids.get(dev_id, -1))
+        self.chat_answers.pop(dev_id, None)
+        self.pipeline.cancel(dev_id, chat_id)
 
 
-    def send_response_msg(self, msg: str):
-        """处理和发送TTS响应结果
+    def create_response_msg(self, dev_id, chat_id: int, wire: bytes):
+        """创建响应消息, 消息体为已编码的设备端消息, bridge直接转发
         Args:
-            msg          待发送的消息
+            dev_id   目标设备ID
+            chat_id  本轮聊天ID
+            wire     设备端消息(json文本utf-8字节)
         """
-        ## 如果聊天已经取消,则不发送该消息
-        if self.chat_id <= self.cancel_chat_id:
-            logger.info('this chat already cancel, no send reponse msg, chat_id: {}, cancel chat_id: {}'.format(self.chat_id, self.cancel_chat_id))
-            return
-        self.auto_send(msg)
+        data_obj = {
+            'node': self.node_name,
+            'dev_id': dev_id,
+            'topic': "chat/response",
+            'type': "wire",
+            'chat_id': chat_id,
+            'data': wire
+        }
+        return data_obj
 
 
-    def handle_tts_result(self, text: str, end_sentence):
-        """循环处理TTS响应结果
-           TODO: 增加超时退出
+    def send_response_msg(self, job: SynthesisJob, frames: list):
+        """编码并发送TTS响应音频帧(流水线输出回调)
         Args:
-            text: 合成的文本
-            end_sentence: 是否为尾句
-        Returns:
-            True 合成成功  False合成失败(不重试) 
+            job     所属合成任务
+            frames  [(frame, last)], frame为None时为无音频的结束帧, last为片段尾帧
         """
-        finished = False
-        while not finished:
-            sleep(0.01)  # 等待n ms
-            logger.debug('handle tts result loop.')
-            res = self.tts.get_result()
-            if res is None:
-                continue
-
-            if 'status' not in res:
-                logger.warning('tts response invaild.')
-                self.tts.connect_close()
-                self._clear_audio_frame()
-                return False
-
-            # print(2,res)
-            if res['status'] == 'DISCONNECT':
-                self._clear_audio_frame()
-                # 进行自动重连
-                self.tts.auto_connect()
-                timeout = 10000
-                sleep_time = 0.01
-                sleep_count = 0
-                while True:
-                    sleep(sleep_time)
-                    sleep_count += 1
-                    res = self.tts.get_result()
-                    if res is None:
-                        continue
-                    if res['status'] == "CONNECTED":
-                        logger.info('auto reconnect success.')
-                        break
-                    if sleep_time*sleep_count > timeout:
-                        logger.error('ws auto reconnect fail, timeout.')
-                        return False
-
-            if res['status'] != 'REQ_OK':
-                logger.info('status is not req_ok, is: {}'.format(res['status']))
-                continue
-
-            ret = res['result']
-            logger.info("synthesis bytes: {}".format(ret['seq_size']))
-
-            ## 获取音频帧
-            frames = []
-            if ret['status'] == 0:
-                logger.info("synthesis start...")
-                continue
-                # frames = self._process_audio_frame(ret['data'])
-            elif ret['status'] == 1:  # 合成中间段 
-                frames = self._process_audio_frame(ret['data'])
-
-            elif ret['status'] == 2:   # 合成结束
-                frames = self._process_audio_frame(ret['data'], flush=True)
-                finished = True
-
-            elif ret['status'] == -1:  # 合成失败
-                logger.warning("synthesis fail, clear frame buff.")
-                self._clear_audio_frame()
-                return False
-            logger.info('get audio frames: {}'.format(len(frames)))
-
-            # 发生数据帧时间间隔(ms)  
-            send_dt = 0.005
-            ## 正常结束   
-            if finished: 
-                ## 循环发送数据帧
-                for frame in frames[0:-1]:
-                    msg = self.create_response_msg(self.chat_id, chat_end=0, seg_end = 0, text=text, audio=frame)
-                    self.send_response_msg(msg)
-                    sleep(send_dt)
-                ## 发送尾帧
-                msg = None
-                if end_sentence:  ## 本次聊天结束
-                    msg = self.create_response_msg(self.chat_id, chat_end=1, seg_end = 1, text=text, audio=frames[-1])
-                    # self.tts.connect_close() ## 暂时不关闭,有问题
-                else:  ## 本段结束
-                    msg = self.create_response_msg(self.chat_id, chat_end=0, seg_end = 1, text=text, audio=frames[-1])
-                # 发送帧消息
-                self.send_response_msg(msg)
-                return True
-            else:
-                ## 循环发送数据帧
-                for frame in frames:
-                    msg = self.create_response_msg(self.chat_id, chat_end=0, seg_end = 0, text=text, audio=frame)
-                    self.send_response_msg(msg)
-                    sleep(send_dt)
+        ## 如果聊天已经取消,则不发送该消息
+        if self.is_canceled(job.dev_id, job.chat_id):
+            logger.debug('this chat already cancel, no send reponse msg, chat_id: {}'.format(job.chat_id))
+            return
+        for wire in self.frame_encoder.encode(job.dev_id, job.chat_id, frames, job.end_sentence):
+            self.auto_send(self.create_response_msg(job.dev_id, job.chat_id, wire))
 
 
-    def execute(self, text: str, voice_type=None, operation_type = None, end_sentence = False):
-        """执行TTS,并发布结果
+    def execute(self, text: str, voice_type=None, operation_type = None, end_sentence = False, dev_id=None, chat_id=0):
+        """提交TTS合成任务, 结果在主循环中按顺序发布(不阻塞)
         Args:
             text:  要合成的文本
             voice_type:  要选择的音色
             operation_type   'query' or 'submit' 单次返回或者流式返回 
             end_sentence: 是否为尾句
+            dev_id: 设备ID
+            chat_id: 本轮聊天ID
         """
-        ## 处理空文本转为合法提交,提交合成
-        logger.info('start synthesis: {}'.format(text))
-        if text == '' or text == ' ':
-            logger.info('empty str, return')
-            return
-        # 设置音色        
+        logger.info('submit synthesis: {}'.format(text))
+        # 设置该设备的音色
         if voice_type is not None:
-            self.tts.set_voice_type(voice_type)
+            self.voice_types[dev_id] = voice_type
         # 设置返回方式       
         if operation_type is not None:
-            self.tts.set_operation_type(operation_type)
-
-        # 提交合成
-        self.tts.execute(text)
-
-        # 等待并处理合成结果(阻塞)
-        logger.info('synthesis execute, start handing')
-        ret = self.handle_tts_result(text, end_sentence)
-        if ret == False:  ## 合成失败,放弃这次合成操作
-            logger.warning('synthesis fail.')
-        logger.info('synthesis end.')
+            for client in self.pool.clients:
+                client.set_operation_type(operation_type)
+        job = SynthesisJob(dev_id, chat_id, text, end_sentence=end_sentence, voice_type=self.voice_types.get(dev_id, self.default_voice_type))
+        self.pipeline.submit(job)
 
 
     def handle_mq_msg(self, msg: dict):
@@ -339,52 +259,67 @@ class TTSNode(MqBaseNode):
 
         ## 聊天取消信号
         if msg['topic'] == 'request/cancel':
-            self.cancel_chat_id = msg['data']['chat_id']
-            logger.info('receive cancel signal,chat_id: {}, cancel chat_id: {}'.format(self.chat_id, self.cancel_chat_id))
+            dev_id = msg.get('dev_id', None)
+            logger.info('receive cancel signal, dev_id: {}, cancel chat_id: {}'.format(dev_id, msg['data']['chat_id']))
+            self.cancel_chat(dev_id, msg['data']['chat_id'])
+
+        ## 设备开始语音请求, 预先建立tts连接
+        elif msg['topic'] == 'request/asr':
+            if msg.get('type') == 'binary':
+                frame = unpack_frame(msg['data'])
+                seq_id = frame['seq_id'] if frame is not None else -1
+            else:
+                seq_id = msg['data']['seq_id']
+            if seq_id == 0:
+                self.pool.prewarm(1)
 
         ## 直接请求TTS
         elif msg['topic'] == 'request/tts':
-            self.execute(msg['data']['text'], msg['data']['voice_type'])
+            self.execute(msg['data']['text'], msg['data']['voice_type'], dev_id=msg.get('dev_id', None),
+                chat_id=msg['data'].get('chat_id', 0))
 
         ## 处理聊天响应的文本
         elif msg['topic'] == 'chat/answer':
             answer = msg['data']
             # print(answer)
             answer_text = answer['text']
-            self.chat_id = answer['chat_id']
-            logger.info('------------------current chat_id: {}----------------'.format(self.chat_id))
+            chat_id = answer['chat_id']
+            dev_id = msg.get('dev_id', None)
+            logger.info('------------------dev_id: {} current chat_id: {}----------------'.format(dev_id, chat_id))
 
             ## 如果聊天已经取消,则不进行处理
-            if self.chat_id <= self.cancel_chat_id:
-                logger.info('this chat already cancel, chat_id: {}, cancel chat_id: {}'.format(self.chat_id, self.cancel_chat_id))
+            if self.is_canceled(dev_id, chat_id):
+                logger.info('this chat already cancel, chat_id: {}, cancel chat_id: {}'.format(chat_id, self.cancel_chat_ids[dev_id]))
                 ## 清空对话数据缓存
-                self.chat_answers = ''
-                ## TODO: 有可能已经处于TTS响应循环了，才收到取消指令，这种情况需要处理
+                self.chat_answers.pop(dev_id, None)
                 return
 
+            ## 新一轮聊天抢占该设备未完成的旧聊天
+            if self.pipeline.has_older(dev_id, chat_id):
+                logger.info('new chat preempt, dev_id: {} chat_id: {}'.format(dev_id, chat_id))
+                self.cancel_chat(dev_id, chat_id - 1)
+
             ## 处理请求信息,请求TTS
+            chat_answers = self.chat_answers.get(dev_id, '')
             if answer['seq'] >= 0:
                 # 前n句直接合成
                 if answer['seq'] < self.direct_n:
-                    self.execute(text=answer_text)
+                    self.execute(text=answer_text, dev_id=dev_id, chat_id=chat_id)
                 else:
                     # 若已缓存消息加上新消息后字节数超过最大值，则先请求合成
-                    text_bytes_size = len(self.chat_answers.encode('utf-8')) + len(answer_text.encode('utf-8'))
+                    text_bytes_size = len(chat_answers.encode('utf-8')) + len(answer_text.encode('utf-8'))
                     logger.info('tts text bytes: {}'.format(text_bytes_size))
                     if text_bytes_size > self._tts_text_bytes_max:
-                        self.execute(text=self.chat_answers)
-                        self.chat_answers = ''
+                        self.execute(text=chat_answers, dev_id=dev_id, chat_id=chat_id)
+                        chat_answers = ''
                     # 缓存消息
-                    self.chat_answers += answer_text
+                    chat_answers += answer_text
+                self.chat_answers[dev_id] = chat_answers
 
-            else:  # seq小于0为结束 
-                self.chat_answers += answer_text
-                if self.chat_answers == '':   # 特殊消息直接响应结束,不进行TTS请求
-                    msg = self.create_response_msg(self.chat_id, chat_end=1, seg_end = 1)
-                    self.auto_send(msg)
-                else:
-                    self.execute(text=self.chat_answers, end_sentence=True)
-                self.chat_answers = ''
+            else:  # seq小于0为结束, 文本为空时只按顺序发送结束消息,不进行TTS请求
+                chat_answers += answer_text
+                self.execute(text=chat_answers, end_sentence=True, dev_id=dev_id, chat_id=chat_id)
+                self.chat_answers.pop(dev_id, None)
 
 
     def launch(self):
@@ -393,11 +328,13 @@ class TTSNode(MqBaseNode):
         ## 启动rabbbitmq传输子线程
         self.transport_start()
 
-        ## 启动tts
-        self.tts.launch()
+        ## 启动tts, 收到合成响应时唤醒主循环
+        self.pool.set_receive_notify(self.wakeup)
+        self.pool.launch()
 
         ## 默认设置为流式响应
-        self.tts.set_operation_type(operation_type='submit')
+        for client in self.pool.clients:
+            client.set_operation_type(operation_type='submit')
         # self.execute('这是一段话，用于语音合成测试,1+1=2, 3+3=6', operation_type='submit')
 
         ## 广播音频类型数据
@@ -408,21 +345,23 @@ class TTSNode(MqBaseNode):
 
         while not self.node_exit:
             logger.debug('tts main loop.')
-            # await asyncio.sleep(0.01)
-            sleep(0.01)
             # self.keyboard_control()
-            ## 获取接收队列数据
-            mq_msg = self.auto_read()
+            ## 等待接收队列数据或合成响应, 超时用于合成超时检测及连接维护
+            mq_msg = self.wait_read(timeout=0.1)
             if mq_msg is not None:
                 self.handle_mq_msg(mq_msg)
+            ## 处理合成结果
+            self.pipeline.poll()
+            self.pool.maintain()
 
 
     def test(self):
-        self.tts.execute(' 这是一段话，用于语音合成测试.')
+        tts = self.pool.acquire()
+        tts.execute(' 这是一段话，用于语音合成测试.')
         ## 等待查询合成结果
         while True:
             sleep(0.1)
-            ret = self.tts.get_result()
+            ret = tts.get_result()
             if ret is not None:
                 print(ret['status'])
 
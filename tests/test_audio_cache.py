@@ -0,0 +1,52 @@
+# coding=utf-8
+"""AudioCache 内存层及磁盘层
+"""
+import os
+
+from tts.audio_cache import AudioCache
+
+
+def test_key_depends_on_voice_and_scope():
+    cache = AudioCache('raw', 16000, scope='volc')
+    assert cache.key('你好 ') == cache.key('你好')
+    assert cache.key('你好', 'v1') != cache.key('你好', 'v2')
+    assert cache.key('你好') != AudioCache('raw', 16000, scope='xfai').key('你好')
+    assert cache.key('你好') != AudioCache('opus', 16000, scope='volc').key('你好')
+
+
+def test_memory_lru():
+    cache = AudioCache('raw', 16000, memory_max_bytes=8)
+    cache.put('a', b'1234')
+    cache.put('b', b'5678')
+    cache.get('a')
+    cache.put('c', b'90ab')
+    assert cache.get('b') is None
+    assert cache.get('a') == b'1234'
+    assert cache.memory_bytes == 8
+    # 超出内存上限的音频不缓存
+    cache.put('d', b'0' * 9)
+    assert cache.get('d') is None
+
+
+def test_disk_round_trip_and_limit(tmp_path):
+    path = str(tmp_path / 'audio')
+    cache = AudioCache('raw', 16000, memory_max_bytes=4, disk_path=path, disk_max_bytes=8)
+    cache.put('a', b'1234')
+    cache.put('b', b'5678')
+    cache.put('c', b'90ab')
+    assert not os.path.exists(os.path.join(path, 'a.audio'))
+    # 重启后从磁盘读取
+    cache = AudioCache('raw', 16000, memory_max_bytes=4, disk_path=path, disk_max_bytes=8)
+    assert cache.get('a') is None
+    assert cache.get('b') == b'5678'
+    assert cache.get('c') == b'90ab'
+
+
+def test_empty_disk_file_dropped(tmp_path):
+    path = str(tmp_path / 'audio')
+    cache = AudioCache('raw', 16000, disk_path=path)
+    cache.put('a', b'1234')
+    open(os.path.join(path, 'a.audio'), 'wb').close()
+    cache = AudioCache('raw', 16000, disk_path=path)
+    assert cache.get('a') is None
+    assert 'a' not in cache.disk
@@ -0,0 +1,81 @@
+# coding=utf-8
+"""CodecLane 按提交顺序输出
+"""
+import gzip
+import threading
+
+from common.codec_pool import CodecLane, compress
+
+
+def wait_task(event, value):
+    """等待事件后返回结果, 用于控制任务完成顺序
+    """
+    assert event.wait(5)
+    return value
+
+
+def test_results_in_submit_order():
+    lane = CodecLane(4)
+    events = [threading.Event() for _ in range(3)]
+    for index, event in enumerate(events):
+        lane.submit(wait_task, event, index)
+    # 后提交的任务先完成, 队首未完成时不输出
+    events[2].set()
+    events[1].set()
+    assert lane.get() == (False, None)
+    notified = threading.Event()
+    lane.set_notify(notified.set)
+    events[0].set()
+    assert notified.wait(5)
+    assert [lane.get() for _ in range(4)] == [(True, 0), (True, 1), (True, 2), (False, None)]
+
+
+def test_callbacks_in_submit_order():
+    lane = CodecLane(4)
+    sent = []
+    done = threading.Event()
+    slow = threading.Event()
+    lane.submit(wait_task, slow, 'first', callback=sent.append)
+    lane.submit(str.upper, 'second', callback=sent.append, offload=False)
+    lane.submit(lambda: 'third', callback=lambda result: (sent.append(result), done.set()))
+    assert sent == []
+    slow.set()
+    assert done.wait(5)
+    assert sent == ['first', 'SECOND', 'third']
+
+
+def test_failed_task_skipped():
+    lane = CodecLane(2)
+    lane.submit(lambda: 1 / 0, offload=False)
+    lane.submit(lambda: 'ok', offload=False)
+    assert lane.get() == (True, 'ok')
+
+
+def test_clear_drops_pending_task():
+    lane = CodecLane(2)
+    event = threading.Event()
+    lane.submit(wait_task, event, 'old')
+    lane.clear()
+    lane.submit(lambda: 'new', offload=False)
+    event.set()
+    assert lane.get() == (True, 'new')
+    assert lane.get() == (False, None)
+
+
+def test_compress_level():
+    data = b'abc' * 1000
+    assert compress(data, 0) == data
+    assert gzip.decompress(compress(data, 1)) == data
+
+
+def test_clear_cancels_queued_task():
+    lane = CodecLane(2)
+    # 占满线程池, 之后提交的任务在队列中等待(取消时同步调用完成回调)
+    block = threading.Event()
+    blockers = [lane.executor.submit(block.wait, 5) for _ in range(lane.executor._max_workers)]
+    lane.submit(lambda: 'queued')
+    lane.clear()
+    block.set()
+    for future in blockers:
+        future.result(5)
+    assert lane.get() == (False, None)
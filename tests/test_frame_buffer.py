@@ -0,0 +1,49 @@
+# coding=utf-8
+"""FrameBuffer 分帧及已读数据回收
+"""
+from common.frame_buffer import FrameBuffer
+
+
+def test_frames_keep_remainder():
+    buff = FrameBuffer()
+    buff.write(bytes(range(10)))
+    assert buff.frames(4) == [bytes([0, 1, 2, 3]), bytes([4, 5, 6, 7])]
+    assert len(buff) == 2
+    buff.write(bytes([10, 11]))
+    assert buff.frames(4) == [bytes([8, 9, 10, 11])]
+    assert len(buff) == 0
+
+
+def test_frames_flush_remainder():
+    buff = FrameBuffer()
+    buff.write(b'abcdef')
+    assert buff.frames(4, flush=True) == [b'abcd', b'ef']
+    assert buff.frames(4, flush=True) == []
+
+
+def test_compact_after_half_read():
+    buff = FrameBuffer()
+    buff.write(b'0123456789')
+    # 已读未超过一半, 不前移
+    assert buff.read(4) == b'0123'
+    assert buff._start == 4 and len(buff._buff) == 10
+    # 已读超过一半, 删除已读数据
+    assert buff.read(2) == b'45'
+    assert buff._start == 0 and bytes(buff._buff) == b'6789'
+    # 全部读取后清空
+    assert buff.read() == b'6789'
+    assert buff._start == 0 and len(buff._buff) == 0
+
+
+def test_interleaved_write_read_order():
+    buff = FrameBuffer()
+    data = bytes(i % 256 for i in range(1000))
+    out = b''
+    for i in range(0, len(data), 37):
+        buff.write(data[i:i + 37])
+        out += b''.join(buff.frames(16))
+        # 缓冲区只保留未读数据及不超过一半的已读数据
+        assert len(buff._buff) - buff._start < 16
+        assert buff._start <= len(buff._buff) // 2 or buff._start == 0
+    out += buff.read()
+    assert out == data
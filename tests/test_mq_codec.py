@@ -0,0 +1,36 @@
+# coding=utf-8
+"""MQ消息编解码
+"""
+import pytest
+
+from common.mq_codec import CODECS, JSON_CONTENT_TYPE, MSGPACK_CONTENT_TYPE, get_codec, get_decoder
+
+
+MESSAGE = {
+    'node': 'asr',
+    'dev_id': 'dev-0001',
+    'topic': 'asr/response',
+    'type': 'json',
+    'data': {'chat_id': 3, 'text': '你好', 'seq': -1},
+}
+
+
+@pytest.mark.parametrize('name', sorted(CODECS))
+def test_round_trip(name):
+    codec = get_codec(name)
+    body = codec.encode(MESSAGE)
+    assert get_decoder(codec.content_type).decode(body) == MESSAGE
+
+
+def test_json_content_type_compatible():
+    # 未声明content_type(旧版本节点)时按json解码
+    body = get_codec('json').encode(MESSAGE)
+    assert get_decoder(None).decode(body) == MESSAGE
+    assert get_decoder(JSON_CONTENT_TYPE).decode(body) == MESSAGE
+
+
+def test_unavailable_codec_falls_back_to_json():
+    assert get_codec('unknown').name == 'json'
+    assert get_decoder('text/plain') is None
+    if 'msgpack' not in CODECS:
+        assert get_decoder(MSGPACK_CONTENT_TYPE) is None
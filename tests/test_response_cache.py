@@ -0,0 +1,49 @@
+# coding=utf-8
+"""ResponseCache 精确及语义匹配
+"""
+from chat.response_cache import ResponseCache, EmbeddingIndex, normalize_text
+
+
+def test_normalize_text():
+    assert normalize_text(' 你好，小明！ ') == normalize_text('你好小明')
+    assert normalize_text('Hello, World') == 'helloworld'
+
+
+def test_exact_match_scoped_by_context_and_prompt():
+    cache = ResponseCache('model', 'prompt')
+    cache.put('你好!', '你好呀')
+    assert cache.get('你好') == '你好呀'
+    # 上一轮回答不同(追问), 不命中
+    assert cache.get('你好', context='上一轮回答') is None
+    cache.put('然后呢', '后来他回家了', context='故事开头')
+    assert cache.get('然后呢', context='故事开头') == '后来他回家了'
+    assert cache.get('然后呢', context='另一个故事') is None
+    # 模型或prompt不同, 不命中
+    assert ResponseCache('model', 'other prompt').get('你好') is None
+
+
+def test_lru_and_ttl(monkeypatch):
+    cache = ResponseCache('model', 'prompt', max_entries=2, ttl=10)
+    now = [1000.0]
+    monkeypatch.setattr('chat.response_cache.time.time', lambda: now[0])
+    cache.put('a', '1')
+    cache.put('b', '2')
+    cache.get('a')
+    cache.put('c', '3')
+    assert cache.get('b') is None
+    assert cache.get('a') == '1'
+    now[0] += 11
+    assert cache.get('a') is None
+
+
+def test_embedding_search_scoped_by_prefix(tmp_path):
+    index = EmbeddingIndex(str(tmp_path / 'vectors.npz'), threshold=0.9)
+    cache = ResponseCache('model', 'prompt', index=index)
+    cache.put('讲个笑话', '笑话内容', vector=[1.0, 0.0, 0.0])
+    assert cache.search([0.99, 0.05, 0.0]) == '笑话内容'
+    assert cache.search([0.0, 1.0, 0.0]) is None
+    assert cache.search([0.99, 0.05, 0.0], context='上一轮回答') is None
+    # 保存后重新加载
+    cache.close()
+    index = EmbeddingIndex(str(tmp_path / 'vectors.npz'), threshold=0.9)
+    assert ResponseCache('model', 'prompt', index=index).search([1.0, 0.0, 0.0]) == '笑话内容'
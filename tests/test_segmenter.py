@@ -0,0 +1,70 @@
+# coding=utf-8
+"""Segmenter 增量断句
+"""
+from common.segmenter import Segmenter
+
+
+def feed(segmenter, text, step=1):
+    """逐段输入文本, 返回输出的句子及flush剩余文本
+    """
+    sentences = []
+    for i in range(0, len(text), step):
+        sentence = segmenter.update(text[i:i + step])
+        if sentence is not None:
+            sentences.append(sentence)
+    return sentences, segmenter.flush()
+
+
+def test_cut_at_last_boundary():
+    segmenter = Segmenter(5, 100)
+    sentences, rest = feed(segmenter, "今天天气很好。我们去公园玩吧！好")
+    assert sentences == ["今天天气很好。", "我们去公园玩吧！"]
+    assert rest == "好"
+
+
+def test_decimal_point_not_boundary():
+    segmenter = Segmenter.from_language('zh', 5, 100)
+    sentences, rest = feed(segmenter, "价格是3.5元和12.75元。好")
+    # 只在句号处断句, 不在小数点处断句
+    assert sentences == ["价格是3.5元和12.75元。"]
+    assert rest == "好"
+
+
+def test_trailing_dot_waits_for_next_text():
+    segmenter = Segmenter.from_language('en', 5, 100)
+    # 末尾的'.'可能是小数点, 收到后续文本前不断句
+    assert segmenter.update("It costs 3.") is None
+    assert segmenter.update("5 dollars. Then") == "It costs 3.5 dollars."
+    assert segmenter.flush() == " Then"
+
+
+def test_abbreviations_not_boundary():
+    segmenter = Segmenter.from_language('en', 5, 200)
+    sentences, rest = feed(segmenter, "Dr. Smith met Mr. Jones, e.g. at noon. Bye")
+    assert sentences == ["Dr. Smith met Mr. Jones,", " e.g. at noon."]
+    assert rest == " Bye"
+
+
+def test_force_output_after_threshold_max():
+    segmenter = Segmenter(5, 20)
+    text = "一" * 30
+    sentences, rest = feed(segmenter, text, step=3)
+    # 超过threshold_max后整段输出, 剩余文本由flush输出
+    assert sentences == ["一" * 21]
+    assert rest == "一" * 9
+    assert "".join(sentences) + rest == text
+
+
+def test_flush_resets_state():
+    segmenter = Segmenter(5, 100)
+    segmenter.update("你好。世界")
+    assert segmenter.flush("!") == "你好。世界!"
+    assert segmenter.flush() == ""
+    assert segmenter.update("短") is None
+
+
+def test_full_width_comma_not_boundary():
+    segmenter = Segmenter.from_language('zh', 5, 100)
+    sentences, rest = feed(segmenter, "他发现了一个洞穴，走了进去")
+    assert sentences == []
+    assert rest == "他发现了一个洞穴，走了进去"
@@ -0,0 +1,87 @@
+# coding=utf-8
+"""SessionStore 淘汰及落盘恢复, 上下文窗口
+"""
+import pytest
+
+from chat.session_store import SessionStore, SqliteSpill, FileSpill
+
+
+class CharCounter():
+    """token计数: 每个字符1 token, 每条消息开销0
+    """
+    def count_message(self, msg: dict):
+        return len(msg['content'])
+
+
+@pytest.fixture(params=['sqlite', 'file'])
+def spill(request, tmp_path):
+    if request.param == 'sqlite':
+        spill = SqliteSpill(str(tmp_path / 'sessions.db'))
+    else:
+        spill = FileSpill(str(tmp_path / 'sessions'))
+    yield spill
+    spill.close()
+
+
+def test_evict_least_recently_used():
+    store = SessionStore(CharCounter(), max_sessions=2)
+    store.add_message('a', 'user', 'hi a', 10)
+    store.add_message('b', 'user', 'hi b', 10)
+    store.get('a')
+    store.add_message('c', 'user', 'hi c', 10)
+    assert list(store.sessions) == ['a', 'c']
+
+
+def test_evict_by_bytes():
+    size = len('x' * 100) + 64
+    store = SessionStore(CharCounter(), max_sessions=10, max_bytes=size * 2)
+    for dev_id in ('a', 'b', 'c'):
+        store.add_message(dev_id, 'user', 'x' * 100, 10)
+    assert list(store.sessions) == ['b', 'c']
+    assert store.size == size * 2
+
+
+def test_spill_round_trip(spill):
+    store = SessionStore(CharCounter(), max_sessions=1, spill=spill)
+    store.add_message(1001, 'user', '你好', 10)
+    store.add_message(1001, 'assistant', '你好, 有什么可以帮你?', 10)
+    # 淘汰时落盘, 再次请求时恢复(含token计数)
+    store.add_message(1002, 'user', 'hello', 10)
+    assert list(store.sessions) == [1002]
+    session = store.get(1001)
+    assert session.messages == [
+        {'role': 'user', 'content': '你好'},
+        {'role': 'assistant', 'content': '你好, 有什么可以帮你?'},
+    ]
+    assert session.tokens == 2 + len('你好, 有什么可以帮你?')
+    assert list(store.sessions) == [1001]
+
+
+def test_close_saves_sessions(tmp_path):
+    path = str(tmp_path / 'sessions.db')
+    store = SessionStore(CharCounter(), spill=SqliteSpill(path))
+    store.add_message('dev', 'user', 'remember me', 10)
+    store.close()
+    # 重启后恢复
+    store = SessionStore(CharCounter(), spill=SqliteSpill(path))
+    assert store.get('dev').messages == [{'role': 'user', 'content': 'remember me'}]
+    assert store.get('unknown').messages == []
+    store.close()
+
+
+def test_window_and_token_budget():
+    store = SessionStore(CharCounter())
+    session = store.get('dev')
+    context = session.get_context([{'role': 'system', 'content': 'p'}])
+    for text in ('aaaa', 'bbbb', 'cccc'):
+        store.add_message('dev', 'user', text, window_size=2)
+    assert [msg['content'] for msg in session.messages] == ['bbbb', 'cccc']
+    # 请求消息列表增量维护, 保留prompt
+    assert [msg['content'] for msg in context] == ['p', 'bbbb', 'cccc']
+    store.add_message('dev', 'user', 'dd', window_size=10, token_budget=6)
+    assert [msg['content'] for msg in session.messages] == ['cccc', 'dd']
+    assert session.tokens == 6
+    assert [msg['content'] for msg in context] == ['p', 'cccc', 'dd']
+    # 单条消息超出预算时保留最新一条
+    store.add_message('dev', 'user', 'e' * 10, window_size=10, token_budget=6)
+    assert [msg['content'] for msg in session.messages] == ['e' * 10]
@@ -0,0 +1,149 @@
+# coding=utf-8
+"""TTSPipeline 按提交顺序输出, 取消及抢占
+"""
+from collections import deque
+
+from tts.tts_pipeline import TTSPipeline, SynthesisJob
+
+
+class FakeClient():
+    """合成连接, 由测试写入合成响应
+    """
+    def __init__(self):
+        self.results = deque()
+        self.texts = []
+        self.closed = False
+
+    def get_result(self):
+        return self.results.popleft() if len(self.results) > 0 else None
+
+    def execute(self, text: str):
+        self.texts.append(text)
+
+    def set_voice_type(self, voice_type: str):
+        pass
+
+    def reply(self, audio: bytes, end=False):
+        self.results.append({'status': 'REQ_OK', 'result': {'status': 2 if end else 1, 'data': audio}})
+
+
+class FakePool():
+    def __init__(self, size: int):
+        self.idle = deque(FakeClient() for _ in range(size))
+
+    def acquire(self):
+        return self.idle.popleft() if len(self.idle) > 0 else None
+
+    def release(self, client, close=False):
+        client.closed = close
+        self.idle.append(client)
+
+
+def create_pipeline(size=4, max_ahead=2):
+    output = []
+    pool = FakePool(size)
+    pipeline = TTSPipeline(pool, 4, lambda job, frames: output.extend(
+        (job.dev_id, job.text, frame, last) for frame, last in frames), max_ahead=max_ahead)
+    return pipeline, pool, output
+
+
+def test_output_in_submit_order():
+    pipeline, _, output = create_pipeline()
+    first = SynthesisJob('d1', 1, 'first')
+    second = SynthesisJob('d1', 1, 'second', end_sentence=True)
+    pipeline.submit(first)
+    pipeline.submit(second)
+    pipeline.poll()
+    # 后提交的任务先合成完成, 等待前一任务输出
+    second.client.reply(b'BBBBBB', end=True)
+    pipeline.poll()
+    assert output == []
+    first.client.reply(b'AAAA')
+    pipeline.poll()
+    assert output == [('d1', 'first', b'AAAA', False)]
+    first.client.reply(b'AA', end=True)
+    pipeline.poll()
+    assert output == [
+        ('d1', 'first', b'AAAA', False),
+        ('d1', 'first', b'AA', True),
+        ('d1', 'second', b'BBBB', False),
+        ('d1', 'second', b'BB', True),
+    ]
+    assert pipeline.streams == {}
+    assert pipeline._frame_buffs == {}
+
+
+def test_devices_independent():
+    pipeline, _, output = create_pipeline()
+    slow = SynthesisJob('d1', 1, 'slow', end_sentence=True)
+    fast = SynthesisJob('d2', 1, 'fast', end_sentence=True)
+    pipeline.submit(slow)
+    pipeline.submit(fast)
+    pipeline.poll()
+    fast.client.reply(b'FFFF', end=True)
+    pipeline.poll()
+    assert output == [('d2', 'fast', b'FFFF', True)]
+
+
+def test_max_ahead_limits_running_jobs():
+    pipeline, _, _ = create_pipeline(size=4, max_ahead=2)
+    jobs = [SynthesisJob('d1', 1, str(i)) for i in range(3)]
+    for job in jobs:
+        pipeline.submit(job)
+    pipeline.poll()
+    assert [job.client is not None for job in jobs] == [True, True, False]
+    jobs[0].client.reply(b'', end=True)
+    pipeline.poll()
+    # 队首任务输出后, 下一轮分配连接
+    pipeline.poll()
+    assert jobs[2].client is not None
+
+
+def test_cancel_drops_frames_and_closes_connection():
+    pipeline, _, output = create_pipeline()
+    old = SynthesisJob('d1', 1, 'old')
+    pipeline.submit(old)
+    pipeline.poll()
+    client = old.client
+    client.reply(b'OOOOOO')
+    pipeline.poll()
+    assert output == [('d1', 'old', b'OOOO', False)]
+    assert pipeline.cancel('d1', 1) == 1
+    # 合成中的任务断开连接, 缓冲区剩余音频丢弃
+    assert client.closed
+    assert pipeline.streams == {}
+    assert pipeline._frame_buffs == {}
+    new = SynthesisJob('d1', 2, 'new', end_sentence=True)
+    pipeline.submit(new)
+    pipeline.poll()
+    new.client.reply(b'NN', end=True)
+    pipeline.poll()
+    assert output[1:] == [('d1', 'new', b'NN', True)]
+
+
+def test_preempt_older_chat():
+    pipeline, _, output = create_pipeline()
+    old = SynthesisJob('d1', 1, 'old')
+    pipeline.submit(old)
+    pipeline.poll()
+    # 新一轮聊天到达时取消该设备之前的聊天(node_tts抢占逻辑)
+    assert pipeline.has_older('d1', 2)
+    assert not pipeline.has_older('d1', 1)
+    pipeline.cancel('d1', 1)
+    new = SynthesisJob('d1', 2, 'new', end_sentence=True)
+    pipeline.submit(new)
+    pipeline.poll()
+    new.client.reply(b'NNNN', end=True)
+    pipeline.poll()
+    assert output == [('d1', 'new', b'NNNN', True)]
+
+
+def test_empty_end_sentence_outputs_end_frame():
+    pipeline, _, output = create_pipeline()
+    first = SynthesisJob('d1', 1, 'first')
+    pipeline.submit(first)
+    pipeline.submit(SynthesisJob('d1', 1, '', end_sentence=True))
+    pipeline.poll()
+    first.client.reply(b'AAA', end=True)
+    pipeline.poll()
+    assert output == [('d1', 'first', b'AAA', True), ('d1', '', None, True)]
@@ -0,0 +1,174 @@
+# coding=utf-8
+"""TTS音频缓存
+按(文本, 音色, 编码格式, 采样率)缓存合成的完整音频, 固定提示语、音色示例及重复句子不再请求合成。
+1. 内存层: LRU, 按音频字节数限制
+2. 磁盘层(可选): 每条音频一个文件, 命中后整体读入并提升到内存层, 按修改时间淘汰
+"""
+import os
+import hashlib
+from collections import OrderedDict
+
+from utility.mlogging import logger
+
+
+class AudioCache():
+    """TTS音频缓存
+    Note:
+        非线程安全, 只在tts节点主线程中使用
+    """
+    def __init__(self, codec: str, samplerate: int, scope='', memory_max_bytes=32*1024*1024,
+            disk_path=None, disk_max_bytes=256*1024*1024):
+        """
+        Args:
+            codec             音频编码格式
+            samplerate        采样率
+            scope             其它影响合成结果的参数(如服务商及默认音色), 计入缓存键
+            memory_max_bytes  内存层音频总字节数上限
+            disk_path         磁盘层目录, None不使用磁盘层
+            disk_max_bytes    磁盘层音频总字节数上限
+        """
+        self.codec = codec
+        self.samplerate = samplerate
+        self.scope = scope
+        self.memory_max_bytes = memory_max_bytes
+        self.disk_path = disk_path
+        self.disk_max_bytes = disk_max_bytes
+
+        # key: bytes
+        self.memory = OrderedDict()
+        self.memory_bytes = 0
+        # 磁盘层索引 key: 文件大小, 按使用顺序排列
+        self.disk = OrderedDict()
+        self.disk_bytes = 0
+        if self.disk_path is not None:
+            self._load_disk_index()
+
+        # 命中统计
+        self.hits = 0
+        self.misses = 0
+
+
+    @classmethod
+    def from_config(cls, audio_config: dict, scope: str, config: dict):
+        """根据配置创建缓存
+        Args:
+            audio_config  音频参数 {'codec':, 'samplerate': }
+            scope         其它影响合成结果的参数
+            config        {'memory_max_bytes':, 'disk_path':, 'disk_max_bytes': }
+        """
+        return cls(audio_config['codec'], audio_config['samplerate'], scope,
+            memory_max_bytes=config.get('memory_max_bytes', 32*1024*1024),
+            disk_path=config.get('disk_path', None),
+            disk_max_bytes=config.get('disk_max_bytes', 256*1024*1024))
+
+
+    def key(self, text: str, voice_type=None):
+        """缓存键
+        Args:
+            text        合成文本
+            voice_type  音色, None为默认音色
+        """
+        content = '\0'.join([self.scope, str(voice_type), self.codec, str(self.samplerate), text.strip()])
+        return hashlib.sha1(content.encode('utf-8')).hexdigest()
+
+
+    def get(self, key: str):
+        """查询音频, 磁盘层命中时提升到内存层
+        Returns:
+            None or bytes
+        """
+        audio = self.memory.get(key, None)
+        if audio is not None:
+            self.memory.move_to_end(key)
+        elif key in self.disk:
+            audio = self._read_disk(key)
+            if audio is not None:
+                self._put_memory(key, audio)
+        if audio is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        logger.debug('tts audio cache {}, hits: {} misses: {}'.format('hit' if audio else 'miss', self.hits, self.misses))
+        return audio
+
+
+    def put(self, key: str, audio: bytes):
+        """缓存音频
+        """
+        if len(audio) == 0:
+            return
+        self._put_memory(key, audio)
+        if self.disk_path is not None and key not in self.disk:
+            self._write_disk(key, audio)
+
+
+    def _put_memory(self, key: str, audio: bytes):
+        if len(audio) > self.memory_max_bytes:
+            return
+        if key in self.memory:
+            self.memory_bytes -= len(self.memory.pop(key))
+        self.memory[key] = audio
+        self.memory_bytes += len(audio)
+        while self.memory_bytes > self.memory_max_bytes:
+            _, evicted = self.memory.popitem(last=False)
+            self.memory_bytes -= len(evicted)
+
+
+    def _file(self, key: str):
+        return os.path.join(self.disk_path, key + '.audio')
+
+
+    def _load_disk_index(self):
+        """读取磁盘层已有文件, 按修改时间排序
+        """
+        os.makedirs(self.disk_path, exist_ok=True)
+        files = []
+        for name in os.listdir(self.disk_path):
+            if not name.endswith('.audio'):
+                continue
+            stat = os.stat(os.path.join(self.disk_path, name))
+            files.append((stat.st_mtime, name[:-len('.audio')], stat.st_size))
+        for _, key, size in sorted(files):
+            self.disk[key] = size
+            self.disk_bytes += size
+        logger.info('tts audio cache on disk: {} files, {} bytes'.format(len(self.disk), self.disk_bytes))
+
+
+    def _read_disk(self, key: str):
+        """读取磁盘层音频
+        """
+        try:
+            with open(self._file(key), 'rb') as f:
+                audio = f.read()
+            if len(audio) == 0:
+                raise OSError('empty file')
+        except OSError as e:
+            logger.warning('read tts audio cache fail: {}'.format(e))
+            self.disk_bytes -= self.disk.pop(key)
+            return None
+        # 更新修改时间, 重启后保持使用顺序
+        os.utime(self._file(key))
+        self.disk.move_to_end(key)
+        return audio
+
+
+    def _write_disk(self, key: str, audio: bytes):
+        """写入磁盘层(先写临时文件再重命名), 超出上限时删除最久未使用的文件
+        """
+        file = self._file(key)
+        try:
+            with open(file + '.tmp', 'wb') as f:
+                f.write(audio)
+            os.replace(file + '.tmp', file)
+        except OSError as e:
+            logger.warning('write tts audio cache fail: {}'.format(e))
+            return
+        self.disk[key] = len(audio)
+        self.disk_bytes += len(audio)
+        while self.disk_bytes > self.disk_max_bytes and len(self.disk) > 1:
+            evicted, size = self.disk.popitem(last=False)
+            self.disk_bytes -= size
+            try:
+                os.remove(self._file(evicted))
+            except OSError:
+                pass
@@ -0,0 +1,121 @@
+# coding=utf-8
+"""TTS响应帧编码
+直接生成设备端接收的chat/response消息(json文本的utf-8字节), bridge收到后原样转发, 不再重复序列化。
+同一任务的多个音频帧共用消息模板, 每帧只进行base64编码和字节拼接。
+"""
+import base64
+import json
+
+# 模板中音频数据的占位符
+_AUDIO_PLACEHOLDER = '@@AUDIO@@'
+# 计算帧长时为dev_id预留的长度
+DEV_ID_LENGTH_MAX = 64
+# 计算帧长时chat_id的最大值
+CHAT_ID_MAX = 2**32 - 1
+
+
+class ResponseFrameEncoder():
+    """chat/response消息编码
+    """
+    def __init__(self, node_name: str, audio_config: dict, receive_length_max: int, frame_length_max=512):
+        """
+        Args:
+            node_name           节点名称
+            audio_config        音频参数 {'samplerate':, 'channels':, 'codec': }
+            receive_length_max  设备单次接收的最大消息长度
+            frame_length_max    音频帧长上限(需要和硬件API匹配)
+        """
+        self.node_name = node_name
+        self.audio_info = {
+            "samplerate": audio_config['samplerate'],
+            "bits": 16,
+            "channels": audio_config['channels'],
+            "format": audio_config['codec'],
+        }
+        self.receive_length_max = receive_length_max
+        # 按最长消息头计算帧长, 确保编码后的消息不超出设备接收长度
+        head, tail = self._template('d' * DEV_ID_LENGTH_MAX, CHAT_ID_MAX, 1, 1)
+        fit_length = (receive_length_max - len(head) - len(tail)) // 4 * 3
+        self.frame_length = max(0, min(frame_length_max, fit_length))
+
+
+    def _message(self, dev_id, chat_id: int, chat_end: int, seg_end: int, buff=None):
+        """创建响应消息
+        """
+        data_obj = {
+            'node': self.node_name,
+            'dev_id': dev_id,
+            'topic': "chat/response",
+            'type': "json",
+            'data': {
+                'chat_id': chat_id,
+                'chat_end': chat_end,
+                'seg_end': seg_end,
+            }
+        }
+        # 与原消息格式一致: 音频消息带text字段, 无音频的结束消息不带
+        if buff is not None:
+            ## TODO: 未防止包大小超出最大值,需要控制text文本长度,需要改为分句发送
+            data_obj['data']['text'] = ' '
+            data_obj['data']['audio'] = dict(self.audio_info, buff=buff)
+        return data_obj
+
+
+    def _template(self, dev_id, chat_id: int, chat_end: int, seg_end: int):
+        """创建含音频消息的模板
+        Returns:
+            (head, tail) 音频base64数据前后的消息字节
+        """
+        msg_str = json.dumps(self._message(dev_id, chat_id, chat_end, seg_end, buff=_AUDIO_PLACEHOLDER))
+        head, tail = msg_str.split(_AUDIO_PLACEHOLDER)
+        return head.encode(), tail.encode()
+
+
+    def encode(self, dev_id, chat_id: int, frames, end_sentence=False):
+        """批量编码音频帧
+        Args:
+            dev_id        设备ID
+            chat_id       本轮聊天ID
+            frames        [(frame, last)], frame为None时为无音频的结束消息, last为片段尾帧
+            end_sentence  是否为尾句, 尾句的尾帧标记聊天结束
+        Returns:
+            [bytes] 设备端消息
+        """
+        templates = {}
+        wires = []
+        for frame, last in frames:
+            seg_end = 1 if last else 0
+            chat_end = 1 if last and end_sentence else 0
+            if frame is None:
+                wires.append(json.dumps(self._message(dev_id, chat_id, chat_end, seg_end)).encode())
+                continue
+            template = templates.get(seg_end)
+            if template is None:
+                template = self._template(dev_id, chat_id, chat_end, seg_end)
+                templates[seg_end] = template
+            wires.append(template[0] + base64.b64encode(frame) + template[1])
+        return wires
+
+
+if __name__=='__main__':
+    # 编码性能测试: 16KB音频, 与逐帧创建dict + base64 + json.dumps(mq及bridge两次)对比
+    import os
+    import timeit
+
+    encoder = ResponseFrameEncoder('tts', {'samplerate': 16000, 'channels': 1, 'codec': 'mp3'}, 2048)
+    audio = os.urandom(16 * 1024)
+    frames = [(audio[i:i + encoder.frame_length], False) for i in range(0, len(audio), encoder.frame_length)]
+    frames[-1] = (frames[-1][0], True)
+
+    def encode_per_frame():
+        for frame, last in frames:
+            msg = encoder._message('dev-0001', 12, 0, 1 if last else 0, buff=base64.b64encode(frame).decode())
+            json.dumps({'type': 'object', 'data': msg})
+            json.dumps(msg)
+
+    number = 2000
+    batch_t = timeit.timeit(lambda: encoder.encode('dev-0001', 12, frames), number=number) / number
+    frame_t = timeit.timeit(encode_per_frame, number=number) / number
+    print('frame length: {}  frames: {}'.format(encoder.frame_length, len(frames)))
+    print('batch encoder:  {:8.2f} us / 16KB audio'.format(batch_t * 1e6))
+    print('per frame dict: {:8.2f} us / 16KB audio'.format(frame_t * 1e6))
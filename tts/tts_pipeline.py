@@ -0,0 +1,352 @@
+# coding=utf-8
+"""TTS流水线合成
+当前片段音频帧发送的同时, 使用连接池中的其它连接提前合成后续片段, 各设备音频帧按提交顺序输出
+合成的音频在输出时按顺序写入设备的分帧缓冲区, 转码输出时同一设备的各片段共用一个编码器(连续的音频流)
+"""
+import time
+from collections import deque
+
+from utility.mlogging import logger
+
+from common.frame_buffer import FrameBuffer
+
+
+# 合成任务状态
+JOB_WAIT = 0     # 等待空闲连接
+JOB_RUNNING = 1  # 合成中
+JOB_DONE = 2     # 合成结束(成功或失败)
+
+
+class SegmentFrameBuffer(FrameBuffer):
+    """设备音频流分帧缓冲区(不转码), 片段结束时输出不足一帧的剩余数据
+    接口与OpusFrameBuffer相同(write/frames/clear)
+    """
+    def frames(self, frame_length: int, flush=False, end=False):
+        """读取音频帧
+        Args:
+            frame_length  帧长
+            flush         片段结束, 同时读取剩余不足一帧的数据
+            end           音频流结束(尾句)
+        """
+        return super().frames(frame_length, flush=flush or end)
+
+
+class SynthesisJob():
+    """单个文本片段的合成任务
+    """
+    def __init__(self, dev_id, chat_id: int, text: str, end_sentence=False, voice_type=None):
+        """
+        Args:
+            dev_id        设备ID
+            chat_id       本轮聊天ID
+            text          要合成的文本
+            end_sentence  是否为尾句
+            voice_type    音色, None使用连接当前音色(连接由各设备共用, 可能为其它设备设置的音色)
+        """
+        self.dev_id = dev_id
+        self.chat_id = chat_id
+        self.text = text
+        self.end_sentence = end_sentence
+        self.voice_type = voice_type
+        # 同一设备内的提交序号
+        self.seq = 0
+
+        self.client = None
+        self.status = JOB_WAIT
+        # 合成成功
+        self.success = False
+        # 连接断开后是否需要重新提交请求
+        self.re_request = False
+        # 是否已收到音频数据
+        self.audio_received = False
+        # 待输出的音频数据, 输出时按顺序写入设备分帧缓冲区
+        self._audio = FrameBuffer()
+        # 音频后处理(PcmPostProcessor), None不处理
+        self._audio_filter = None
+        # 音频已全部收到(合成结束或失败)
+        self.audio_end = False
+        # 音频缓存键, 非None时保存完整音频, 合成成功后写入缓存
+        self.cache_key = None
+        self.audio_all = bytearray()
+        # 最近活动时间, 用于超时检测
+        self.update_time = time.time()
+
+
+    def push_audio(self, audio: bytes, flush=False):
+        """写入音频数据
+        Args:
+            audio:  音频数据
+            flush:  片段音频是否结束
+        """
+        if self.cache_key is not None:
+            self.audio_all += audio
+        # 缓存保存合成的原始音频, 命中后同样经过后处理
+        if self._audio_filter is not None:
+            audio = self._audio_filter.process(audio)
+        self._audio.write(audio)
+        if flush:
+            self.audio_end = True
+
+
+    def read_audio(self):
+        """读取待输出的音频数据
+        """
+        return self._audio.read()
+
+
+    def clear_audio(self):
+        """清空音频缓冲区
+        """
+        self._audio.clear()
+        self.audio_all = bytearray()
+
+
+class TTSPipeline():
+    """TTS流水线合成调度
+    1. 每个设备的合成任务按提交顺序排队, 音频帧按顺序输出
+    2. 每个设备最多max_ahead个任务同时合成, 当前任务输出时后续任务已在合成
+    3. 合成结果处理不阻塞, 在节点主循环中调用poll()
+    """
+    def __init__(self, pool, frame_length: int, on_frames, max_ahead=2, timeout=30, cache=None,
+            frame_buffer=SegmentFrameBuffer, audio_filter=None):
+        """
+        Args:
+            pool          tts连接池(WsClientPool)
+            frame_length  音频帧长
+            on_frames     音频帧输出回调 on_frames(job, [(frame, last)]), 每次输出任务当前已有的全部帧
+            max_ahead     每个设备同时合成的任务数
+            timeout       合成无响应超时时间(s)
+            cache         音频缓存(AudioCache), 命中时不请求合成, None不使用
+            frame_buffer  设备分帧缓冲区的创建函数, 每个设备一个, 如转码输出时使用OpusFrameBuffer
+            audio_filter  任务音频后处理的创建函数(如PcmPostProcessor), None不处理
+        """
+        self.pool = pool
+        self.frame_length = frame_length
+        self.frame_buffer = frame_buffer
+        self.audio_filter = audio_filter
+        self.on_frames = on_frames
+        self.max_ahead = max_ahead
+        self.timeout = timeout
+        self.cache = cache
+        # 各设备任务队列 dev_id: deque(SynthesisJob)
+        self.streams = {}
+        # 各设备已提交任务数
+        self._seq_counts = {}
+        # 各设备分帧缓冲区 dev_id: frame_buffer, 尾句输出完成或任务全部取消后删除
+        self._frame_buffs = {}
+
+
+    def submit(self, job: SynthesisJob):
+        """提交合成任务
+        """
+        job.seq = self._seq_counts.get(job.dev_id, 0)
+        self._seq_counts[job.dev_id] = job.seq + 1
+        if self.audio_filter is not None:
+            job._audio_filter = self.audio_filter()
+        ## 空文本不请求合成, 尾句时按顺序输出结束帧
+        if job.text.strip() == '':
+            if not job.end_sentence:
+                return
+            job.status = JOB_DONE
+            job.success = True
+            job.audio_end = True
+        elif self.cache is not None:
+            ## 缓存命中时直接输出音频帧
+            job.cache_key = self.cache.key(job.text, job.voice_type)
+            audio = self.cache.get(job.cache_key)
+            if audio is not None:
+                logger.info('tts audio cache hit, seq: {} text: {}'.format(job.seq, job.text))
+                job.cache_key = None
+                job.push_audio(audio, flush=True)
+                job.status = JOB_DONE
+                job.success = True
+        self.streams.setdefault(job.dev_id, deque()).append(job)
+
+
+    def has_older(self, dev_id, chat_id: int):
+        """设备是否有该聊天ID之前的未完成任务
+        """
+        stream = self.streams.get(dev_id, ())
+        return any(job.chat_id < chat_id for job in stream)
+
+
+    def cancel(self, dev_id, chat_id: int):
+        """取消设备的合成任务, 合成中的任务立即断开连接停止合成, 并丢弃未输出的音频帧
+        Args:
+            dev_id     设备ID
+            chat_id    聊天ID, 取消该ID及之前的任务
+        Returns:
+            取消的任务数
+        """
+        stream = self.streams.get(dev_id, None)
+        if stream is None:
+            # 已输出的片段可能在分帧缓冲区留有剩余音频(等待下一片段)
+            self._frame_buffs.pop(dev_id, None)
+            return 0
+        canceled = [job for job in stream if job.chat_id <= chat_id]
+        if len(canceled) > 0 and canceled[0] is stream[0]:
+            # 正在输出的片段被取消, 丢弃分帧缓冲区数据并重置编码器
+            buff = self._frame_buffs.get(dev_id, None)
+            if buff is not None:
+                buff.clear()
+        for job in canceled:
+            job.clear_audio()
+            if job.status == JOB_RUNNING:
+                # 关闭连接以中止服务端合成, 连接由连接池后台重连
+                self.pool.release(job.client, close=True)
+                job.client = None
+            job.status = JOB_DONE
+            stream.remove(job)
+        if len(stream) == 0:
+            del self.streams[dev_id]
+            self._frame_buffs.pop(dev_id, None)
+        if len(canceled) > 0:
+            logger.info('cancel synthesis, dev_id: {} chat_id: {} jobs: {}'.format(dev_id, chat_id, len(canceled)))
+        return len(canceled)
+
+
+    def poll(self):
+        """分配连接, 处理合成结果并按顺序输出音频帧(非阻塞)
+        """
+        self._dispatch()
+        now = time.time()
+        for stream in self.streams.values():
+            for job in stream:
+                if job.status != JOB_RUNNING:
+                    continue
+                while job.status == JOB_RUNNING:
+                    res = job.client.get_result()
+                    if res is None:
+                        break
+                    job.update_time = now
+                    self._handle_result(job, res)
+                if job.status == JOB_RUNNING and now - job.update_time > self.timeout:
+                    logger.warning('synthesis timeout, seq: {}'.format(job.seq))
+                    self._finish(job, False)
+        self._output()
+
+
+    def _dispatch(self):
+        """为各设备前max_ahead个等待中的任务分配连接
+        """
+        for stream in self.streams.values():
+            for index in range(min(self.max_ahead, len(stream))):
+                job = stream[index]
+                if job.status != JOB_WAIT:
+                    continue
+                client = self.pool.acquire()
+                if client is None:
+                    return
+                self._start(job, client)
+
+
+    def _start(self, job: SynthesisJob, client):
+        """提交合成请求
+        """
+        logger.info('start synthesis, seq: {} text: {}'.format(job.seq, job.text))
+        # 丢弃连接上的残留响应(如预热连接状态)
+        while client.get_result() is not None:
+            pass
+        if job.voice_type is not None:
+            client.set_voice_type(job.voice_type)
+        job.client = client
+        job.status = JOB_RUNNING
+        job.update_time = time.time()
+        client.execute(job.text)
+
+
+    def _finish(self, job: SynthesisJob, success: bool):
+        """结束任务, 归还连接
+        """
+        if not success:
+            logger.warning('synthesis fail, seq: {}'.format(job.seq))
+            job.push_audio(b'', flush=True)
+        job.success = success
+        job.status = JOB_DONE
+        if success and job.cache_key is not None:
+            self.cache.put(job.cache_key, bytes(job.audio_all))
+        job.audio_all = bytearray()
+        if job.client is not None:
+            self.pool.release(job.client, close=not success)
+            job.client = None
+
+
+    def _handle_result(self, job: SynthesisJob, res: dict):
+        """处理合成响应
+        """
+        if 'status' not in res:
+            logger.warning('tts response invaild.')
+            self._finish(job, False)
+            return
+
+        if res['status'] == 'DISCONNECT':
+            if job.audio_received:
+                # 已输出部分音频, 不再重新合成
+                self._finish(job, False)
+                return
+            # 进行自动重连, 连接成功后重新提交
+            logger.info('ws disconnect, reconnect and retry.')
+            job.client.auto_connect()
+            job.re_request = True
+            return
+
+        if res['status'] == 'CONNECTED':
+            if job.re_request:
+                job.re_request = False
+                job.client.execute(job.text)
+            return
+
+        if res['status'] != 'REQ_OK':
+            logger.info('status is not req_ok, is: {}'.format(res['status']))
+            return
+
+        ret = res['result']
+        if ret is None:
+            return
+        logger.debug("synthesis bytes: {}".format(ret.get('seq_size', 0)))
+
+        status = ret.get('status', None)
+        if status == 0:
+            logger.info("synthesis start...")
+        elif status == 1:  # 合成中间段
+            job.audio_received = True
+            job.push_audio(ret['data'])
+        elif status == 2:   # 合成结束
+            job.audio_received = True
+            job.push_audio(ret['data'], flush=True)
+            self._finish(job, True)
+        elif status == -1:  # 合成失败
+            self._finish(job, False)
+
+
+    def _output(self):
+        """按提交顺序输出各设备音频帧, 队首任务结束后输出下一任务
+        片段结束时输出缓冲区中的全部帧并标记尾帧(转码时不足一个包的音频留给下一片段), 尾句结束时音频流结束,
+        此时设备无后续任务则删除其分帧缓冲区
+        """
+        for dev_id in list(self.streams.keys()):
+            stream = self.streams[dev_id]
+            buff = self._frame_buffs.get(dev_id, None)
+            if buff is None:
+                buff = self.frame_buffer()
+                self._frame_buffs[dev_id] = buff
+            while len(stream) > 0:
+                job = stream[0]
+                buff.write(job.read_audio())
+                frames = [(frame, False) for frame in buff.frames(self.frame_length, flush=job.audio_end,
+                    end=job.audio_end and job.end_sentence)]
+                if job.audio_end:
+                    ## 标记尾帧, 无音频时输出结束帧
+                    if len(frames) > 0:
+                        frames[-1] = (frames[-1][0], True)
+                    else:
+                        frames.append((None, True))
+                if len(frames) > 0:
+                    self.on_frames(job, frames)
+                if job.status != JOB_DONE:
+                    break
+                stream.popleft()
+            if len(stream) == 0:
+                del self.streams[dev_id]
+                if job.end_sentence:
+                    del self._frame_buffs[dev_id]
@@ -6,10 +6,11 @@ from utility.mlogging import logger
 class VolcTTS(VolcTTSClient):
     """火山引擎TTS
     """
-    def __init__(self, config: dict):
+    def __init__(self, config: dict, ping_interval=0):
         """
         Args:
             config: tts配置参数
+            ping_interval: 连接健康检测间隔(s), 由连接池配置
         """
         self.config = config
 
@@ -28,5 +29,5 @@ class VolcTTS(VolcTTSClient):
             logger.error('get cluster from env fail.')
             exit(1)
 
-        super().__init__(appid=appid, token=token, cluster=cluster, config=self.config)
+        super().__init__(appid=appid, token=token, cluster=cluster, config=self.config, ping_interval=ping_interval)
         logger.info('tts client initialize.')
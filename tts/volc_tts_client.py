@@ -1,6 +1,5 @@
 #coding=utf-8
 # import os
-from time import sleep
 import json
 import uuid
 import json
@@ -14,6 +13,7 @@ from tornado.httpclient import HTTPRequest
 from utility.mlogging import logger
 
 from common.ws_client import WsClient
+from common.codec_pool import CodecLane, compress, INLINE_MAX_BYTES
 from common.ws_enum_types import WsEnumTypes
 
 
@@ -123,10 +123,11 @@ def parse_response(res):
 class VolcTTSClient():
     """Volc语音合成, websocket接口
     """
-    def __init__(self, appid, token, cluster, config: dict):
+    def __init__(self, appid, token, cluster, config: dict, ping_interval=0):
         """
         Args:
             config:  tts配置参数
+            ping_interval: 连接健康检测(ping)间隔(s), 0不检测
         """
         self.config = config
         self.audio_config = config['common']['audio']
@@ -148,19 +149,29 @@ class VolcTTSClient():
         # reserved data: 0x00 (1 byte)
         self.default_header = bytearray(b'\x11\x10\x11\x00')
 
+        # 请求压缩等级 1-9, 0不压缩(如局域网部署)
+        self.compression_level = int(self.config['volc'].get('compression_level', 1))
+        if self.compression_level == 0:
+            # message compression: b0000 (none)
+            self.default_header[2] = 0x10
+        # 请求编码及响应解码在共享线程池中执行, 按顺序发送请求及读取响应
+        codec_workers = int(self.config['volc'].get('codec_workers', 2))
+        self._send_lane = CodecLane(codec_workers)
+        self._receive_lane = CodecLane(codec_workers)
+
         # 保存当前合成结果
         # self._result_que = deque()
 
         # 关于连接建立:
         # SDK说明，多次合成需要建立多次连接，但有时连接通道建立较慢,非常影响整体效果。
         # 实测: 单次连接也可以多次合成，但服务器可能会主动关闭连接
-        # TODO: 加入空闲检测机制，空闲自动断开连接, 在收到合成请求(预请求)后及时重连
+        # 空闲检测、预连接及断开重连由连接池(common.ws_pool.WsClientPool)实现
 
         # self.ws = create_connection(self.api_url, header=ws_header, timeout=600)
         header = {"Authorization": f"Bearer; {self.token}"}
         request = HTTPRequest(url=self.api_url, headers=header)
         # request = HTTPRequest(url="ws://192.168.3.104:9001/linker-dev")
-        self._ws = WsClient(request)
+        self._ws = WsClient(request, ping_interval=ping_interval)
         # 线程退出控制信号
         # self.ws_stop_event = threading.Event()
         # 创建ws子线程, 默认不连接
@@ -175,10 +186,7 @@ class VolcTTSClient():
         """等待ws客户端连接完成
         """
         while True:
-            sleep(0.01) 
-            res = self._ws.auto_read()
-            if res is None:
-                continue
+            res = self._ws.read()
             if res['status'] == WsEnumTypes.STATUS_CONNECTED:
                 break
 
@@ -275,15 +283,21 @@ class VolcTTSClient():
         submit_request_json["request"]["operation"] = self.operation_type
         submit_request_json["request"]["silence_duration"] = self.silence_duration
 
-        payload_bytes = str.encode(json.dumps(submit_request_json))
-        payload_bytes = gzip.compress(payload_bytes)  # if no compression, comment this line
+        # 请求数据量小, 在调用线程编码, 经CodecLane保持与其它请求的顺序
+        self._send_lane.submit(self._pack_request, submit_request_json, callback=self._ws.auto_send, offload=False)
+
+
+    def _pack_request(self, submit_request_json: dict):
+        """序列化并压缩合成请求
+        """
+        payload_bytes = compress(str.encode(json.dumps(submit_request_json)), self.compression_level)
         full_client_request = bytearray(self.default_header)
         full_client_request.extend((len(payload_bytes)).to_bytes(4, 'big'))  # payload size(4 bytes)
         full_client_request.extend(payload_bytes)  # payload
 
         full_client_request = bytes(full_client_request)
-        self._ws.auto_send(full_client_request)
         logger.debug('auto send full client request: {}'.format(full_client_request))
+        return full_client_request
       
 
     def get_result(self):
@@ -306,9 +320,18 @@ class VolcTTSClient():
                     }
             }
         """
-        res = self._ws.auto_read()
-        if res is None:
+        ## 接收到的消息按顺序提交解码, 压缩的较大响应(错误及前端消息)在线程池中解压
+        while True:
+            res = self._ws.auto_read()
+            if res is None:
+                break
+            offload = res['status'] == WsEnumTypes.STATUS_MSG_OK and (res['msg'][2] & 0x0f) == 1 \
+                and len(res['msg']) > INLINE_MAX_BYTES
+            self._receive_lane.submit(self._parse_message, res, offload=offload)
+        ready, item = self._receive_lane.get()
+        if not ready:
             return None
+        res, msg = item
         result = {}
         result['result'] = None
         # print(1, res)
@@ -321,8 +344,6 @@ class VolcTTSClient():
             return result
         elif res['status'] == WsEnumTypes.STATUS_MSG_OK:
             result['status'] = "REQ_OK"
-            msg = res['msg']
-            msg = parse_response(msg)
             # print('tts reuslt:', msg)
             result['result'] = msg
             return result
@@ -331,15 +352,61 @@ class VolcTTSClient():
         return None
 
 
+    @staticmethod
+    def _parse_message(res: dict):
+        """解码响应消息
+        Returns:
+            (res, 解码结果)
+        """
+        if res['status'] != WsEnumTypes.STATUS_MSG_OK:
+            return res, None
+        return res, parse_response(res['msg'])
+
+
     def auto_connect(self):
-        """客户端自动连接
+        """客户端自动连接, 丢弃上一连接未输出的编解码结果
         Returns:
         """
+        self._clear_lanes()
         self._ws.auto_connect()
 
 
     def connect_close(self):
-        """ws关闭连接
+        """ws关闭连接, 丢弃未输出的编解码结果(连接池复用时不串到下一任务)
         """
+        self._clear_lanes()
         self._ws.connect_close()
 
+
+    def _clear_lanes(self):
+        """丢弃未发送的请求及未读取的响应
+        """
+        self._send_lane.clear()
+        self._receive_lane.clear()
+
+
+    def set_receive_notify(self, callback):
+        """设置接收通知, 收到响应及线程池解码完成时调用
+        Args:
+            callback  无参数回调, 在ws线程或编解码线程中执行
+        """
+        self._ws.set_receive_notify(callback)
+        self._receive_lane.set_notify(callback)
+
+
+    def is_connected(self):
+        """ws是否已连接
+        """
+        return self._ws.is_connected()
+
+
+    def is_connecting(self):
+        """ws是否正在连接
+        """
+        return self._ws.is_connecting()
+
+
+    def idle_time(self):
+        """ws连接空闲时长(s)
+        """
+        return self._ws.idle_time()
@@ -7,10 +7,11 @@ from utility.mlogging import logger
 class XFaiTTS(XFAiTTSClient):
     """科大讯飞TTS
     """
-    def __init__(self, config: dict):
+    def __init__(self, config: dict, ping_interval=0):
         """
         Args:
             config: tts配置参数
+            ping_interval: 连接健康检测间隔(s), 由连接池配置
         """
         self.config = config
 
@@ -22,5 +23,5 @@ class XFaiTTS(XFAiTTSClient):
         api_secret = api_key.split('--')[1]
         api_key = api_key.split('--')[2]
 
-        super().__init__(appid=appid, api_secret=api_secret, api_key=api_key, config=self.config)
+        super().__init__(appid=appid, api_secret=api_secret, api_key=api_key, config=self.config, ping_interval=ping_interval)
         logger.info('tts client initialize.')
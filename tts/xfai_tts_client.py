@@ -1,6 +1,5 @@
 #coding=utf-8
 # import os
-from time import sleep
 import json
 import json
 
@@ -82,13 +81,14 @@ def parse_response(res):
 class XFAiTTSClient():
     """科大讯飞语音合成, websocket接口
     """
-    def __init__(self, appid, api_secret, api_key, config: dict):
+    def __init__(self, appid, api_secret, api_key, config: dict, ping_interval=0):
         """
         Args:
             appid:      app id
             api_secret: api secret
             api_key:    api key
             config:  tts配置参数
+            ping_interval: 连接健康检测(ping)间隔(s), 0不检测
         """
         self.config = config
         self.audio_config = config['common']['audio']
@@ -118,8 +118,8 @@ class XFAiTTSClient():
         # header = {"Authorization": f"Bearer; {self.token}"}
         # request = HTTPRequest(url=self.api_url, headers=header)
 
-        request_url = self._create_request_url()
-        self._ws = WsClient(request_url)
+        # url签名有时效, 每次连接(含连接池后台重连)时重新生成
+        self._ws = WsClient(self._create_request_url, ping_interval=ping_interval)
 
         # 线程退出控制信号
         # self.ws_stop_event = threading.Event()
@@ -135,10 +135,7 @@ class XFAiTTSClient():
         """等待ws客户端连接完成
         """
         while True:
-            sleep(0.01) 
-            res = self._ws.auto_read()
-            if res is None:
-                continue
+            res = self._ws.read()
             if res['status'] == WsEnumTypes.STATUS_CONNECTED:
                 break
 
@@ -321,3 +318,29 @@ class XFAiTTSClient():
         """ws关闭连接
         """
         self._ws.connect_close()
+
+
+    def set_receive_notify(self, callback):
+        """设置接收通知, 收到响应时调用
+        Args:
+            callback  无参数回调, 在ws线程中执行
+        """
+        self._ws.set_receive_notify(callback)
+
+
+    def is_connected(self):
+        """ws是否已连接
+        """
+        return self._ws.is_connected()
+
+
+    def is_connecting(self):
+        """ws是否正在连接
+        """
+        return self._ws.is_connecting()
+
+
+    def idle_time(self):
+        """ws连接空闲时长(s)
+        """
+        return self._ws.idle_time()